@@ -0,0 +1,68 @@
+import asyncio
+import contextlib
+from PDBTools import pdblib
+
+
+"""
+asyncio versions of download_pdb, for programs that run an event loop. The blocking download (or local file read)
+and the parsing of the structure are both run in an executor, so the event loop is never stalled, and downloads
+of some files overlap with parsing of others. Local files are found in the same way as download_pdb (uppercase
+and then lowercase <ID>.pdb in the current folder).
+"""
+
+async def fetch_structure(pdb_id, mapped=False, semaphore=None, executor=None):
+    """Reads a local PDB file, or downloads it if there is no local copy, and parses its structure, without blocking
+    the event loop
+    Inputs:
+    pdb_id - PDB ID (type string)
+    mapped - if True, the file is memory-mapped, as in download_pdb (type bool)
+    semaphore - if given, only this many files are read or downloaded at the same time (type asyncio.Semaphore)
+    executor - executor to run the download and parsing in (the event loop's default executor if None)
+    Outputs:
+    Contents of file corresponding to PDB ID if found, with its structure already parsed (type PDBLines or MappedLines)
+    Name of file found locally/name of file downloaded, extension excluded (type string)
+    Both are returned as a tuple, the same as download_pdb"""
+    loop = asyncio.get_running_loop()
+    # Only hold the semaphore while reading or downloading, so parsing does not stop other downloads starting
+    async with (semaphore if semaphore is not None else contextlib.nullcontext()):
+        (lines, pdb_id) = await loop.run_in_executor(executor, pdblib.download_pdb, pdb_id, mapped)
+    # If the file could not be downloaded, there is nothing to parse
+    if lines == []:
+        return (lines, pdb_id)
+    # Parse the structure, which is kept with the lines for later queries
+    await loop.run_in_executor(executor, pdblib.get_structure, lines)
+    return (lines, pdb_id)
+
+async def fetch_structures(pdb_ids, concurrency=8, mapped=False, executor=None):
+    """Reads or downloads many PDB files and parses their structures, at most concurrency files at a time, yielding
+    each one as soon as it is ready (so they may not be in the order given). Use with async for.
+    Inputs:
+    pdb_ids - PDB IDs (list of strings)
+    concurrency - number of files read or downloaded at the same time (type int)
+    mapped - if True, files are memory-mapped, as in download_pdb (type bool)
+    executor - executor to run the downloads and parsing in (the event loop's default executor if None)
+    Output:
+    (PDB ID asked for, contents of file, name of file or error message) for each PDB ID; the contents are an empty
+    list if the file could not be read, downloaded or parsed, and the error message says why, as in the results of
+    download_many (yielded tuples)"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(pdb_id):
+        # An error for one PDB ID (e.g. a lost connection or an unreadable file) is yielded as its result, so it
+        # does not end the loop and cancel every other download
+        try:
+            (lines, found_id) = await fetch_structure(pdb_id, mapped, semaphore, executor)
+        except Exception as error:
+            return (pdb_id, [], "{0}: {1}".format(type(error).__name__, error))
+        if lines == []:
+            return (pdb_id, lines, "The file could not be downloaded")
+        return (pdb_id, lines, found_id)
+
+    tasks = [asyncio.ensure_future(fetch_one(pdb_id)) for pdb_id in pdb_ids]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    # If the caller stops early, do not leave the remaining downloads running
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,370 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import traceback
+from PDBTools import pdblib
+from PDBTools import pdbprofile
+
+
+"""
+Non-interactive batch mode for checkPDB.py. Each of the eight menu options is a subcommand that is run for every
+PDB ID given on the command line or in an IDs file, with the IDs split across a pool of worker processes. Files are
+read from (and written to) the current folder, exactly as in the interactive menu. Messages printed by pdblib for each
+ID are collected, and a summary of the IDs that succeeded and failed (with their errors) is printed at the end, and
+can be saved as JSON.
+
+Examples:
+./checkPDB.py fasta --ids-file ids.txt --chains all --jobs 16
+./checkPDB.py residues 1HIV 1C6Y --chains A
+./checkPDB.py rename --ids-file ids.txt --map A:B,B:A --in-place
+./checkPDB.py plot --ids-file ids.txt --chains A --height 6 --width 4 --summary plot_summary.json
+./checkPDB.py fasta --ids-file ids.txt --profile
+./checkPDB.py lines 1HIV --select "resname HIS and resseq 10:50 and name CA"
+./checkPDB.py scan mirror/ --output nonstandard.csv --jobs 16
+./checkPDB.py index mirror/ --database pdb.sqlite
+./checkPDB.py query --database pdb.sqlite --ligand HEM --chain A
+"""
+
+# Detail options of the interactive menu, by name, and the line pattern for each detail
+DETAILS = {"header": "HEADER", "title": "TITLE", "source": "SOURCE", "keywords": "KEYWDS", "authors": "AUTHOR",
+           "resolution": "REMARK   2 RESOLUTION.", "journal": "JRNL        TITL"}
+
+def _chains(chains, lines, selection=None):
+    """Returns the chain IDs asked for, or every chain with protein or non-protein residues if asked for all
+    Inputs:
+    chains - 'all', or chain IDs separated by commas (type string)
+    lines - file contents of pdb file (list of string lines)
+    selection - selection string; if given, all only includes the chains with selected atoms (type string)
+    Output:
+    Chain IDs (list of strings)"""
+    if chains == "all":
+        structure = pdblib.get_structure(lines)
+        if selection is None:
+            return structure.chain_ids()
+        selected = set(structure.chain[structure.selection_rows(selection)].tolist())
+        return [chain_id for chain_id in structure.chain_ids() if chain_id in selected]
+    return [chain_id.strip() for chain_id in chains.split(",")]
+
+def op_download(options, lines, pdb_id):
+    """Option 1: only reads the local file or downloads it"""
+    return True
+
+def op_details(options, lines, pdb_id):
+    """Option 2: prints the chosen details"""
+    pdblib.print_details({DETAILS[name]: "" for name in options.details.split(",")}, lines)
+    return True
+
+def op_residues(options, lines, pdb_id):
+    """Option 3: prints the protein residues of each chain"""
+    found = False
+    for chain_id in _chains(options.chains, lines, options.select):
+        print("{0}:".format(chain_id))
+        # The residues printed are returned, so they are only found once
+        found = (pdblib.print_prot_residues(chain_id, lines, options.select) != "") or found
+    return found
+
+def op_fasta(options, lines, pdb_id):
+    """Option 4: writes the protein residues of the chains to <ID>.fasta (or <ID>_<chain>.fasta for one chain)"""
+    chain_ids = [""] if options.chains == "all" else _chains(options.chains, lines, options.select)
+    written = False
+    for chain_id in chain_ids:
+        filename = pdb_id + ("_" + chain_id if chain_id != "" else "")
+        written = pdblib.get_fasta_protseqs(filename, chain_id, lines, selection=options.select) or written
+    return written
+
+def op_lines(options, lines, pdb_id):
+    """Option 5: writes the residue lines of each chain to <ID>_<chain>.txt"""
+    written = False
+    for chain_id in _chains(options.chains, lines, options.select):
+        filename = "{0}_{1}".format(pdb_id, chain_id)
+        written = pdblib.get_chain_residues(chain_id, options.record, filename, "w", lines, options.select) or written
+    return written
+
+def _mapping(options):
+    """Returns the chain IDs to alter, from --map (old:new pairs separated by commas) or --old and --new
+    Input:
+    options - parsed command line options
+    Output:
+    New chain ID for each old chain ID (dictionary of string: string)"""
+    if options.map is not None:
+        return dict(pair.strip().split(":", 1) for pair in options.map.split(","))
+    return {options.old: options.new}
+
+def op_rename(options, lines, pdb_id):
+    """Option 6: alters chain IDs, writing the altered file to <ID>_<new chains>.pdb, or altering the local file
+    itself with --in-place"""
+    mapping = _mapping(options)
+    if options.in_place:
+        (filename, local_id) = pdblib.find_local_pdb(pdb_id)
+        if filename is None:
+            raise FileNotFoundError("--in-place needs a local file for {0}".format(pdb_id))
+        return pdblib.remap_chains_in_place(mapping, filename) > 0
+    (new_lines, new_id) = pdblib.remap_chains(mapping, lines, pdb_id)
+    return new_id != pdb_id
+
+def op_nonstandard(options, lines, pdb_id):
+    """Option 7: prints any non-standard protein residues"""
+    pdblib.print_nonstandard_residues(lines)
+    return True
+
+def op_plot(options, lines, pdb_id):
+    """Option 8: plots the temperature factor of each chain to <ID>_<chain>_tempfact.png"""
+    written = False
+    for chain_id in _chains(options.chains, lines, options.select):
+        filename = "{0}_{1}_tempfact".format(pdb_id, chain_id)
+        written = pdblib.plot_temp_factor(chain_id, options.height, options.width, filename, lines, pdb_id, options.per_residue, options.max_points, options.select) or written
+    return written
+
+# Function for each subcommand, and whether its printed messages are its result (and so are printed for each ID)
+OPERATIONS = {"download": (op_download, False), "details": (op_details, True), "residues": (op_residues, True),
+              "fasta": (op_fasta, False), "lines": (op_lines, False), "rename": (op_rename, False),
+              "nonstandard": (op_nonstandard, True), "plot": (op_plot, False)}
+
+def run_one(task):
+    """Runs one operation for one PDB ID in a worker process, collecting everything it prints
+    Input:
+    task - (options, PDB ID) (type tuple)
+    Output:
+    Result with the keys id, ok, output, error and profile (the calls recorded by pdbprofile) (type dictionary)"""
+    (options, pdb_id) = task
+    output = io.StringIO()
+    result = {"id": pdb_id, "ok": False, "output": "", "error": ""}
+    # Workers record the calls they make if profiling was asked for, so the main process can add them up
+    if options.profile:
+        pdbprofile.enable()
+    try:
+        with contextlib.redirect_stdout(output), pdbprofile.collect() as recorded:
+            (lines, found_id) = pdblib.download_pdb(pdb_id, options.mapped)
+            if lines == []:
+                result["error"] = "The file could not be found or downloaded."
+            else:
+                function = OPERATIONS[options.command][0]
+                result["ok"] = bool(function(options, lines, found_id))
+                if not result["ok"]:
+                    result["error"] = "Nothing was found for the options given."
+    except Exception as error:
+        result["error"] = traceback.format_exception_only(error)[-1].strip()
+    result["output"] = output.getvalue()
+    result["profile"] = recorded
+    return result
+
+def read_ids(options):
+    """Returns the PDB IDs given on the command line and in the IDs file, without repeats, in the order given
+    Input:
+    options - parsed command line options
+    Output:
+    PDB IDs (list of strings)"""
+    pdb_ids = list(options.ids)
+    if options.ids_file is not None:
+        with open(options.ids_file, 'r') as fobject:
+            for line in fobject:
+                # IDs may be separated by spaces or commas, and # starts a comment
+                line = line.split("#")[0]
+                pdb_ids += line.replace(",", " ").split()
+    return list(dict.fromkeys(pdb_ids))
+
+def run_batch(options):
+    """Runs the chosen operation for every PDB ID across a pool of worker processes, then prints a summary
+    Input:
+    options - parsed command line options
+    Output:
+    Results for each PDB ID, in the order given (list of dictionaries)"""
+    pdb_ids = read_ids(options)
+    tasks = [(options, pdb_id) for pdb_id in pdb_ids]
+    jobs = max(1, min(options.jobs, len(tasks)))
+    # Small chunks keep the workers evenly busy; one worker runs in this process to avoid starting a pool
+    if jobs == 1:
+        results = [run_one(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            results = pool.map(run_one, tasks, chunksize=max(1, len(tasks) // (jobs * 8)))
+    # Calls recorded in this process have already been added up, but those of worker processes have not
+    for result in results:
+        recorded = result.pop("profile")
+        if options.profile and (jobs > 1):
+            pdbprofile.merge(recorded)
+    print_output = OPERATIONS[options.command][1]
+    for result in results:
+        if print_output and result["ok"]:
+            print("== {0} ==".format(result["id"]))
+            print(result["output"].rstrip("\n"))
+    failed = [result for result in results if not result["ok"]]
+    print("{0} of {1} PDB IDs succeeded for {2}.".format(len(results) - len(failed), len(results), options.command))
+    for result in failed:
+        print("{0} failed: {1}".format(result["id"], result["error"]))
+    if options.summary is not None:
+        with open(options.summary, 'w') as fobject:
+            json.dump({"command": options.command, "succeeded": len(results) - len(failed), "failed": len(failed),
+                       "results": results}, fobject, indent=1)
+    return results
+
+def build_parser():
+    """Returns the command line parser, with one subcommand for each menu option"""
+    parser = argparse.ArgumentParser(prog="checkPDB.py", description="Run a checkPDB.py menu option over many PDB IDs without prompts. Run with no arguments for the interactive menu.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("ids", nargs="*", help="PDB IDs to use")
+    common.add_argument("--ids-file", help="file of PDB IDs, separated by spaces, commas or newlines")
+    common.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes (default: number of CPUs)")
+    common.add_argument("--summary", help="file to save the results for every PDB ID to, as JSON")
+    common.add_argument("--mapped", action="store_true", help="memory-map files instead of reading them whole")
+    common.add_argument("--profile", action="store_true", help="time every call to pdblib, and print the times, bytes read and written and cache hits at the end")
+    chains = argparse.ArgumentParser(add_help=False)
+    chains.add_argument("--chains", default="all", help="'all', or chain IDs separated by commas (default: all)")
+    chains.add_argument("--select", help="only use the atoms matching a selection, e.g. \"resname HIS and resseq 10:50 and name CA\"")
+    subparsers.add_parser("download", parents=[common], help="1 - read the local PDB file or download it")
+    details = subparsers.add_parser("details", parents=[common], help="2 - print details")
+    details.add_argument("--details", default=",".join(DETAILS.keys()), help="details to print, separated by commas, from: " + ", ".join(DETAILS.keys()))
+    subparsers.add_parser("residues", parents=[common, chains], help="3 - print protein residues of chains")
+    subparsers.add_parser("fasta", parents=[common, chains], help="4 - write protein residues to <ID>.fasta")
+    lines = subparsers.add_parser("lines", parents=[common, chains], help="5 - write residue lines of chains to <ID>_<chain>.txt")
+    lines.add_argument("--record", default="both", help="ATOM, HETATM, or anything else for both (default: both)")
+    rename = subparsers.add_parser("rename", parents=[common], help="6 - alter chain IDs, writing <ID>_<new>.pdb")
+    rename.add_argument("--old", help="chain ID to alter")
+    rename.add_argument("--new", help="chain ID to replace it with")
+    rename.add_argument("--map", help="chain IDs to alter at once, as old:new pairs separated by commas (e.g. A:B,B:A)")
+    rename.add_argument("--in-place", action="store_true", help="alter the local PDB file itself instead of writing a new file")
+    subparsers.add_parser("nonstandard", parents=[common], help="7 - print non-standard protein residues")
+    plot = subparsers.add_parser("plot", parents=[common, chains], help="8 - plot temperature factors to <ID>_<chain>_tempfact.png")
+    plot.add_argument("--height", default="6", help="height of the plot in inches (default: 6)")
+    plot.add_argument("--width", default="4", help="width of the plot in inches (default: 4)")
+    plot.add_argument("--per-residue", action="store_true", help="plot the mean temperature factor of each residue instead of each atom")
+    plot.add_argument("--max-points", type=int, help="largest number of points to draw, keeping the lowest and highest of each run of atoms (default: 4 for each pixel across)")
+    scan = subparsers.add_parser("scan", help="count non-standard protein residues of every PDB file of a folder or tar file")
+    scan.add_argument("source", help="folder (searched recursively), tar file or PDB file to scan")
+    scan.add_argument("--output", help="CSV or JSONL file to write the result of each file to as it is scanned")
+    scan.add_argument("--format", choices=("csv", "jsonl"), help="format of the output (default: from its extension, csv unless .jsonl)")
+    scan.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes (default: number of CPUs)")
+    scan.add_argument("--hetatm", action="store_true", help="also count the residues of HETATM records other than water (e.g. MSE)")
+    scan.add_argument("--profile", action="store_true", help="time every call to pdblib, and print the times and bytes read at the end")
+    index = subparsers.add_parser("index", help="index the PDB files of a folder in a SQLite database, reading only new or changed files")
+    index.add_argument("source", help="folder of PDB files to index (searched recursively)")
+    index.add_argument("--database", default="pdbindex.sqlite", help="SQLite database to create or update (default: pdbindex.sqlite)")
+    index.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes (default: number of CPUs)")
+    index.add_argument("--keep-removed", action="store_true", help="keep files that no longer exist in the index")
+    query = subparsers.add_parser("query", help="answer a question from a database made with index, without reading any PDB file")
+    query.add_argument("--database", default="pdbindex.sqlite", help="SQLite database made with index (default: pdbindex.sqlite)")
+    question = query.add_mutually_exclusive_group(required=True)
+    question.add_argument("--ligand", help="entries with a HETATM residue of this name (e.g. HEM)")
+    question.add_argument("--motif", help="chains whose protein sequence contains these 1-letter residues")
+    question.add_argument("--search", help="entries with a detail containing some text, as detail:text (e.g. title:protease)")
+    question.add_argument("--entry", help="everything held for one PDB ID")
+    query.add_argument("--chain", help="with --ligand, only this chain")
+    query.add_argument("--regex", action="store_true", help="with --motif, the motif is a regular expression")
+    return parser
+
+def run_index(options):
+    """Indexes a folder of PDB files, then prints a summary
+    Input:
+    options - parsed command line options
+    Output:
+    Summary of the update (type dictionary)"""
+    # pdbindex and pdbscan are only imported by the subcommands that use them, so the other subcommands start faster
+    from PDBTools import pdbindex
+    with pdbindex.StructureIndex(options.database) as index:
+        summary = index.update(options.source, max(1, options.jobs), not options.keep_removed)
+    print("{0} files found: {1} indexed, {2} unchanged, {3} removed, {4} could not be read. The index is in {5}".format(
+          summary["files"], summary["indexed"], summary["unchanged"], summary["removed"], summary["failed"], options.database))
+    return summary
+
+def run_query(options):
+    """Answers one question from an index, printing one line for each result
+    Input:
+    options - parsed command line options
+    Output:
+    Number of results (type int)"""
+    from PDBTools import pdbindex
+    with pdbindex.StructureIndex(options.database) as index:
+        if options.ligand is not None:
+            rows = ["{0} {1}: {2}".format(pdb_id, chain_id, residues) for (pdb_id, chain_id, residues) in index.find_ligand(options.ligand, options.chain)]
+        elif options.motif is not None:
+            rows = ["{0} {1}: {2}".format(pdb_id, chain_id, position) for (pdb_id, chain_id, position) in index.find_motif(options.motif, options.regex)]
+        elif options.search is not None:
+            (field, colon, text) = options.search.partition(":")
+            rows = index.search(field, text)
+        else:
+            entry = index.get_entry(options.entry)
+            rows = [] if entry is None else [json.dumps(entry, indent=1)]
+    for row in rows:
+        print(row)
+    if rows == []:
+        print("Nothing was found in {0}.".format(options.database))
+    return len(rows)
+
+def run_scan(options):
+    """Scans a corpus for non-standard protein residues, then prints a summary
+    Input:
+    options - parsed command line options
+    Output:
+    Summary of the scan (type dictionary)"""
+    from PDBTools import pdbscan
+    records = ("ATOM", "HETATM") if options.hetatm else ("ATOM",)
+    summary = pdbscan.scan_corpus(options.source, options.output, options.format, max(1, options.jobs), records)
+    print("{0} files scanned ({1} could not be read), {2} residues counted, {3} files with non-standard residues.".format(
+          summary["files"], summary["failed"], summary["residues"], summary["files_with_nonstandard"]))
+    for (code, count) in list(summary["codes"].items())[:20]:
+        print("{0}: {1}".format(code, count))
+    if options.output is not None:
+        print("The result of each file is in {0}".format(options.output))
+    return summary
+
+def main(argv=None):
+    """Runs the batch mode with the given command line arguments
+    Input:
+    argv - command line arguments, excluding the program name (sys.argv[1:] if None) (list of strings)
+    Output:
+    Exit status: 0 if every PDB ID succeeded, 1 otherwise (type int)"""
+    parser = build_parser()
+    options = parser.parse_args(argv)
+    if options.command == "index":
+        if not os.path.isdir(options.source):
+            parser.error("{0} is not a folder".format(options.source))
+        summary = run_index(options)
+        return 0 if summary["failed"] == 0 else 1
+    if options.command == "query":
+        if not os.path.isfile(options.database):
+            parser.error("{0} does not exist; make it with the index subcommand".format(options.database))
+        if (options.search is not None) and (":" not in options.search):
+            from PDBTools import pdbindex
+            parser.error("--search must be detail:text, where detail is one of: " + ", ".join(pdbindex.DETAIL_FIELDS))
+        return 0 if run_query(options) > 0 else 1
+    if options.command == "scan":
+        if not os.path.exists(options.source):
+            parser.error("{0} does not exist".format(options.source))
+        if options.profile:
+            pdbprofile.enable()
+        summary = run_scan(options)
+        if options.profile:
+            pdbprofile.report()
+        return 0 if summary["failed"] == 0 else 1
+    if options.command == "details":
+        unknown = [name for name in options.details.split(",") if name not in DETAILS]
+        if unknown != []:
+            parser.error("unknown details: " + ", ".join(unknown))
+    if options.command == "rename":
+        if (options.map is None) and ((options.old is None) or (options.new is None)):
+            parser.error("rename needs --map, or both --old and --new")
+        if (options.map is not None) and any(":" not in pair for pair in options.map.split(",")):
+            parser.error("--map must be old:new pairs separated by commas")
+    if (options.command == "plot") and (options.max_points is not None) and (options.max_points < 2):
+        parser.error("--max-points must be at least 2")
+    if getattr(options, "select", None) is not None:
+        try:
+            pdblib.compile_selection(options.select)
+        except pdblib.SelectionError as error:
+            parser.error(str(error))
+    if (options.ids == []) and (options.ids_file is None):
+        parser.error("no PDB IDs were given")
+    if options.profile:
+        pdbprofile.enable()
+    results = run_batch(options)
+    if options.profile:
+        pdbprofile.report()
+    return 0 if all(result["ok"] for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
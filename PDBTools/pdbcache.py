@@ -0,0 +1,218 @@
+import gzip
+import os
+import tempfile
+import threading
+import time
+import contextlib
+
+
+"""
+On-disk cache of downloaded PDB files, shared by every program (and every working directory) that uses the same
+cache folder. Files are stored gzip-compressed as <ID>.pdb.gz, written to a temporary file and renamed into place
+so that workers running at the same time never see a partly written entry, and the least recently used entries are
+removed when the cache grows past its size limit or entries have not been used for longer than its age limit.
+
+The cache is off unless configure() is called, or the PDBTOOLS_CACHE_DIR environment variable is set, in which case
+download_pdb (and so get_chain_residues when reading) and download_many go through it.
+"""
+
+# Extension of cached files
+CACHE_EXTENSION = ".pdb.gz"
+# File creation mask of the process, read once (it can only be read by setting it), so that cached files get the
+# same permissions as any other new file rather than the owner-only permissions of temporary files
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+class StructureCache:
+    """Size- and age-bounded cache of gzip-compressed PDB files in one folder, with least recently used eviction.
+    The modification time of each file is used as the time it was last used, so it is updated on every hit.
+    Attributes:
+    directory - folder holding the cached files (type string)
+    max_bytes - largest total size of the cached files in bytes, or None for no limit (type int)
+    max_age - seconds after its last use that an entry is removed, or None for no limit (type float)
+    hits, misses, stores, evictions - counts of cache lookups found and not found, files stored and files removed
+    by this process (type int)"""
+
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        """Creates the cache folder if it does not exist
+        Inputs:
+        directory - folder to keep the cached files in (type string)
+        max_bytes - largest total size of the cached files in bytes, or None for no limit (type int)
+        max_age - seconds after its last use that an entry is removed, or None for no limit (type float)"""
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, pdb_id):
+        """Returns the name of the cached file for a PDB ID (whether or not it is in the cache)
+        Input:
+        pdb_id - PDB ID (type string)
+        Output:
+        Name of the cached file (type string)"""
+        return os.path.join(self.directory, pdb_id.upper() + CACHE_EXTENSION)
+
+    def _count(self, counter):
+        """Adds one to one of the statistics counters, as downloads may use the cache from several threads"""
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def contains(self, pdb_id):
+        """Returns True if the PDB ID is in the cache, False otherwise (does not count as a hit or miss)"""
+        return os.path.isfile(self.path(pdb_id))
+
+    def lookup(self, pdb_id):
+        """Returns the name of the cached file for a PDB ID if it is in the cache, marking it as recently used
+        Input:
+        pdb_id - PDB ID (type string)
+        Output:
+        Name of the cached file, or None if the PDB ID is not in the cache (type string)"""
+        filename = self.path(pdb_id)
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return filename
+
+    def get(self, pdb_id):
+        """Returns the contents of a cached PDB file, marking it as recently used
+        Input:
+        pdb_id - PDB ID (type string)
+        Output:
+        Contents of the file, or None if the PDB ID is not in the cache (type string)"""
+        filename = self.path(pdb_id)
+        try:
+            with gzip.open(filename, 'rt') as fobject:
+                contents = fobject.read()
+            os.utime(filename)
+        # The entry may not exist, or may have been removed by another worker since it was found
+        except (FileNotFoundError, EOFError, gzip.BadGzipFile):
+            self._count("misses")
+            return None
+        self._count("hits")
+        return contents
+
+    @contextlib.contextmanager
+    def open_writer(self, pdb_id, evict=True):
+        """Opens a new cache entry for writing, as a binary file that is compressed as it is written. The entry only
+        appears in the cache once the with block finishes without an error; otherwise nothing is stored.
+        Inputs:
+        pdb_id - PDB ID (type string)
+        evict - if True, old entries are evicted once the entry is stored; if False, the caller evicts them later,
+        e.g. once a batch of downloads has finished (type bool)
+        Output:
+        File object to write the uncompressed contents to (yielded)"""
+        (handle, temp_filename) = tempfile.mkstemp(dir=self.directory, prefix=".tmp-", suffix=CACHE_EXTENSION)
+        try:
+            with os.fdopen(handle, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as fobject:
+                yield fobject
+            os.chmod(temp_filename, 0o666 & ~_UMASK)
+            os.replace(temp_filename, self.path(pdb_id))
+        except BaseException:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        self._count("stores")
+        # The entry just stored is never evicted here, even if it is larger than max_bytes on its own, as the caller
+        # is about to read it; it is removed by a later eviction once other entries have been used after it
+        if evict:
+            self.evict(keep=(self.path(pdb_id),))
+
+    def put(self, pdb_id, contents):
+        """Stores the contents of a PDB file in the cache
+        Inputs:
+        pdb_id - PDB ID (type string)
+        contents - contents of the file (type string)
+        Output:
+        Name of the cached file (type string)"""
+        with self.open_writer(pdb_id) as fobject:
+            fobject.write(contents.encode("utf-8"))
+        return self.path(pdb_id)
+
+    def entries(self):
+        """Returns every cached file with its size and the time it was last used, least recently used first
+        Output:
+        (name of file, size in bytes, time last used) for each entry (list of tuples)"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(CACHE_EXTENSION) and not entry.name.startswith(".tmp-"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, keep=()):
+        """Removes entries not used for longer than max_age, then the least recently used entries until the cache is
+        no larger than max_bytes
+        Input:
+        keep - names of cached files that must not be removed, e.g. those just stored or found (collection of strings)
+        Output:
+        Number of entries removed (type int)"""
+        if (self.max_bytes is None) and (self.max_age is None):
+            return 0
+        entries = self.entries()
+        total = sum(size for (filename, size, last_used) in entries)
+        oldest_allowed = (time.time() - self.max_age) if self.max_age is not None else None
+        removed = 0
+        for (filename, size, last_used) in entries:
+            too_old = (oldest_allowed is not None) and (last_used < oldest_allowed)
+            too_big = (self.max_bytes is not None) and (total > self.max_bytes)
+            if (filename in keep) or not (too_old or too_big):
+                continue
+            try:
+                os.remove(filename)
+                removed += 1
+            # Another worker may have removed it already
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def clear(self):
+        """Removes every entry from the cache"""
+        for (filename, size, last_used) in self.entries():
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(filename)
+
+    def stats(self):
+        """Returns the hit and miss statistics of this process, and the current size of the cache
+        Output:
+        Statistics, with the keys hits, misses, stores, evictions, entries and bytes (type dictionary)"""
+        entries = self.entries()
+        return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions,
+                "entries": len(entries), "bytes": sum(size for (filename, size, last_used) in entries)}
+
+
+# Cache used by pdblib, or None if caching is off
+_cache = None
+if os.environ.get("PDBTOOLS_CACHE_DIR"):
+    _cache = StructureCache(os.environ["PDBTOOLS_CACHE_DIR"],
+                            int(os.environ["PDBTOOLS_CACHE_MAX_BYTES"]) if os.environ.get("PDBTOOLS_CACHE_MAX_BYTES") else None,
+                            float(os.environ["PDBTOOLS_CACHE_MAX_AGE"]) if os.environ.get("PDBTOOLS_CACHE_MAX_AGE") else None)
+
+def configure(directory, max_bytes=None, max_age=None):
+    """Turns on the cache used by pdblib, or turns it off if directory is None
+    Inputs:
+    directory - folder to keep the cached files in, or None to turn caching off (type string)
+    max_bytes - largest total size of the cached files in bytes, or None for no limit (type int)
+    max_age - seconds after its last use that an entry is removed, or None for no limit (type float)
+    Output:
+    The cache now in use, or None (type StructureCache)"""
+    global _cache
+    _cache = StructureCache(directory, max_bytes, max_age) if directory is not None else None
+    return _cache
+
+def get_cache():
+    """Returns the cache used by pdblib, or None if caching is off"""
+    return _cache
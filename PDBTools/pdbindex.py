@@ -0,0 +1,357 @@
+import functools
+import hashlib
+import io
+import os
+import re
+import sqlite3
+from PDBTools import pdblib
+from PDBTools import pdbprofile
+from PDBTools import pdbscan
+
+
+"""
+SQLite index of a folder of PDB files, so that questions such as "which entries have a HEM ligand on chain A" or
+"which chains have a sequence containing a motif" are answered from the database in milliseconds, without opening
+any PDB file. For each file, the index holds the header details shown by print_details (header, title, source,
+keywords, authors, resolution and journal title) and a few more from the header, the protein sequence, number of
+residues and number of atoms of each chain, and the name, number of residues and number of atoms of each kind of
+HETATM residue other than water (ligands, ions and modified residues) of each chain, whose atoms are also counted as
+the hetatms of the chain and file. Like the sequences, everything is taken from the first model only.
+
+Files are indexed across a pool of worker processes, and indexing again only reads the files that have changed: a
+file with the same size and modification time as when it was indexed is skipped, and a file with a new modification
+time but the same size is only indexed again if its SHA-256 hash has changed. Files that have been removed from the
+folder are removed from the index.
+"""
+
+# Version of the layout of the database; a database with another version is rebuilt
+INDEX_VERSION = 2
+# Number of files given to a worker process at a time
+INDEX_CHUNK = 8
+# Number of files written to the database in each transaction
+INDEX_COMMIT_EVERY = 500
+# Details of each file that can be searched with StructureIndex.search, as in the details of print_details
+DETAIL_FIELDS = ("header", "title", "source", "keywords", "authors", "journal", "classification", "experiment")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    pdb_id TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    header TEXT, title TEXT, source TEXT, keywords TEXT, authors TEXT, resolution REAL, journal TEXT,
+    classification TEXT, deposition_date TEXT, experiment TEXT,
+    models INTEGER, atoms INTEGER, hetatms INTEGER,
+    error TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS chains (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    chain TEXT NOT NULL,
+    sequence TEXT NOT NULL,
+    residues INTEGER NOT NULL,
+    atoms INTEGER NOT NULL,
+    hetatms INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ligands (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    chain TEXT NOT NULL,
+    resname TEXT NOT NULL,
+    residues INTEGER NOT NULL,
+    atoms INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_pdb_id ON files(pdb_id);
+CREATE INDEX IF NOT EXISTS chains_file ON chains(file_id);
+CREATE INDEX IF NOT EXISTS ligands_resname ON ligands(resname, chain);
+CREATE INDEX IF NOT EXISTS ligands_file ON ligands(file_id);
+"""
+
+def _index_file(path, old_hash=None):
+    """Reads one PDB file and finds everything the index holds for it. Errors are recorded in the result rather than
+    raised, so one bad file does not stop the indexing of a folder.
+    Inputs:
+    path - name of the PDB file, plain or compressed (type string)
+    old_hash - SHA-256 hash of the file when it was last indexed, or None if it has not been (type string)
+    Output:
+    Row of the file for the files table (with unchanged True if its hash is old_hash, in which case nothing else is
+    found), and the rows of the chains and ligands tables (type dictionary)"""
+    # PDB IDs are stored in uppercase, as mirrors use lowercase file names
+    row = {"path": path, "pdb_id": pdblib.pdb_id_from_filename(path).upper(), "size": 0, "mtime_ns": 0, "sha256": "",
+           "error": ""}
+    # A file that cannot be read (e.g. a broken link) is recorded with its error and no size, so it is tried again
+    # by the next update
+    try:
+        stat = os.stat(path)
+        with open(path, 'rb') as fobject:
+            data = fobject.read()
+    except OSError as error:
+        row["error"] = "{0}: {1}".format(type(error).__name__, error)
+        return {"file": row, "unchanged": False, "chains": [], "ligands": []}
+    row.update({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": hashlib.sha256(data).hexdigest()})
+    # The file was only touched, so only its modification time needs updating
+    if row["sha256"] == old_hash:
+        return {"file": row, "unchanged": True, "chains": [], "ligands": []}
+    chains = []
+    ligands = []
+    try:
+        lines = pdblib.read_pdb_file(io.BytesIO(data))
+        header = pdblib.get_header(lines)
+        metadata = header.metadata()
+        row.update({"header": header.text("HEADER"), "title": header.text("TITLE"), "source": header.text("SOURCE"),
+                    "keywords": header.text("KEYWDS"), "authors": header.text("AUTHOR"),
+                    "resolution": metadata["resolution"], "journal": header.text("JRNL TITL"),
+                    "classification": metadata["classification"], "deposition_date": metadata["deposition_date"],
+                    "experiment": metadata["experiment"], "models": len(pdblib.get_structure(lines).model_ranges)})
+        sequences = pdblib.get_all_prot_sequences(lines)
+        protein = pdblib.chain_temp_factors(lines)
+        protein = dict(zip(protein["chain"].tolist(), zip(protein["residues"].tolist(), protein["atoms"].tolist())))
+        # Every HETATM residue of the first model except water (as in Structure.ligand_rows), grouped by chain and
+        # residue name in the order they first appear
+        hetero = pdblib.residue_temp_factors(lines, records=("HETATM",))
+        groups = {}
+        for (chain_id, resname, atoms) in zip(hetero["chain"].tolist(), hetero["resname"].tolist(), hetero["atoms"].tolist()):
+            if resname in pdblib.WATER_NAMES:
+                continue
+            group = groups.setdefault((chain_id, resname), {"chain": chain_id, "resname": resname, "residues": 0, "atoms": 0})
+            group["residues"] += 1
+            group["atoms"] += atoms
+        ligands = list(groups.values())
+        hetatms = {}
+        for ligand in ligands:
+            hetatms[ligand["chain"]] = hetatms.get(ligand["chain"], 0) + ligand["atoms"]
+        # Every chain with protein or HETATM residues, in the order the chains first appear
+        for chain_id in pdblib.get_structure(lines).chain_ids():
+            if (chain_id in protein) or (chain_id in hetatms):
+                (chain_residues, chain_atoms) = protein.get(chain_id, (0, 0))
+                chains.append({"chain": chain_id, "sequence": sequences.get(chain_id, ""), "residues": chain_residues,
+                               "atoms": chain_atoms, "hetatms": hetatms.get(chain_id, 0)})
+        row["atoms"] = sum(chain["atoms"] for chain in chains)
+        row["hetatms"] = sum(chain["hetatms"] for chain in chains)
+    except Exception as error:
+        row["error"] = "{0}: {1}".format(type(error).__name__, error)
+        (chains, ligands) = ([], [])
+    return {"file": row, "unchanged": False, "chains": chains, "ligands": ligands}
+
+def _index_chunk(task):
+    """Indexes a chunk of files in a worker process (see StructureIndex.update)
+    Input:
+    task - (list of (name of the file, old hash or None) of each file, profiling) (type tuple)
+    Output:
+    Results of _index_file for each file (list of dictionaries)
+    Calls recorded by pdbprofile in the worker, to add to those of the main process (type dictionary)
+    Both are returned as a tuple"""
+    (files, profiling) = task
+    if profiling:
+        pdbprofile.enable()
+    with pdbprofile.collect() as recorded:
+        results = [_index_file(path, old_hash) for (path, old_hash) in files]
+    return (results, recorded)
+
+def _regexp(pattern, text):
+    """REGEXP function for SQLite: True if the regular expression is found anywhere in the text"""
+    return (text is not None) and (_compiled_pattern(pattern).search(text) is not None)
+
+@functools.lru_cache(maxsize=64)
+def _compiled_pattern(pattern):
+    """Returns a compiled regular expression, compiling each pattern only once"""
+    return re.compile(pattern)
+
+class StructureIndex:
+    """SQLite index of the PDB files of one or more folders (see the description of the index above). Can be used in
+    a with statement.
+    Attributes:
+    database - name of the SQLite database file (type string)
+    connection - connection to the database (type sqlite3.Connection)"""
+
+    def __init__(self, database):
+        """Opens the database, creating it if it does not exist, or rebuilding it if it was made by another version
+        Input:
+        database - name of the SQLite database file (type string)"""
+        self.database = database
+        self.connection = sqlite3.connect(database)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.create_function("REGEXP", 2, _regexp, deterministic=True)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, INDEX_VERSION):
+            with self.connection:
+                for table in ("ligands", "chains", "files"):
+                    self.connection.execute("DROP TABLE IF EXISTS " + table)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute("PRAGMA user_version = {0}".format(INDEX_VERSION))
+
+    def close(self):
+        """Closes the database"""
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write(self, result):
+        """Adds the rows of one indexed file to the database, replacing any rows it had before"""
+        row = result["file"]
+        if result["unchanged"]:
+            self.connection.execute("UPDATE files SET mtime_ns = ? WHERE path = ?", (row["mtime_ns"], row["path"]))
+            return
+        # Removing the old row of the file also removes the rows of its chains and ligands
+        self.connection.execute("DELETE FROM files WHERE path = ?", (row["path"],))
+        columns = list(row.keys())
+        cursor = self.connection.execute("INSERT INTO files ({0}) VALUES ({1})".format(", ".join(columns), ", ".join("?" * len(columns))),
+                                         [row[column] for column in columns])
+        file_id = cursor.lastrowid
+        self.connection.executemany("INSERT INTO chains VALUES (?, ?, ?, ?, ?, ?)",
+                                    [(file_id, chain["chain"], chain["sequence"], chain["residues"], chain["atoms"], chain["hetatms"]) for chain in result["chains"]])
+        self.connection.executemany("INSERT INTO ligands VALUES (?, ?, ?, ?, ?)",
+                                    [(file_id, ligand["chain"], ligand["resname"], ligand["residues"], ligand["atoms"]) for ligand in result["ligands"]])
+
+    @pdbprofile.timed("write")
+    def update(self, directory, workers=None, prune=True):
+        """Indexes the PDB files of a folder (and its subfolders) across a pool of worker processes, only reading
+        files that are new or have changed since they were last indexed
+        Inputs:
+        directory - folder of PDB files, plain or compressed (see pdbscan.iter_corpus) (type string)
+        workers - number of worker processes (if None, the number of CPUs; 1 indexes in this process) (type int)
+        prune - if True, files under the folder that are in the index but no longer exist are removed from it (type bool)
+        Output:
+        Summary with the keys files (number of PDB files found), indexed (read and indexed), unchanged (skipped, or
+        only touched), removed (removed from the index) and failed (could not be read) (type dictionary)"""
+        if not os.path.isdir(directory):
+            print("The folder {0} could not be found.".format(directory))
+            return {"files": 0, "indexed": 0, "unchanged": 0, "removed": 0, "failed": 0}
+        directory = os.path.abspath(directory)
+        summary = {"files": 0, "indexed": 0, "unchanged": 0, "removed": 0, "failed": 0}
+        # Size, modification time and hash of every file under the folder when it was indexed
+        known = {path: (size, mtime_ns, sha256) for (path, size, mtime_ns, sha256) in self.connection.execute(
+                 "SELECT path, size, mtime_ns, sha256 FROM files WHERE path >= ? AND path < ?", (directory + os.sep, directory + chr(ord(os.sep) + 1)))}
+        found = set()
+        stale = []
+        for (name, path) in pdbscan.iter_corpus(directory):
+            found.add(path)
+            summary["files"] += 1
+            try:
+                stat = os.stat(path)
+            # A file that cannot be found or read is given to _index_file, which records it as failed
+            except OSError:
+                stale.append((path, None))
+                continue
+            old = known.get(path)
+            if (old is not None) and (old[0] == stat.st_size) and (old[1] == stat.st_mtime_ns):
+                summary["unchanged"] += 1
+                continue
+            # A different size means different contents; a different time alone needs the contents to be compared
+            stale.append((path, old[2] if (old is not None) and (old[0] == stat.st_size) else None))
+        profiling = pdbprofile.is_enabled()
+        workers = workers or os.cpu_count() or 1
+        tasks = ((chunk, profiling) for chunk in pdbscan.chunks(stale, INDEX_CHUNK))
+        written = 0
+        try:
+            for (results, recorded) in pdbscan.map_bounded(_index_chunk, tasks, workers):
+                if profiling and (workers > 1):
+                    pdbprofile.merge(recorded)
+                for result in results:
+                    self._write(result)
+                    if result["unchanged"]:
+                        summary["unchanged"] += 1
+                    else:
+                        summary["indexed"] += 1
+                        summary["failed"] += (result["file"]["error"] != "")
+                    written += 1
+                    # Commit every few hundred files, so an interrupted update keeps most of its work
+                    if written % INDEX_COMMIT_EVERY == 0:
+                        self.connection.commit()
+            if prune:
+                removed = [(path,) for path in known if path not in found]
+                self.connection.executemany("DELETE FROM files WHERE path = ?", removed)
+                summary["removed"] = len(removed)
+        finally:
+            self.connection.commit()
+        return summary
+
+    def _query(self, sql, parameters=()):
+        """Runs a query and returns every row (list of tuples)"""
+        return self.connection.execute(sql, parameters).fetchall()
+
+    def find_ligand(self, resname, chain_id=None):
+        """Finds the entries with a HETATM residue name (other than water, which is not indexed), on any chain or on one
+        chain
+        Inputs:
+        resname - residue name of the HETATM records, e.g. "HEM" (type string)
+        chain_id - Chain ID the residue must be on, or None for any chain (type string)
+        Output:
+        (PDB ID, chain ID, number of residues of that name on the chain) for each chain found, in order of PDB ID
+        (list of tuples)"""
+        sql = "SELECT files.pdb_id, ligands.chain, ligands.residues FROM ligands JOIN files ON files.id = ligands.file_id WHERE ligands.resname = ?"
+        parameters = [resname.upper()]
+        if chain_id is not None:
+            sql += " AND ligands.chain = ?"
+            parameters.append(chain_id)
+        return self._query(sql + " ORDER BY files.pdb_id, ligands.chain", parameters)
+
+    def find_motif(self, motif, regex=False):
+        """Finds the protein chains whose sequence contains a motif
+        Inputs:
+        motif - 1-letter residues to look for, e.g. "GXSXG" as "G.S.G" with regex (type string)
+        regex - if True, the motif is a regular expression (type bool)
+        Output:
+        (PDB ID, chain ID, position of the first match counting from 1) for each chain found, in order of PDB ID
+        (list of tuples)"""
+        if not regex:
+            return self._query("SELECT files.pdb_id, chains.chain, instr(chains.sequence, ?) AS position FROM chains JOIN files ON files.id = chains.file_id "
+                               "WHERE position > 0 ORDER BY files.pdb_id, chains.chain", (motif.upper(),))
+        rows = self._query("SELECT files.pdb_id, chains.chain, chains.sequence FROM chains JOIN files ON files.id = chains.file_id "
+                           "WHERE chains.sequence REGEXP ? ORDER BY files.pdb_id, chains.chain", (motif,))
+        return [(pdb_id, chain_id, _compiled_pattern(motif).search(sequence).start() + 1) for (pdb_id, chain_id, sequence) in rows]
+
+    def search(self, field, text):
+        """Finds the entries with a detail containing some text, ignoring case
+        Inputs:
+        field - detail to search, one of DETAIL_FIELDS (type string)
+        text - text to look for, e.g. "HYDROLASE" (type string)
+        Output:
+        PDB IDs found, in order (list of strings)"""
+        if field not in DETAIL_FIELDS:
+            print("The detail {0} is not in the index. Please use one of: {1}".format(field, ", ".join(DETAIL_FIELDS)))
+            return []
+        # Escape the wildcards of LIKE, so the text is matched as it is
+        pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        return [pdb_id for (pdb_id,) in self._query("SELECT DISTINCT pdb_id FROM files WHERE {0} LIKE ? ESCAPE '\\' ORDER BY pdb_id".format(field), (pattern,))]
+
+    def get_sequences(self, pdb_id):
+        """Returns the protein sequence of every chain of an entry, as get_all_prot_sequences would
+        Input:
+        pdb_id - PDB ID (type string)
+        Output:
+        1-letter protein residues of each chain with protein residues (dictionary of chain ID: string)"""
+        rows = self._query("SELECT chain, sequence FROM chains WHERE file_id = (SELECT id FROM files WHERE pdb_id = ? ORDER BY path LIMIT 1) "
+                           "AND sequence != '' ORDER BY rowid", (pdb_id.upper(),))
+        return dict(rows)
+
+    def get_entry(self, pdb_id):
+        """Returns everything the index holds for an entry
+        Input:
+        pdb_id - PDB ID (type string)
+        Output:
+        Row of the file (path, size, details, counts of models and atoms, and error), with chains (one dictionary for
+        each chain) and ligands (one dictionary for each HETATM residue name other than water of each chain), or None if the entry is not
+        in the index (type dictionary)"""
+        cursor = self.connection.execute("SELECT * FROM files WHERE pdb_id = ? ORDER BY path LIMIT 1", (pdb_id.upper(),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        entry = dict(zip([column[0] for column in cursor.description], row))
+        for table in ("chains", "ligands"):
+            cursor = self.connection.execute("SELECT * FROM {0} WHERE file_id = ? ORDER BY rowid".format(table), (entry["id"],))
+            names = [column[0] for column in cursor.description]
+            entry[table] = [{name: value for (name, value) in zip(names, values) if name != "file_id"} for values in cursor]
+        return entry
+
+    def stats(self):
+        """Returns the number of files, chains, ligand rows and files that could not be read in the index
+        (dictionary of string: int)"""
+        (files, failed) = self.connection.execute("SELECT count(*), count(NULLIF(error, '')) FROM files").fetchone()
+        return {"files": files, "chains": self._query("SELECT count(*) FROM chains")[0][0],
+                "ligands": self._query("SELECT count(*) FROM ligands")[0][0], "failed": failed}
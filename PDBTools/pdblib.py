@@ -1,6 +1,27 @@
-import requests
 import os
-import matplotlib.pyplot as plt
+import sys
+import copy
+import functools
+import re
+import contextlib
+import concurrent.futures
+import threading
+import mmap
+import io
+import queue
+import tarfile
+import gzip
+import bz2
+import lzma
+import shutil
+import tempfile
+import importlib.util
+import itertools
+from collections import namedtuple
+from collections.abc import Sequence
+import numpy as np
+from PDBTools import pdbcache
+from PDBTools import pdbprofile
 
 
 """
@@ -9,37 +30,77 @@ and not just checkPDB.py, all provided arguments are checked, and any potential
 statements. However, users can use the check functions like is_valid_chain in their own programs as well.
 """
 
-def download_pdb(pdb_id):
-    """Reads local PDB file contents, or downloads PDB file from RSCB site and saves to a file if no local copy. It returns the contents of the file as a list of lines and file name as a tuple.
+def _lazy_import(name):
+    """Returns a module that is only imported when one of its attributes is first used, so that programs which never
+    use it do not pay for importing it
     Input:
-    PDB ID (type string)
+    name - name of a top-level module (type string)
+    Output:
+    The module, loaded on first use (type module)"""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    # A missing module is reported now, as a plain import would, rather than when it is first used
+    if spec is None:
+        raise ImportError("No module named {0!r}".format(name), name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+# requests is only imported when a file is first downloaded (matplotlib is imported when a plot is first drawn)
+requests = _lazy_import("requests")
+
+# Site PDB files are downloaded from (a PDB ID and .pdb are added to the end)
+RCSB_URL = "https://files.rcsb.org/download/"
+
+def stats():
+    """Returns the calls, times, bytes and cache hits recorded while profiling was turned on (see pdbprofile.enable,
+    or set the PDBTOOLS_PROFILE environment variable)
+    Output:
+    Everything recorded, as described in pdbprofile.stats (type dictionary)"""
+    return pdbprofile.stats()
+
+def dump_stats(target):
+    """Saves the calls, times, bytes and cache hits recorded while profiling was turned on as JSON
+    Input:
+    target - name of the file to save to, or a file object opened for writing text"""
+    pdbprofile.dump(target)
+
+@pdbprofile.timed("download")
+def download_pdb(pdb_id, mapped=False):
+    """Reads local PDB file contents, or downloads PDB file from RSCB site and saves to a file if no local copy. It returns the contents of the file as a list of lines and file name as a tuple.
+    If a cache has been turned on (see pdbcache.configure), files that are not found locally are looked for in the cache, and downloaded files are saved to the cache instead of the current folder.
+    Inputs:
+    pdb_id - PDB ID (type string)
+    mapped - if True, the file is memory-mapped and lines are only decoded when used, instead of reading the whole file (type bool). Cached files are compressed, so are always read in full.
     Outputs:
-    Contents of file corresponding to PDB ID if found (type list)
+    Contents of file corresponding to PDB ID if found (type list, or MappedLines if mapped)
     Name of file found locally/name of file downloaded, extension excluded (type string)
     Both are returned as a tuple"""
-    # Create a string of the filename - try for both uppercase and lowercase
-    filename_lower = pdb_id.lower() + ".pdb"
+    # Create a string of the filename to download to
     filename_upper = pdb_id.upper() + ".pdb"
-    # If the filename is found locally, open the file and read the contents
-    if os.path.isfile(filename_upper):
-        pdb_id = pdb_id.upper()
-        # Print message to tell user that local file has been found
-        print("A local file for this ID, {0}.pdb was found.".format(pdb_id))
-        with open(filename_upper, 'r') as fobject:
-            # Get all contents as a string
-            contents = fobject.read()
-    elif os.path.isfile(filename_lower):
-        pdb_id = pdb_id.lower()
+    contents = None
+    cache = pdbcache.get_cache()
+    # If the filename is found locally, it is read below
+    (filename, local_id) = find_local_pdb(pdb_id)
+    # If the file is not found locally, look for it in the cache (if there is one)
+    if (filename is None) and (cache is not None):
+        contents = cache.get(pdb_id)
+    if filename is not None:
+        pdb_id = local_id
+        pdbprofile.add("local_file_hits")
         # Print message to tell user that local file has been found
         print("A local file for this ID, {0}.pdb was found.".format(pdb_id))
-        with open(filename_lower, 'r') as fobject:
-            # Get all contents as a string
-            contents = fobject.read()
-    # If the file is not found locally, use requests to download it
+    elif contents is not None:
+        pdb_id = pdb_id.upper()
+        print("A cached copy of the file for this ID, {0}.pdb was found.".format(pdb_id))
+    # If the file is not found locally or in the cache, use requests to download it
     else:
         # Print message telling user that local file was not found
         print("A local file {0}.pdb was not found. Trying to download a file with PDB ID {0}.".format(pdb_id))
-        response = requests.get("https://files.rcsb.org/download/" + pdb_id + ".pdb")
+        response = requests.get(RCSB_URL + pdb_id + ".pdb")
         # if not successful, return an empty list
         if response.status_code != 200:
             print("A file for PDB ID {0} could not be downloaded. Please check the PDB ID given.".format(pdb_id))
@@ -48,52 +109,1506 @@ def download_pdb(pdb_id):
         else:
             # Get the file contents
             contents = response.text
-            # Save the file locally
-            with open(filename_upper, 'w') as fobject:
-                fobject.write(contents)
-            print("The PDB file has been downloaded, and saved to the file {0}.pdb".format(pdb_id))
-    # Convert string to list of lines of the file
-    lines = contents.split("\n")
+            pdbprofile.add("downloads")
+            pdbprofile.add("bytes_downloaded", len(response.content))
+            # Save the file to the cache if there is one, or locally otherwise
+            if cache is not None:
+                filename = cache.put(pdb_id, contents)
+                print("The PDB file has been downloaded, and saved to the cache file {0}".format(filename))
+            else:
+                filename = filename_upper
+                with open(filename, 'w') as fobject:
+                    fobject.write(contents)
+                print("The PDB file has been downloaded, and saved to the file {0}.pdb".format(pdb_id))
+    # Memory-map the file, so that only the lines (or columns of lines) that are used are ever decoded (cached
+    # and other compressed files cannot be mapped)
+    if mapped and (filename is not None) and (get_compression(filename) is None):
+        lines = MappedLines(filename)
+    else:
+        # Get all contents as a string (decompressing the file if needed), unless it was just downloaded
+        if contents is None:
+            with open_pdb_file(filename) as fobject:
+                contents = fobject.read()
+            pdbprofile.add("bytes_read", len(contents))
+        # Convert string to list of lines of the file (a PDBLines list, so the parsed structure can be kept with it)
+        lines = PDBLines(contents.split("\n"))
     # Tell user that lines have bee read
     print("The contents of the file with PDB ID {0} has successfully been read.".format(pdb_id))
     # Return list of lines and filename (pdb ID either uppercase or lowercase)
     return (lines, pdb_id)
 
-def format_80(contents):
-    """Converts a string to a formatted string with 80 characters on each line
+# Fixed-width columns of ATOM/HETATM records (0-based start and end indices of each field)
+ATOM_COLUMNS = {"record": (0, 6), "serial": (6, 11), "name": (12, 16), "altloc": (16, 17), "resname": (17, 20),
+                "chain": (21, 22), "resseq": (22, 26), "icode": (26, 27), "x": (30, 38), "y": (38, 46), "z": (46, 54),
+                "occupancy": (54, 60), "bfactor": (60, 66), "element": (76, 78)}
+
+# Endings of local PDB file names, in the order they are looked for (compressed files are read without unpacking)
+LOCAL_EXTENSIONS = (".pdb", ".pdb.gz", ".ent.gz", ".pdb.bz2", ".ent.bz2", ".pdb.xz", ".ent.xz")
+
+def find_local_pdb(pdb_id, directory="."):
+    """Finds a local PDB file for a PDB ID, trying an uppercase file name first and then a lowercase one. Plain .pdb
+    files are looked for first, then compressed files ending in LOCAL_EXTENSIONS, including the pdb<id>.ent.gz names
+    used by PDB mirrors.
+    Inputs:
+    pdb_id - PDB ID (type string)
+    directory - folder to look in (type string)
+    Outputs:
+    Name of the local file, or None if there is no local file (type string)
+    PDB ID in the case of the file found (type string)
+    Both are returned as a tuple"""
+    for extension in LOCAL_EXTENSIONS:
+        for local_id in (pdb_id.upper(), pdb_id.lower()):
+            for prefix in (("", "pdb") if extension.startswith(".ent") else ("",)):
+                filename = os.path.join(directory, prefix + local_id + extension)
+                if os.path.isfile(filename):
+                    return (filename, local_id)
+    return (None, pdb_id)
+
+# Magic bytes at the start of compressed files, and the module used to decompress them
+COMPRESSION_MAGIC = ((b"\x1f\x8b", gzip), (b"BZh", bz2), (b"\xfd7zXZ\x00", lzma))
+# File name endings of compressed files, used when the magic bytes cannot be read
+COMPRESSION_EXTENSIONS = {".gz": gzip, ".bz2": bz2, ".xz": lzma}
+
+def get_compression(filename, start=None):
+    """Returns the module needed to decompress a file, found from its first bytes, or from its extension if the first
+    bytes are not given and the file cannot be read
+    Inputs:
+    filename - name of the file (type string)
+    start - first bytes of the file, if already read (type bytes)
+    Output:
+    gzip, bz2 or lzma module, or None if the file is not compressed"""
+    if start is None:
+        try:
+            with open(filename, 'rb') as fobject:
+                start = fobject.read(6)
+        except OSError:
+            start = b""
+    for (magic, module) in COMPRESSION_MAGIC:
+        if start.startswith(magic):
+            return module
+    if (start == b"") and (filename is not None):
+        return COMPRESSION_EXTENSIONS.get(os.path.splitext(str(filename))[1].lower())
+    return None
+
+def open_pdb_file(filename_or_fileobj, background=True):
+    """Opens a PDB file for reading as text. Files compressed with gzip, bz2 or xz are decompressed as they are
+    read (nothing is written to disk), and by default the decompression runs in a background thread so that it
+    overlaps with parsing the lines that have already been decompressed.
+    Inputs:
+    filename_or_fileobj - name of a file, or a file object opened in binary mode
+    background - if True, compressed files are decompressed in a background thread (type bool)
+    Output:
+    File object opened in text mode (must be closed by the caller)"""
+    if isinstance(filename_or_fileobj, (str, os.PathLike)):
+        module = get_compression(filename_or_fileobj)
+        if module is None:
+            return open(filename_or_fileobj, 'r')
+        raw = module.open(filename_or_fileobj, 'rb')
+    else:
+        # Look at the first bytes without using them up, by putting the file object in a buffered reader
+        buffered = filename_or_fileobj if hasattr(filename_or_fileobj, "peek") else io.BufferedReader(filename_or_fileobj)
+        module = get_compression(None, buffered.peek(6)[:6])
+        raw = module.open(buffered, 'rb') if module is not None else buffered
+    if background and (module is not None):
+        raw = io.BufferedReader(_BackgroundReader(raw))
+    return io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+
+class _BackgroundReader(io.RawIOBase):
+    """Reads a binary file object in a background thread, a chunk at a time, into a small queue. Used for compressed
+    files, so that the next chunk is decompressed (zlib, bz2 and lzma do not hold the GIL) while the previous chunk
+    is being parsed."""
+
+    def __init__(self, fobject, chunk_size=1 << 20, depth=4):
+        """Starts reading the file object in a background thread
+        Inputs:
+        fobject - file object to read (binary mode)
+        chunk_size - bytes read at a time (type int)
+        depth - most chunks read ahead of the reader (type int)"""
+        super().__init__()
+        self._fobject = fobject
+        self._chunks = queue.Queue(depth)
+        self._pending = b""
+        self._finished = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_chunks, args=(chunk_size,), daemon=True)
+        self._thread.start()
+
+    def _read_chunks(self, chunk_size):
+        """Reads chunks into the queue until the end of the file (an empty chunk), or an error, which is passed on"""
+        try:
+            while not self._stop.is_set():
+                chunk = self._fobject.read(chunk_size)
+                self._chunks.put(chunk)
+                if chunk == b"":
+                    return
+        except Exception as error:
+            self._chunks.put(error)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        """Copies the next decompressed bytes into the buffer, waiting for the background thread if needed"""
+        if (self._pending == b"") and (not self._finished):
+            chunk = self._chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            self._finished = (chunk == b"")
+            self._pending = chunk
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def close(self):
+        """Stops the background thread and closes the file object"""
+        if not self.closed:
+            self._stop.set()
+            # Empty the queue so the background thread is not left waiting to add a chunk
+            while self._thread.is_alive():
+                try:
+                    self._chunks.get(timeout=0.05)
+                except queue.Empty:
+                    pass
+            self._fobject.close()
+        super().close()
+
+@pdbprofile.timed("read")
+def read_pdb_file(filename_or_fileobj):
+    """Reads a PDB file (plain, or compressed with gzip, bz2 or xz) into a list of lines
+    Input:
+    filename_or_fileobj - name of a file, or a file object opened in binary mode
+    Output:
+    Contents of the file (type PDBLines)"""
+    with open_pdb_file(filename_or_fileobj) as fobject:
+        contents = fobject.read()
+    pdbprofile.add("bytes_read", len(contents))
+    return PDBLines(contents.split("\n"))
+
+def iter_tar_pdbs(tar_filename):
+    """Reads every PDB file inside a tar file (such as data.tar.gz), one member at a time, as the tar file is
+    decompressed. Members may themselves be compressed (e.g. .ent.gz). Nothing is extracted to disk.
+    Input:
+    tar_filename - name of the tar file, which may be compressed (type string)
+    Output:
+    (name of the member, PDB ID from the member name, contents of the file as PDBLines) for each PDB file (yielded tuples)"""
+    # Stream mode reads the members in order without seeking, so the tar file is only decompressed once
+    with tarfile.open(tar_filename, 'r|*') as tar:
+        for member in tar:
+            name = os.path.basename(member.name)
+            if not member.isfile() or not name.lower().endswith(LOCAL_EXTENSIONS + (".ent",)):
+                continue
+            # Members of a streamed tar file cannot seek, so each member's bytes are read before decompressing them
+            lines = read_pdb_file(io.BytesIO(tar.extractfile(member).read()))
+            yield (member.name, pdb_id_from_filename(name), lines)
+
+def pdb_id_from_filename(filename):
+    """Returns the PDB ID of a PDB file name: the name up to its first dot, without the pdb prefix of mirror names
+    (e.g. 1HIV.pdb, 1hiv.pdb.gz and pdb1hiv.ent.gz)
+    Input:
+    filename - name of the file, with or without its folder (type string)
+    Output:
+    PDB ID in the case of the file name (type string)"""
+    name = os.path.basename(filename)
+    pdb_id = name.split(".")[0]
+    if (".ent" in name.lower()) and pdb_id.lower().startswith("pdb"):
+        pdb_id = pdb_id[3:]
+    return pdb_id
+
+@pdbprofile.timed("download")
+def download_many(pdb_ids, workers=8, base_url=None, directory=None):
+    """Downloads many PDB files at once, using a pool of threads that share one pooled requests session, so that
+    connections are reused instead of being opened for every file. Files that are already in the directory (as
+    uppercase or lowercase .pdb) are not downloaded again. Each file is written in chunks as it arrives, to a
+    temporary file that is renamed once complete, so a failed download never leaves a partial file.
+    Inputs:
+    pdb_ids - PDB IDs to download (list of strings)
+    workers - number of downloads at the same time (type int)
+    base_url - site to download from, with the PDB ID and .pdb added to the end (type string, RCSB_URL if None)
+    directory - folder to save the files to (type string). If None, files are saved to the cache if one has been
+    turned on (see pdbcache.configure), or to the current folder otherwise
+    Output:
+    Result for each PDB ID, as a dictionary with PDB IDs as keys and (success, file name or error message) tuples as
+    values. Cached files are only evicted once every download has finished, and never the files of this call, so
+    every file name returned exists until the cache is next used"""
+    if base_url is None:
+        base_url = RCSB_URL
+    cache = pdbcache.get_cache() if directory is None else None
+    if directory is None:
+        directory = "."
+    # One session for all threads, with enough pooled connections for every worker
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    with session, concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {pdb_id: executor.submit(_download_to_file, session, pdb_id, base_url, directory, cache) for pdb_id in pdb_ids}
+        results = {pdb_id: future.result() for pdb_id, future in futures.items()}
+    # Evict old cache entries once for the whole batch, keeping every file stored or found by it
+    if cache is not None:
+        cache.evict(keep={message for (success, message) in results.values() if success})
+    # Tell user how many files could be downloaded or found
+    failed = [pdb_id for pdb_id, (success, message) in results.items() if not success]
+    print("{0} of {1} PDB files were downloaded or found locally.".format(len(results) - len(failed), len(results)))
+    if failed != []:
+        print("Files for the PDB IDs {0} could not be downloaded.".format(", ".join(failed)))
+    return results
+
+def _download_to_file(session, pdb_id, base_url, directory, cache=None):
+    """Downloads one PDB file with the given session, streaming it to the file <ID>.pdb in the directory, or to the
+    cache if one is given
+    Inputs:
+    session - session to download with (type requests.Session)
+    pdb_id - PDB ID to download (type string)
+    base_url - site to download from (type string)
+    directory - folder to save the file to (type string)
+    cache - cache to save the file to instead of the directory, or None (type StructureCache)
+    Output:
+    (True, name of file) if downloaded or found locally, (False, error message) otherwise (type tuple)"""
+    # Use a local copy if there is one, the same as download_pdb
+    (filename, local_id) = find_local_pdb(pdb_id, directory)
+    if filename is not None:
+        return (True, filename)
+    if cache is not None:
+        return _download_to_cache(session, pdb_id, base_url, cache)
+    filename = os.path.join(directory, pdb_id.upper() + ".pdb")
+    temp_filename = filename + ".part{0}".format(threading.get_ident())
+    try:
+        with session.get(base_url + pdb_id + ".pdb", stream=True, timeout=60) as response:
+            if response.status_code != 200:
+                return (False, "HTTP status {0}".format(response.status_code))
+            pdbprofile.add("downloads")
+            with open(temp_filename, 'wb') as fobject:
+                for chunk in response.iter_content(chunk_size=65536):
+                    fobject.write(chunk)
+                    pdbprofile.add("bytes_downloaded", len(chunk))
+        os.replace(temp_filename, filename)
+    except (requests.RequestException, OSError) as error:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        return (False, str(error))
+    return (True, filename)
+
+def _download_to_cache(session, pdb_id, base_url, cache):
+    """Downloads one PDB file with the given session into the cache, unless it is already cached
+    Inputs:
+    session - session to download with (type requests.Session)
+    pdb_id - PDB ID to download (type string)
+    base_url - site to download from (type string)
+    cache - cache to save the file to (type StructureCache)
+    Output:
+    (True, name of cached file) if downloaded or already cached, (False, error message) otherwise (type tuple)"""
+    filename = cache.lookup(pdb_id)
+    if filename is not None:
+        return (True, filename)
+    try:
+        with session.get(base_url + pdb_id + ".pdb", stream=True, timeout=60) as response:
+            if response.status_code != 200:
+                return (False, "HTTP status {0}".format(response.status_code))
+            pdbprofile.add("downloads")
+            # Old entries are evicted by download_many once the whole batch has finished
+            with cache.open_writer(pdb_id, evict=False) as fobject:
+                for chunk in response.iter_content(chunk_size=65536):
+                    fobject.write(chunk)
+                    pdbprofile.add("bytes_downloaded", len(chunk))
+    except (requests.RequestException, OSError) as error:
+        return (False, str(error))
+    return (True, cache.path(pdb_id))
+
+# Dictionary with three-letter amino acid residues as keys, and one-letter aas as values
+PROTEIN_CODES = {"ALA":"A", "ASX":"B", "CYS":"C", "ASP":"D", "GLU":"E", "PHE":"F", "GLY":"G", "HIS":"H", "ILE":"I", "LYS":"K", "LEU":"L", "MET":"M", "ASN":"N", "PRO":"P", 
+                 "GLN":"Q", "ARG":"R", "SER":"S", "THR":"T", "SEC":"U", "VAL":"V", "TRP":"W", "XAA":"X", "TYR":"Y", "GLX":"Z"}
+# Three-letter codes of the standard protein residues (only taking 20 as standard); any other residue name of an ATOM
+# record is non-standard
+STANDARD_RESIDUES = ("ALA", "CYS", "ASP", "GLU", "PHE", "GLY", "HIS", "ILE", "LYS", "LEU", "MET", "ASN", "PRO",
+                     "GLN", "ARG", "SER", "THR", "VAL", "TRP", "TYR")
+
+class PDBLines(list):
+    """List of the lines of a PDB file, as returned by download_pdb. It behaves exactly like a list of strings, but
+    also keeps the Structure parsed from the lines, so that the file is only parsed the first time it is queried.
+    Note that the stored structure is not updated if the list itself is changed."""
+    structure = None
+    header = None
+    models = None
+
+class MappedLines(Sequence):
+    """Read-only list of the lines of a memory-mapped PDB file. Only the offsets of the lines are found when the file
+    is opened; a line is decoded to a string only when it is accessed, and a Structure is parsed straight from the
+    bytes of the coordinate lines. It can be used anywhere a list of lines from download_pdb is used, and keeps its
+    parsed structure the same way as PDBLines.
+    Attributes:
+    filename - name of the mapped file (type string)
+    buffer - contents of the file (type mmap, or bytes for an empty file)
+    starts, ends - byte offsets of the start and end of each line, excluding the newline (type int arrays)"""
+    structure = None
+    header = None
+    models = None
+
+    @pdbprofile.timed("read", "MappedLines")
+    def __init__(self, filename, offsets=None):
+        """Memory-maps the file and finds the offset of every line
+        Inputs:
+        filename - name of the PDB file, including extension (type string)
+        offsets - (starts, ends) of the lines if already known, so the file does not need to be scanned (type tuple)"""
+        self.filename = filename
+        with open(filename, 'rb') as fobject:
+            # Files of length 0 cannot be mapped, but are one empty line (the same as splitting an empty string)
+            if os.fstat(fobject.fileno()).st_size == 0:
+                self.buffer = b""
+            else:
+                self.buffer = mmap.mmap(fobject.fileno(), 0, access=mmap.ACCESS_READ)
+        pdbprofile.add("bytes_mapped", len(self.buffer))
+        if offsets is not None:
+            (self.starts, self.ends) = offsets
+            return
+        data = np.frombuffer(self.buffer, dtype=np.uint8)
+        # Lines are split on newlines only, the same as contents.split("\n")
+        newlines = np.flatnonzero(data == ord("\n"))
+        self.starts = np.concatenate(([0], newlines + 1)).astype(np.int64)
+        self.ends = np.concatenate((newlines, [len(data)])).astype(np.int64)
+
+    def __len__(self):
+        """Returns the number of lines in the file"""
+        return len(self.starts)
+
+    def __getitem__(self, idx):
+        """Returns the decoded line (or list of lines for a slice) at the given index"""
+        if isinstance(idx, slice):
+            return [self[line_idx] for line_idx in range(*idx.indices(len(self)))]
+        return self.get_bytes(idx).decode("utf-8", "replace")
+
+    def get_bytes(self, idx):
+        """Returns the raw bytes of the line at the given index, without decoding them
+        Input:
+        idx - index of the line (type int)
+        Output:
+        Line without the newline (type bytes)"""
+        return self.buffer[self.starts[idx]:self.ends[idx]]
+
+    def atom_chars(self, start=0, stop=None):
+        """Finds the ATOM and HETATM lines from their first bytes, and returns them as a 2D array of characters
+        Inputs:
+        start, stop - range of lines to look at (every line by default) (type int)
+        Output:
+        Indices of the coordinate lines (type int array)
+        Characters of each coordinate line padded to 80 with spaces, one row per line (type uint8 array)"""
+        data = np.frombuffer(self.buffer, dtype=np.uint8)
+        (line_index, chars) = _gather_atom_chars(data, self.starts[start:stop], self.ends[start:stop])
+        return (line_index + start, chars)
+
+    def model_lines(self):
+        """Returns the indices of the MODEL lines, found from their first bytes (type int array)"""
+        data = np.frombuffer(self.buffer, dtype=np.uint8)
+        if len(data) == 0:
+            return np.zeros(0, dtype=np.int64)
+        first = _gather_columns(data, self.starts, self.ends, 5)
+        return np.flatnonzero(np.all(first == np.frombuffer(b"MODEL", dtype=np.uint8), axis=1))
+
+class Structure:
+    """Holds the ATOM and HETATM records of a PDB file as NumPy arrays, one array per column, so that queries on the
+    file can be done with array operations instead of looping over every line. The lines are only parsed once, when
+    the Structure is made.
+    Attributes (one element per atom, in the same order as the file):
+    line_index - index of the line each atom was read from in lines (type int array)
+    record - ATOM or HETATM (type string array)
+    serial, resseq - atom serial number and residue number (type int arrays)
+    name, altloc, resname, chain, icode, element - atom name, alternate location, residue name, chain ID,
+    insertion code and element symbol, with surrounding spaces removed (type string arrays)
+    x, y, z, occupancy, bfactor - coordinates, occupancy and temperature factor (type float arrays)
+    lines - the lines the structure was parsed from (list of string lines)
+    Files with several models (e.g. NMR ensembles) hold the atoms of every model, one model after another; see models
+    and model_ranges."""
+
+    @pdbprofile.timed("parse", "Structure")
+    def __init__(self, lines, line_range=None):
+        """Parses the ATOM and HETATM records from the lines of a PDB file in a single pass
+        Inputs:
+        lines - file contents of pdb file (list of string lines)
+        line_range - (start, stop) of the lines to parse (e.g. those of one model), or None for every line (type tuple)"""
+        self.lines = lines
+        (start, stop) = line_range if line_range is not None else (0, None)
+        # Get the index of every coordinate line, and its characters as a 2D array (one row per atom)
+        if isinstance(lines, MappedLines):
+            (self.line_index, chars) = lines.atom_chars(start, stop)
+        else:
+            (self.line_index, chars) = _atom_chars(lines, start, stop)
+        # Slice each field out of the array of characters and convert it to the type of that field
+        for field, (start, end) in ATOM_COLUMNS.items():
+            column = np.ascontiguousarray(chars[:, start:end]).view("S{0}".format(end - start)).ravel()
+            if field in ("serial", "resseq"):
+                setattr(self, field, _to_numbers(column, np.int64, 0))
+            elif field in ("x", "y", "z", "occupancy", "bfactor"):
+                setattr(self, field, _to_numbers(column, np.float64, np.nan))
+            else:
+                setattr(self, field, np.char.strip(column.astype("U")))
+        # The chain, residue and model indices and spatial grids are only built the first time they are needed
+        self._chain_ranges = None
+        self._residue_starts = None
+        self._model_ranges = None
+        self._models = None
+        self._grids = {}
+        self._masks = {}
+
+    @classmethod
+    def from_columns(cls, lines, line_index, columns):
+        """Makes a Structure from columns that have already been parsed (e.g. loaded from a saved structure),
+        without reading the lines
+        Inputs:
+        lines - file contents of pdb file (list of string lines)
+        line_index - index of the line each atom was read from (type int array)
+        columns - array for each field of ATOM_COLUMNS (dictionary of field name: array)
+        Output:
+        Structure holding the given arrays (which are not copied)"""
+        structure = cls.__new__(cls)
+        structure.lines = lines
+        structure.line_index = line_index
+        for field in ATOM_COLUMNS.keys():
+            setattr(structure, field, columns[field])
+        structure._chain_ranges = None
+        structure._residue_starts = None
+        structure._model_ranges = None
+        structure._models = None
+        structure._grids = {}
+        structure._masks = {}
+        return structure
+
+    def atom_range(self, start, stop):
+        """Returns the atoms in a range of rows (e.g. those of one model) as a Structure whose columns are views of
+        this structure's columns, so nothing is parsed or copied
+        Inputs:
+        start, stop - [start, stop) range of rows (type int)
+        Output:
+        Structure of the atoms in the range (type Structure)"""
+        columns = {field: getattr(self, field)[start:stop] for field in ATOM_COLUMNS.keys()}
+        return Structure.from_columns(self.lines, self.line_index[start:stop], columns)
+
+    def __len__(self):
+        """Returns the number of atoms in the structure"""
+        return len(self.line_index)
+
+    @property
+    def coords(self):
+        """Coordinates of every atom as an array with one row of x, y and z per atom"""
+        return np.column_stack((self.x, self.y, self.z))
+
+    def get_lines(self, rows):
+        """Returns the lines of the file that the given atoms were read from
+        Input:
+        rows - indices of atoms, or a boolean mask over all atoms (type int or bool array)
+        Output:
+        Lines of the file for the atoms, in file order (list of string lines)"""
+        return [self.lines[idx] for idx in self.line_index[rows]]
+
+    @property
+    def chain_ranges(self):
+        """Index of the atoms of each record type and chain, as a dictionary with (record type, chain ID) tuples as keys
+        and arrays of [start, stop) atom row ranges as values. Chains are usually contiguous in the file, so each chain
+        normally has one range per record type. The dictionary is in the order the chains first appear in the file."""
+        if self._chain_ranges is None:
+            # Find the rows where the record type or chain ID differs from the row before, which start each range
+            changed = np.flatnonzero((self.record[1:] != self.record[:-1]) | (self.chain[1:] != self.chain[:-1])) + 1
+            starts = np.concatenate(([0], changed)) if len(self) > 0 else changed
+            stops = np.concatenate((changed, [len(self)]))
+            ranges = {}
+            # There is only one range for each run of records, so this loop is over runs rather than atoms
+            for (start, stop) in zip(starts.tolist(), stops.tolist()):
+                ranges.setdefault((str(self.record[start]), str(self.chain[start])), []).append((start, stop))
+            self._chain_ranges = {key: np.array(value, dtype=np.int64) for key, value in ranges.items()}
+        return self._chain_ranges
+
+    @property
+    def residue_starts(self):
+        """Atom row at which each residue starts, with the number of atoms added at the end, so that the atoms of
+        residue i are rows residue_starts[i] to residue_starts[i+1]. A new residue starts wherever the record type,
+        chain ID, residue number, insertion code or residue name changes."""
+        if self._residue_starts is None:
+            changed = ((self.record[1:] != self.record[:-1]) | (self.chain[1:] != self.chain[:-1])
+                       | (self.resseq[1:] != self.resseq[:-1]) | (self.icode[1:] != self.icode[:-1])
+                       | (self.resname[1:] != self.resname[:-1]))
+            starts = np.flatnonzero(changed) + 1
+            self._residue_starts = np.concatenate(([0] if len(self) > 0 else [], starts, [len(self)])).astype(np.int64)
+        return self._residue_starts
+
+    def chain_ids(self, records=("ATOM", "HETATM")):
+        """Returns the chain IDs with atoms of the given record types, in the order they first appear in the file
+        Input:
+        records - record types to include (list or tuple of strings)
+        Output:
+        Chain IDs (list of strings)"""
+        chain_ids = []
+        for (record, chain_id) in self.chain_ranges.keys():
+            if (record in records) and (chain_id not in chain_ids):
+                chain_ids.append(chain_id)
+        return chain_ids
+
+    def chain_rows(self, chain_id, records=("ATOM", "HETATM")):
+        """Returns the rows of the atoms of one chain, only looking at the ranges of that chain in the index
+        Inputs:
+        chain_id - Chain ID of the atoms (type string)
+        records - record types to include (list or tuple of strings)
+        Output:
+        Rows of the atoms in file order (type int array)"""
+        ranges = [self.chain_ranges[(record, chain_id)] for record in records if (record, chain_id) in self.chain_ranges]
+        if ranges == []:
+            return np.zeros(0, dtype=np.int64)
+        ranges = np.sort(np.concatenate(ranges), axis=0)
+        return np.concatenate([np.arange(start, stop) for (start, stop) in ranges.tolist()])
+
+    def chain_line_ranges(self, chain_id, records=("ATOM", "HETATM")):
+        """Returns the ranges of lines of the file holding the atoms of one chain
+        Inputs:
+        chain_id - Chain ID of the atoms (type string)
+        records - record types to include (list or tuple of strings)
+        Output:
+        [start, stop) line ranges, one row per range (type int array)"""
+        ranges = [self.chain_ranges[(record, chain_id)] for record in records if (record, chain_id) in self.chain_ranges]
+        if ranges == []:
+            return np.zeros((0, 2), dtype=np.int64)
+        ranges = np.sort(np.concatenate(ranges), axis=0)
+        return np.column_stack((self.line_index[ranges[:, 0]], self.line_index[ranges[:, 1] - 1] + 1))
+
+    def rename_chain(self, old_chain_id, new_chain_id, lines):
+        """Returns a copy of the structure with one chain ID changed, without parsing the lines again
+        Inputs:
+        old_chain_id - Chain ID to change (type string)
+        new_chain_id - Chain ID that the old ID will be replaced with (type string)
+        lines - lines of the file with the chain ID already changed (list of string lines)
+        Output:
+        Structure for the changed lines"""
+        return self.remap_chains({old_chain_id: new_chain_id}, lines)
+
+    def remap_chains(self, mapping, lines):
+        """Returns a copy of the structure with any number of chain IDs changed at once, without parsing the lines
+        again. The atoms of each chain are found before any are changed, so chains can be swapped.
+        Inputs:
+        mapping - new chain ID for each old chain ID (dictionary of string: string)
+        lines - lines of the file with the chain IDs already changed (list of string lines)
+        Output:
+        Structure for the changed lines"""
+        renamed = copy.copy(self)
+        renamed.lines = lines
+        renamed.chain = self.chain.copy()
+        for (old_chain_id, new_chain_id) in mapping.items():
+            renamed.chain[self.chain_rows(old_chain_id)] = new_chain_id
+        # The indices are built again for the new chain IDs when needed (the spatial grids are kept, as no atom moves)
+        renamed._chain_ranges = None
+        renamed._residue_starts = None
+        renamed._models = None
+        renamed._masks = {}
+        return renamed
+
+    def model_lines(self):
+        """Returns the indices of the MODEL lines before or between the atoms. Only the lines that are not coordinate
+        lines need to be looked at (the header, and TER, ENDMDL and MODEL lines), so the file is not scanned again.
+        Output:
+        Indices of the MODEL lines (type int array)"""
+        starts = np.concatenate(([0], self.line_index[:-1] + 1)) if len(self) > 0 else np.zeros(0, dtype=np.int64)
+        gaps = self.line_index > starts
+        model_lines = [idx for (start, stop) in zip(starts[gaps].tolist(), self.line_index[gaps].tolist())
+                       for idx in range(start, stop) if self.lines[idx].startswith("MODEL")]
+        return np.array(model_lines, dtype=np.int64)
+
+    @property
+    def model_ranges(self):
+        """[start, stop) range of atom rows of each model, one row per model. Files without MODEL records have one
+        model holding every atom."""
+        if self._model_ranges is None:
+            line_ranges = _model_line_ranges(self.lines, self.model_lines())
+            self._model_ranges = np.searchsorted(self.line_index, line_ranges).astype(np.int64)
+        return self._model_ranges
+
+    @property
+    def models(self):
+        """The models of the structure (type Models). Each model is a Structure of views of this structure's columns,
+        made when it is first accessed."""
+        if self._models is None:
+            self._models = Models(self.lines, self)
+        return self._models
+
+    def first_model_rows(self, rows):
+        """Returns the given rows that are in the first model, so that a file with several models (e.g. an NMR
+        ensemble) gives each residue once
+        Input:
+        rows - rows of atoms, in file order (type int array)
+        Output:
+        Rows of the atoms in the first model (type int array)"""
+        # Models without atoms are skipped (e.g. the other models, for a structure of one model from atom_range)
+        model_ranges = self.model_ranges[self.model_ranges[:, 1] > self.model_ranges[:, 0]]
+        if len(model_ranges) <= 1:
+            return rows
+        return rows[(rows >= model_ranges[0, 0]) & (rows < model_ranges[0, 1])]
+
+    def grid(self, cell_size=None):
+        """Returns the spatial grid of the atoms, built the first time it is used and kept for later queries
+        Input:
+        cell_size - length of the side of each cell in Angstroms (GRID_CELL_SIZE if None) (type float)
+        Output:
+        Grid of the atoms (type SpatialGrid)"""
+        cell_size = float(cell_size if cell_size is not None else GRID_CELL_SIZE)
+        grid = self._grids.get(cell_size)
+        if grid is None:
+            grid = SpatialGrid(self.coords, cell_size)
+            self._grids[cell_size] = grid
+        return grid
+
+    def mask(self, selection):
+        """Returns True for each atom of a selection and False for every other atom. The masks of selection strings
+        are kept, so a selection used again is not evaluated again.
+        Input:
+        selection - selection string (e.g. "chain A and resname HIS and resseq 10:50 and name CA", see
+        compile_selection), rows of atoms (type int array or list), a boolean mask over all atoms, or None for every atom
+        Output:
+        Mask over all atoms (type bool array)"""
+        if isinstance(selection, str):
+            mask = self._masks.get(selection)
+            if mask is None:
+                # Keep only a limited number of masks, as each holds one value for every atom
+                if len(self._masks) >= MAX_KEPT_MASKS:
+                    self._masks.clear()
+                mask = compile_selection(selection)(self)
+                self._masks[selection] = mask
+            return mask
+        if selection is None:
+            return np.ones(len(self), dtype=bool)
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.selection_rows(selection)] = True
+        return mask
+
+    def selection_rows(self, selection):
+        """Returns the rows of the atoms of a selection
+        Input:
+        selection - selection string (see compile_selection), rows of atoms (type int array or list), a boolean mask
+        over all atoms, or None for every atom
+        Output:
+        Rows of the atoms (type int array)"""
+        if selection is None:
+            return np.arange(len(self))
+        if isinstance(selection, str):
+            return np.flatnonzero(self.mask(selection))
+        selection = np.asarray(selection)
+        if selection.dtype == bool:
+            return np.flatnonzero(selection)
+        return selection.astype(np.int64).ravel()
+
+    def atom_rows(self, chain_id=None, names=None, records=("ATOM",)):
+        """Returns the rows of the atoms of one chain (or every chain) with the given atom names, e.g. the alpha-carbons
+        of chain A with atom_rows("A", ("CA",))
+        Inputs:
+        chain_id - Chain ID of the atoms, or None for every chain (type string)
+        names - atom names to include (e.g. ("CA",) or ("N", "CA", "C", "O")), or None for every atom (list or tuple of strings)
+        records - record types to include (list or tuple of strings)
+        Output:
+        Rows of the atoms in file order (type int array)"""
+        rows = _record_rows(self, records, chain_id)
+        if names is not None:
+            rows = rows[np.isin(self.name[rows], names)]
+        return rows
+
+    def masses(self, rows=None):
+        """Returns the mass of each atom in daltons, from its element symbol, or from the atom name if the element
+        column is blank (as in older files). Atoms of unknown elements have a mass of 0.
+        Input:
+        rows - rows of the atoms, or None for every atom (type int array)
+        Output:
+        Masses (type float array)"""
+        elements = self.element if rows is None else self.element[rows]
+        names = self.name if rows is None else self.name[rows]
+        # Atom names start with the element symbol, after any leading digits (e.g. 1HB for a hydrogen)
+        blank = (elements == "")
+        if blank.any():
+            elements = elements.copy()
+            elements[blank] = np.char.lstrip(names[blank], "0123456789").astype("U1")
+        # Look up each different symbol once
+        (symbols, inverse) = np.unique(elements, return_inverse=True)
+        masses = np.array([ELEMENT_MASSES.get(symbol.upper(), 0.0) for symbol in symbols.tolist()])
+        return masses[inverse.ravel()] if len(masses) > 0 else np.zeros(0)
+
+    def ligand_rows(self, resname=None, chain_id=None):
+        """Returns the rows of the HETATM atoms that are not water (e.g. ligands, ions and modified residues), which
+        can be used as a selection in atoms_within and contacts
+        Inputs:
+        resname - only atoms of residues with this name (e.g. "HEM"), or None for any (type string)
+        chain_id - only atoms of this chain, or None for any (type string)
+        Output:
+        Rows of the atoms in file order (type int array)"""
+        selected = (self.record == "HETATM") & ~np.isin(self.resname, WATER_NAMES)
+        if resname is not None:
+            selected &= (self.resname == resname)
+        if chain_id is not None:
+            selected &= (self.chain == chain_id)
+        return np.flatnonzero(selected)
+
+    def atoms_within(self, point_or_selection, radius):
+        """Finds every atom within a distance of a point, of several points, or of any atom of a selection, using the
+        spatial grid, so only atoms in nearby cells are looked at. The atoms of a selection are within 0 of themselves,
+        so they are included.
+        Inputs:
+        point_or_selection - x, y and z of a point, or an array with one row per point (type float array), or a
+        selection of atoms (a selection string, rows as an int array, or a boolean mask)
+        radius - distance in Angstroms (type float)
+        Output:
+        Rows of the atoms found, in file order (type int array)"""
+        if isinstance(point_or_selection, str):
+            point_or_selection = self.selection_rows(point_or_selection)
+        point_or_selection = np.asarray(point_or_selection)
+        if point_or_selection.dtype.kind == "f":
+            points = point_or_selection.reshape(-1, 3)
+        else:
+            points = self.coords[self.selection_rows(point_or_selection)]
+        (_, rows, _) = self.grid().pairs(points, radius)
+        return np.unique(rows)
+
+    def contacts(self, sel_a, sel_b, cutoff):
+        """Finds every pair of an atom of one selection and an atom of another selection that are at most a distance
+        apart, using the spatial grid. An atom in both selections is not paired with itself.
+        Inputs:
+        sel_a, sel_b - selections of atoms (selection strings, rows as int arrays, boolean masks, or None for every atom)
+        cutoff - largest distance in Angstroms (type float)
+        Output:
+        Rows of the atoms of sel_a, rows of the atoms of sel_b, and the distances of the pairs, sorted by the rows of
+        sel_a then sel_b (tuple of int, int and float arrays)"""
+        rows_a = self.selection_rows(sel_a)
+        rows_b = self.selection_rows(sel_b)
+        # Query the grid with the smaller selection, and keep the atoms found that are in the other one
+        swapped = len(rows_b) < len(rows_a)
+        (query_rows, other_rows) = (rows_b, rows_a) if swapped else (rows_a, rows_b)
+        in_other = np.zeros(len(self), dtype=bool)
+        in_other[other_rows] = True
+        (point_idx, found, distances) = self.grid().pairs(self.coords[query_rows], cutoff)
+        found_from = query_rows[point_idx]
+        keep = in_other[found] & (found != found_from)
+        (found_from, found, distances) = (found_from[keep], found[keep], distances[keep])
+        if swapped:
+            (found_from, found) = (found, found_from)
+        order = np.lexsort((found, found_from))
+        return (found_from[order], found[order], distances[order])
+
+def _atom_chars(lines, start=0, stop=None):
+    """Finds the ATOM and HETATM lines of a list of lines, and returns them as a 2D array of characters
+    Inputs:
+    lines - file contents of pdb file (list of string lines)
+    start, stop - range of lines to look at (every line by default) (type int)
+    Output:
+    Indices of the coordinate lines (type int array)
+    Characters of each coordinate line padded to 80 with spaces, one row per line (type uint8 array)"""
+    if (start, stop) != (0, None):
+        line_index = [idx for idx, line in enumerate(lines[start:stop], start) if line.startswith(("ATOM", "HETATM"))]
+    else:
+        line_index = [idx for idx, line in enumerate(lines) if line.startswith(("ATOM", "HETATM"))]
+    # Put all coordinate lines, padded to 80 characters, into one string and view it as rows of 80 characters
+    text = "".join([lines[idx][:80].ljust(80) for idx in line_index])
+    chars = np.frombuffer(text.encode("ascii", "replace"), dtype=np.uint8).reshape(len(line_index), 80)
+    return (np.array(line_index, dtype=np.int64), chars)
+
+def _gather_atom_chars(data, starts, ends):
+    """Finds the ATOM and HETATM lines in the bytes of a file, and gathers them into a 2D array of characters,
+    without decoding any lines
+    Inputs:
+    data - bytes of the file (type uint8 array)
+    starts, ends - byte offsets of the start and end of each line (type int arrays)
+    Output:
+    Indices of the coordinate lines (type int array)
+    Characters of each coordinate line padded to 80 with spaces, one row per line (type uint8 array)"""
+    if len(data) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros((0, 80), dtype=np.uint8))
+    # Look at the first 6 bytes of every line (bytes past the end of a line are treated as spaces)
+    first = _gather_columns(data, starts, ends, 6)
+    is_atom = np.all(first[:, :4] == np.frombuffer(b"ATOM", dtype=np.uint8), axis=1)
+    is_hetatm = np.all(first == np.frombuffer(b"HETATM", dtype=np.uint8), axis=1)
+    line_index = np.flatnonzero(is_atom | is_hetatm)
+    return (line_index, _gather_columns(data, starts[line_index], ends[line_index], 80))
+
+def _gather_columns(data, starts, ends, width):
+    """Returns the first characters of each line as a 2D array, padding lines shorter than width with spaces
+    Inputs:
+    data - bytes of the file (type uint8 array)
+    starts, ends - byte offsets of the start and end of each line (type int arrays)
+    width - number of characters to take from each line (type int)
+    Output:
+    Characters of each line, one row per line (type uint8 array)"""
+    offsets = starts[:, None] + np.arange(width)
+    inside = offsets < ends[:, None]
+    return np.where(inside, data[np.minimum(offsets, len(data) - 1)], ord(" ")).astype(np.uint8)
+
+def _to_numbers(column, dtype, blank):
+    """Converts a column of fixed-width byte strings to numbers, using the blank value for empty fields
+    Inputs:
+    column - field sliced from each line (type bytes array)
+    dtype - NumPy type to convert to
+    blank - value used for empty fields, or fields that are not a number
+    Output:
+    Converted column (type dtype array)"""
+    column = np.char.strip(column)
+    column[column == b""] = str(blank).encode()
+    try:
+        return column.astype(dtype)
+    # A few files have fields that are not plain numbers (e.g. hybrid-36 serial numbers), so convert one at a time
+    except ValueError:
+        convert = float if np.issubdtype(dtype, np.floating) else int
+        numbers = np.full(len(column), blank, dtype=dtype)
+        for idx, value in enumerate(column):
+            try:
+                numbers[idx] = convert(value)
+            except ValueError:
+                pass
+        return numbers
+
+def get_structure(lines):
+    """Returns the Structure for the lines of a PDB file. If the lines were returned by download_pdb, the structure is
+    only parsed the first time, and kept with the lines for later queries.
+    Input:
+    lines - file contents of pdb file (list of string lines), or a Structure
+    Output:
+    Parsed structure of the ATOM and HETATM records (type Structure)"""
+    # Structures are used as they are
+    if isinstance(lines, Structure):
+        return lines
+    structure = getattr(lines, "structure", None)
+    # Parse the lines if they have not been parsed already, keeping the structure if the lines are a PDBLines list
+    if structure is not None:
+        pdbprofile.add("structure_cache_hits")
+    else:
+        structure = Structure(lines)
+        if isinstance(lines, PDBLines):
+            lines.structure = structure
+    return structure
+
+# Length of the side of each cell of the spatial grid in Angstroms: around the distance of most contact queries, so
+# most queries only look at the cells next to each point
+GRID_CELL_SIZE = 4.0
+# Number of (point, nearby cell) pairs looked up in the grid at once; larger queries are split, so the candidate pairs
+# of each part fit in memory
+GRID_QUERY_CHUNK = 1 << 20
+# Residue names of water, which ligand_rows leaves out
+WATER_NAMES = ("HOH", "WAT", "DOD", "H2O")
+
+class SpatialGrid:
+    """Uniform grid of cubic cells over the atoms of a structure, for finding the atoms near a point without measuring
+    the distance to every atom. The atoms are sorted by the cell they are in, so the atoms of a cell are one run of the
+    sorted atoms. Building the grid and each query take time proportional to the number of atoms and points (atoms
+    with unknown coordinates are left out).
+    Attributes:
+    cell_size - length of the side of each cell in Angstroms (type float)
+    origin - lowest x, y and z of the atoms, the corner of the first cell (type float array)
+    shape - number of cells along x, y and z (type int array)
+    rows - rows of the atoms, sorted by cell (type int array)
+    coords - coordinates of the atoms, in the same order as rows (type float array)
+    cell_keys - number of each cell with any atoms, in increasing order (type int array)
+    cell_starts - position in rows of the first atom of each cell, with the number of atoms added at the end (type int array)"""
+
+    def __init__(self, coords, cell_size=GRID_CELL_SIZE):
+        """Sorts the atoms into cells
+        Inputs:
+        coords - coordinates of every atom, one row of x, y and z per atom (type float array)
+        cell_size - length of the side of each cell in Angstroms (type float)"""
+        self.cell_size = float(cell_size)
+        valid = np.flatnonzero(np.all(np.isfinite(coords), axis=1))
+        self.origin = coords[valid].min(axis=0) if len(valid) > 0 else np.zeros(3)
+        cells = np.floor((coords[valid] - self.origin) / self.cell_size).astype(np.int64)
+        self.shape = cells.max(axis=0) + 1 if len(valid) > 0 else np.ones(3, dtype=np.int64)
+        keys = self._keys(cells)
+        order = np.argsort(keys, kind="stable")
+        self.rows = valid[order]
+        self.coords = np.ascontiguousarray(coords[self.rows])
+        (self.cell_keys, starts) = np.unique(keys[order], return_index=True)
+        self.cell_starts = np.append(starts, len(order)).astype(np.int64)
+
+    def _keys(self, cells):
+        """Returns the number of each cell from its x, y and z cell indices"""
+        return (cells[:, 0] * self.shape[1] + cells[:, 1]) * self.shape[2] + cells[:, 2]
+
+    def pairs(self, points, radius):
+        """Finds every atom within a distance of each of the points. Only the cells that could hold such an atom are
+        looked at: each point is paired with every nearby cell at once, then with the atoms of those cells.
+        Inputs:
+        points - coordinates of the points, one row of x, y and z per point (type float array)
+        radius - distance in Angstroms (type float)
+        Output:
+        Index of the point, row of the atom and distance of each pair found (tuple of int, int and float arrays)"""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        found = ([np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0)])
+        if (len(self.cell_keys) == 0) or (radius < 0):
+            return tuple(np.concatenate(parts) for parts in found)
+        reach = int(np.ceil(radius / self.cell_size))
+        # Offsets to the nearby cells, leaving out cells whose nearest corner is further away than the radius
+        offsets = np.array([offset for offset in itertools.product(range(-reach, reach + 1), repeat=3)
+                            if self.cell_size * np.sqrt(sum(max(abs(step) - 1, 0) ** 2 for step in offset)) <= radius], dtype=np.int64)
+        chunk_size = max(1, GRID_QUERY_CHUNK // len(offsets))
+        for chunk_start in range(0, len(points), chunk_size):
+            chunk = points[chunk_start:chunk_start + chunk_size]
+            valid = np.all(np.isfinite(chunk), axis=1)
+            cells = np.floor((np.where(valid[:, np.newaxis], chunk, 0) - self.origin) / self.cell_size).astype(np.int64)
+            # Every nearby cell of every point, one row per (point, offset)
+            neighbours = (cells[:, np.newaxis, :] + offsets).reshape(-1, 3)
+            point_idx = np.repeat(np.arange(len(chunk)), len(offsets))
+            inside = np.repeat(valid, len(offsets)) & np.all((neighbours >= 0) & (neighbours < self.shape), axis=1)
+            (neighbours, point_idx) = (neighbours[inside], point_idx[inside])
+            # Find each nearby cell among the cells with atoms
+            keys = self._keys(neighbours)
+            positions = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+            hit = self.cell_keys[positions] == keys
+            (point_idx, positions) = (point_idx[hit], positions[hit])
+            starts = self.cell_starts[positions]
+            counts = self.cell_starts[positions + 1] - starts
+            # Pair each point with every atom of its nearby cells: the atoms of a cell follow each other in rows
+            pair_points = np.repeat(point_idx, counts)
+            pair_atoms = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+            squared = ((self.coords[pair_atoms] - chunk[pair_points]) ** 2).sum(axis=1)
+            close = squared <= radius * radius
+            found[0].append(pair_points[close] + chunk_start)
+            found[1].append(self.rows[pair_atoms[close]])
+            found[2].append(np.sqrt(squared[close]))
+        return tuple(np.concatenate(parts) for parts in found)
+
+def _model_line_ranges(lines, model_lines=None):
+    """Finds the [start, stop) range of lines of each model: from each MODEL line to the next one (the last model
+    goes on to the end of the file). Files without MODEL records have one model, holding every line.
+    Inputs:
+    lines - file contents of pdb file (list of string lines)
+    model_lines - indices of the MODEL lines if already known, or None to look for them in every line (type int array)
+    Output:
+    Range of lines of each model, one row per model (type int array)"""
+    if model_lines is None and isinstance(lines, MappedLines):
+        model_lines = lines.model_lines()
+    elif model_lines is None:
+        model_lines = np.array([idx for idx, line in enumerate(lines) if line.startswith("MODEL")], dtype=np.int64)
+    if len(model_lines) == 0:
+        return np.array([[0, len(lines)]], dtype=np.int64)
+    return np.column_stack((model_lines, np.append(model_lines[1:], len(lines)))).astype(np.int64)
+
+class Models(Sequence):
+    """Read-only list of the models of a PDB file (e.g. the conformers of an NMR ensemble), each a Structure. The
+    MODEL lines are found once, when the list is made, and a model is only parsed the first time it is accessed (or,
+    if the whole file has already been parsed, taken from that structure without parsing). Files without MODEL
+    records have one model.
+    Attributes:
+    lines - file contents of pdb file (list of string lines)
+    line_ranges - [start, stop) range of lines of each model, one row per model (type int array)"""
+
+    def __init__(self, lines, structure=None):
+        """Finds the lines of each model
+        Inputs:
+        lines - file contents of pdb file (list of string lines)
+        structure - structure already parsed from every line, to take the models from, or None (type Structure)"""
+        self.lines = lines
+        # A parsed structure knows where its MODEL lines are without looking at every line
+        self.line_ranges = _model_line_ranges(lines, structure.model_lines() if structure is not None else None)
+        self._structure = structure
+        self._models = {}
+
+    def __len__(self):
+        """Returns the number of models"""
+        return len(self.line_ranges)
+
+    def __getitem__(self, idx):
+        """Returns the model (or list of models for a slice) at the given index (type Structure)"""
+        if isinstance(idx, slice):
+            return [self[model_idx] for model_idx in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not (0 <= idx < len(self)):
+            raise IndexError("model index out of range")
+        model = self._models.get(idx)
+        if model is None:
+            structure = self._structure if self._structure is not None else getattr(self.lines, "structure", None)
+            if structure is not None:
+                (start, stop) = structure.model_ranges[idx]
+                model = structure.atom_range(start, stop)
+            else:
+                model = Structure(self.lines, tuple(self.line_ranges[idx]))
+            self._models[idx] = model
+        return model
+
+    def coords(self, chain_id=None, names=None, records=("ATOM",)):
+        """Returns the coordinates of the chosen atoms of every model stacked into one array, for ensemble statistics
+        (e.g. the mean structure, or superpose and rmsd against the first model). Every model must have the same
+        number of chosen atoms.
+        Inputs:
+        chain_id - Chain ID of the atoms, or None for every chain (type string)
+        names - atom names to include (e.g. ("CA",)), or None for every atom (list or tuple of strings)
+        records - record types to include (list or tuple of strings)
+        Output:
+        Coordinates, of shape (models, atoms, 3), or an empty array of shape (0, 0, 3) if the models have different
+        numbers of atoms (type float array)"""
+        coords = [model.coords[model.atom_rows(chain_id, names, records)] for model in self]
+        if len({len(model_coords) for model_coords in coords}) > 1:
+            print("The models have different numbers of atoms, so their coordinates could not be stacked.")
+            return np.zeros((0, 0, 3))
+        return np.stack(coords) if coords != [] else np.zeros((0, 0, 3))
+
+def get_models(lines):
+    """Returns the models of the lines of a PDB file. If the lines were returned by download_pdb, the models are
+    found once and kept with the lines; if the lines have already been parsed, the models are taken from the parsed
+    structure, and otherwise each model is parsed only when it is first accessed.
+    Input:
+    lines - file contents of pdb file (list of string lines), or a Structure
+    Output:
+    Models of the file (type Models)"""
+    if isinstance(lines, Structure):
+        return lines.models
+    models = getattr(lines, "models", None)
+    if models is None:
+        structure = getattr(lines, "structure", None)
+        models = structure.models if structure is not None else Models(lines)
+        if isinstance(lines, (PDBLines, MappedLines)):
+            lines.models = models
+    return models
+
+# Atom selections: a selection string such as "chain A and resname HIS and resseq 10:50 and name CA" is compiled once
+# into a function that builds a boolean mask over the atoms of a structure from its columns, with one array operation
+# for each test.
+#
+# Tests (several values may be given, separated by spaces or commas, and match any of them):
+# chain, resname, name, element, altloc, icode, record - text columns, e.g. "chain A B", "resname HIS,HID", "name C*"
+# (a value ending in * matches any value starting with the rest)
+# resseq (or resid), serial, model - whole numbers or inclusive ranges, e.g. "resseq 10:50 60", "resseq :20", "model 1"
+# (models are numbered from 1)
+# resseq, serial, bfactor, occupancy, x, y, z - compared with <, <=, >, >=, == or !=, e.g. "bfactor > 40"
+# all, none, protein (ATOM records), hetero (HETATM records), water, ligand (HETATM records other than water)
+# Tests are combined with not, and, or (in that order of precedence) and parentheses, and "within 5 of <selection>"
+# selects every atom within 5 Angstroms of any atom of the selection (using the spatial grid).
+
+# Largest number of selection masks kept with each structure
+MAX_KEPT_MASKS = 32
+# Text columns that can be tested in a selection, and the column each name tests
+SELECTION_TEXT_FIELDS = {"chain": "chain", "resname": "resname", "name": "name", "element": "element",
+                         "altloc": "altloc", "icode": "icode", "record": "record"}
+# Number columns that can be tested in a selection, and the column each name tests
+SELECTION_NUMBER_FIELDS = {"resseq": "resseq", "resid": "resseq", "serial": "serial", "bfactor": "bfactor",
+                           "occupancy": "occupancy", "x": "x", "y": "y", "z": "z", "model": "model"}
+# Comparison operators allowed after a number column
+SELECTION_OPERATORS = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal,
+                       "==": np.equal, "=": np.equal, "!=": np.not_equal}
+# Tests that need no value
+SELECTION_KEYWORDS = {"all": lambda structure: np.ones(len(structure), dtype=bool),
+                      "none": lambda structure: np.zeros(len(structure), dtype=bool),
+                      "protein": lambda structure: structure.record == "ATOM",
+                      "hetero": lambda structure: structure.record == "HETATM",
+                      "water": lambda structure: np.isin(structure.resname, WATER_NAMES),
+                      "ligand": lambda structure: (structure.record == "HETATM") & ~np.isin(structure.resname, WATER_NAMES)}
+
+class SelectionError(ValueError):
+    """Raised when a selection string cannot be compiled"""
+
+def _tokenize_selection(text):
+    """Splits a selection string into words, parentheses and comparison operators (commas separate values like spaces)"""
+    return re.findall(r"\(|\)|<=|>=|==|!=|<|>|=|[^\s(),<>=!]+", text)
+
+class _SelectionParser:
+    """Recursive descent parser that turns the words of a selection string into a function of a structure that
+    returns a mask over its atoms"""
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize_selection(text)
+        self.position = 0
+
+    def error(self, message):
+        """Raises a SelectionError naming the selection"""
+        raise SelectionError("{0} in selection '{1}'".format(message, self.text))
+
+    def peek(self):
+        """Returns the next word in lower case, or None at the end"""
+        return self.tokens[self.position].lower() if self.position < len(self.tokens) else None
+
+    def take(self):
+        """Returns the next word, and moves past it"""
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self):
+        """Parses the whole selection"""
+        if self.tokens == []:
+            self.error("Empty selection")
+        function = self.parse_or()
+        if self.peek() is not None:
+            self.error("Unexpected '{0}'".format(self.tokens[self.position]))
+        return function
+
+    def parse_or(self):
+        function = self.parse_and()
+        while self.peek() == "or":
+            self.take()
+            (left, right) = (function, self.parse_and())
+            function = lambda structure, left=left, right=right: left(structure) | right(structure)
+        return function
+
+    def parse_and(self):
+        function = self.parse_not()
+        while self.peek() == "and":
+            self.take()
+            (left, right) = (function, self.parse_not())
+            function = lambda structure, left=left, right=right: left(structure) & right(structure)
+        return function
+
+    def parse_not(self):
+        word = self.peek()
+        if word == "not":
+            self.take()
+            inner = self.parse_not()
+            return lambda structure: ~inner(structure)
+        if word == "within":
+            self.take()
+            radius = self.number(self.take() if self.peek() is not None else "")
+            if self.peek() != "of":
+                self.error("Expected 'of' after 'within {0}'".format(radius))
+            self.take()
+            inner = self.parse_not()
+            return lambda structure: structure.mask(structure.atoms_within(np.flatnonzero(inner(structure)), radius))
+        if word == "(":
+            self.take()
+            function = self.parse_or()
+            if self.peek() != ")":
+                self.error("Missing ')'")
+            self.take()
+            return function
+        return self.parse_test()
+
+    def values(self):
+        """Returns the values after a column name, up to the next and, or or closing parenthesis"""
+        values = []
+        while self.peek() not in (None, "and", "or", ")", "("):
+            values.append(self.take())
+        return values
+
+    def number(self, word):
+        """Converts a word to a number, or raises a SelectionError"""
+        try:
+            return float(word)
+        except ValueError:
+            self.error("Expected a number but found '{0}'".format(word))
+
+    def parse_test(self):
+        word = self.peek()
+        if word is None:
+            self.error("Expected a test")
+        self.take()
+        if word in SELECTION_KEYWORDS:
+            return SELECTION_KEYWORDS[word]
+        if word in SELECTION_TEXT_FIELDS:
+            return self.text_test(SELECTION_TEXT_FIELDS[word], word)
+        if word in SELECTION_NUMBER_FIELDS:
+            return self.number_test(SELECTION_NUMBER_FIELDS[word], word)
+        self.error("Unknown test '{0}'".format(self.tokens[self.position - 1]))
+
+    def text_test(self, field, word):
+        """Test of a text column against one or more values, where a value ending in * matches by its start"""
+        values = self.values()
+        if values == []:
+            self.error("Expected a value after '{0}'".format(word))
+        exact = [value for value in values if not value.endswith("*")]
+        prefixes = tuple(value[:-1] for value in values if value.endswith("*"))
+        def test(structure):
+            column = getattr(structure, field)
+            mask = np.isin(column, exact) if exact != [] else np.zeros(len(column), dtype=bool)
+            for prefix in prefixes:
+                mask |= np.char.startswith(column, prefix)
+            return mask
+        return test
+
+    def number_test(self, field, word):
+        """Test of a number column: a comparison, or one or more whole numbers and inclusive ranges"""
+        if self.peek() in SELECTION_OPERATORS:
+            operator = SELECTION_OPERATORS[self.take()]
+            if self.peek() is None:
+                self.error("Expected a number after '{0}'".format(word))
+            value = self.number(self.take())
+            return lambda structure: operator(_selection_column(structure, field), value)
+        values = self.values()
+        if values == []:
+            self.error("Expected a value after '{0}'".format(word))
+        ranges = []
+        for value in values:
+            (low, separator, high) = value.partition(":")
+            low = self.number(low) if low != "" else -np.inf
+            high = (self.number(high) if high != "" else np.inf) if separator else low
+            ranges.append((low, high))
+        def test(structure):
+            column = _selection_column(structure, field)
+            mask = np.zeros(len(column), dtype=bool)
+            for (low, high) in ranges:
+                mask |= (column >= low) & (column <= high)
+            return mask
+        return test
+
+def _selection_column(structure, field):
+    """Returns a number column for a selection, or for model the number of the model of each atom (from 1)"""
+    if field != "model":
+        return getattr(structure, field)
+    model_ranges = structure.model_ranges
+    model = np.zeros(len(structure), dtype=np.int64)
+    for (model_idx, (start, stop)) in enumerate(model_ranges.tolist()):
+        model[start:stop] = model_idx + 1
+    return model
+
+@functools.lru_cache(maxsize=256)
+def compile_selection(text):
+    """Compiles a selection string (see the description of selections above) into a function that returns a boolean
+    mask over the atoms of a structure. Compiled selections are kept, so each string is only parsed once.
     Input:
-    Unformatted file contents (type string)
+    text - selection string, e.g. "chain A and resname HIS and resseq 10:50 and name CA" (type string)
+    Output:
+    Function of a Structure returning True for each selected atom (type function)
+    Raises SelectionError if the selection is not valid"""
+    return _SelectionParser(text).parse()
+
+@pdbprofile.timed("query")
+def select(selection, lines):
+    """Returns the rows of the atoms matching a selection string (see compile_selection)
+    Inputs:
+    selection - selection string, e.g. "chain A and resname HIS and resseq 10:50 and name CA" (type string)
+    lines - file contents of pdb file (list of string lines), or a Structure
+    Output:
+    Rows of the selected atoms in file order (type int array)"""
+    return get_structure(lines).selection_rows(selection)
+
+def _select_rows(structure, rows, selection):
+    """Returns the rows that are also in a selection (all of them if the selection is None)"""
+    if selection is None:
+        return rows
+    return rows[structure.mask(selection)[rows]]
+
+def write_wrapped(fobject, contents, width=80):
+    """Writes a string to a file object with at most width characters on each line, ending with a newline. The
+    string is cut into slices of the line width, so the time taken grows linearly with its length.
+    Inputs:
+    fobject - file object opened for writing text (e.g. sys.stdout)
+    contents - string to write (type string)
+    width - number of characters on each line (type int)
+    Output:
+    None (writes the wrapped string)"""
+    for start in range(0, len(contents), width):
+        fobject.write(contents[start:start + width])
+        fobject.write("\n")
+    # An empty string is still ended with a newline, like print("")
+    if contents == "":
+        fobject.write("\n")
+
+def format_80(contents, width=80):
+    """Converts a string to a formatted string with 80 characters on each line
+    Inputs:
+    contents - Unformatted file contents (type string)
+    width - number of characters on each line (type int, 80 unless given)
     Output:
     Formatted file contents (type string)"""
-    formatted = ""
-    # Iterates through each index corresponding to a character in the string
-    for char_idx in range(len(contents)):
-        # If the end of the line is reached, add newline character and current character on new line
-        if ((char_idx % 80) == 0) and (char_idx != 0):
-            formatted += "\n" + contents[char_idx]
-        # Else add character to the line
+    # Join slices of the line width, rather than adding one character at a time
+    return "\n".join([contents[start:start + width] for start in range(0, len(contents), width)])
+
+class FastaWriter:
+    """Writes FASTA records to a file as they are given, wrapping sequences to a fixed line width, so that many
+    structures can be written into one multi-record FASTA file without building it in memory first. Files whose
+    names end in .gz are written gzip-compressed. Can be used in a with statement.
+    Attributes:
+    width - number of sequence characters on each line (type int)
+    records - number of records written (type int)"""
+
+    def __init__(self, filename_or_fileobj, width=80, append=False):
+        """Opens the FASTA file for writing
+        Inputs:
+        filename_or_fileobj - name of the FASTA file, including extension, or a file object opened for writing text
+        width - number of sequence characters on each line (type int)
+        append - if True, records are added to the end of an existing file instead of replacing it (type bool)"""
+        self.width = width
+        self.records = 0
+        mode = 'at' if append else 'wt'
+        if isinstance(filename_or_fileobj, (str, os.PathLike)):
+            if str(filename_or_fileobj).endswith(".gz"):
+                self._fobject = gzip.open(filename_or_fileobj, mode)
+            else:
+                self._fobject = open(filename_or_fileobj, mode, buffering=1 << 16)
+            self._close = True
         else:
-            formatted += contents[char_idx]
-    return formatted
+            self._fobject = filename_or_fileobj
+            self._close = False
+
+    @pdbprofile.timed("write")
+    def write(self, header, sequence):
+        """Writes one FASTA record
+        Inputs:
+        header - description of the sequence, without the > (type string)
+        sequence - sequence to write (type string)
+        Output:
+        None (writes the record)"""
+        self._fobject.write(">" + header + "\n")
+        write_wrapped(self._fobject, sequence, self.width)
+        self.records += 1
+        # Characters written: the header line, the sequence and one newline for each line of the sequence
+        pdbprofile.add("bytes_written", len(header) + 2 + len(sequence) + max(1, -(-len(sequence) // self.width)))
+
+    def close(self):
+        """Closes the file, unless it was given as a file object"""
+        if self._close:
+            self._fobject.close()
+        else:
+            self._fobject.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# Records that start the coordinate section; the header is every line before the first of them
+COORDINATE_RECORDS = ("ATOM", "HETATM", "MODEL")
+
+def _header_key(line):
+    """Returns the key a header line is indexed by: "REMARK n" for numbered remarks, "JRNL xxxx" for journal
+    subrecords (e.g. "JRNL TITL"), and the record name otherwise (e.g. "TITLE")"""
+    record = line[:6].strip()
+    if record == "REMARK":
+        return "REMARK " + line[6:10].strip()
+    if record == "JRNL":
+        return "JRNL " + line[12:16].strip()
+    return record
+
+def _header_text(line):
+    """Returns the text of a header line after its record name and continuation number"""
+    if line.startswith("JRNL"):
+        return line[19:]
+    if line.startswith("REMARK"):
+        return line[11:]
+    return line[10:]
+
+def _specification(text):
+    """Splits the text of a COMPND or SOURCE record into one dictionary of tokens per molecule
+    Input:
+    text - joined text of the record, e.g. "MOL_ID: 1; MOLECULE: HIV-1 PROTEASE; CHAIN: A, B;" (type string)
+    Output:
+    Tokens of each molecule (list of dictionaries of string: string)"""
+    molecules = []
+    for item in text.split(";"):
+        (token, colon, value) = item.partition(":")
+        token = token.strip()
+        if colon == "":
+            continue
+        if (token == "MOL_ID") or (molecules == []):
+            molecules.append({})
+        molecules[-1][token] = value.strip()
+    return molecules
+
+class Header:
+    """Index of the header records of a PDB file: every line before the first coordinate record, grouped by record so
+    that each detail is found without looking at any other line. Keys are the record name (e.g. "HEADER", "TITLE",
+    "COMPND", "SOURCE", "KEYWDS", "AUTHOR"), "REMARK n" for each numbered remark (e.g. "REMARK 2") and "JRNL xxxx"
+    for each journal subrecord (e.g. "JRNL TITL").
+    Attributes:
+    lines - the header lines (list of strings)
+    records - index of each line of the record, in file order, for each key (dictionary of string: list of ints)"""
 
-def print_details(details, lines):
+    @pdbprofile.timed("parse", "Header")
+    def __init__(self, lines):
+        """Indexes the header lines
+        Input:
+        lines - lines of the header, which may go on into the rest of the file (only the lines before the first
+        coordinate record are kept) (list of string lines)"""
+        self.lines = []
+        self.records = {}
+        for line in lines:
+            if line.startswith(COORDINATE_RECORDS):
+                break
+            self.records.setdefault(_header_key(line), []).append(len(self.lines))
+            self.lines.append(line)
+
+    def keys(self):
+        """Returns the key of every record in the header, in the order they first appear (list of strings)"""
+        return list(self.records.keys())
+
+    def get_lines(self, key):
+        """Returns every line of a record, including its continuation lines
+        Input:
+        key - record key, e.g. "TITLE", "REMARK 2" or "JRNL TITL" (type string)
+        Output:
+        Lines of the record, or an empty list if the record is not in the header (list of strings)"""
+        return [self.lines[line_idx] for line_idx in self.records.get(key, [])]
+
+    def text(self, key):
+        """Returns the text of a record, with its continuation lines joined and repeated spaces removed
+        Input:
+        key - record key, e.g. "TITLE", "REMARK 2" or "JRNL TITL" (type string)
+        Output:
+        Text of the record, or an empty string if the record is not in the header (type string)"""
+        return " ".join(" ".join(_header_text(line) for line in self.get_lines(key)).split())
+
+    def metadata(self):
+        """Returns the main details of the header, parsed
+        Output:
+        Details with the keys id_code, classification, deposition_date, title, compounds, sources, keywords,
+        experiment, authors, resolution and journal (type dictionary). Missing details are empty strings, empty
+        lists, or None for the resolution"""
+        header_lines = self.get_lines("HEADER")
+        header_line = header_lines[0] if header_lines != [] else ""
+        # Resolution is given on a REMARK 2 line as e.g. "RESOLUTION.    2.00 ANGSTROMS."
+        resolution = None
+        for line in self.get_lines("REMARK 2"):
+            words = _header_text(line).replace("RESOLUTION.", " ").split()
+            if line[11:22] == "RESOLUTION." and words != []:
+                try:
+                    resolution = float(words[0])
+                except ValueError:
+                    pass
+        return {"id_code": header_line[62:66].strip(), "classification": header_line[10:50].strip(),
+                "deposition_date": header_line[50:59].strip(), "title": self.text("TITLE"),
+                "compounds": _specification(self.text("COMPND")), "sources": _specification(self.text("SOURCE")),
+                "keywords": [word.strip() for word in self.text("KEYWDS").split(",") if word.strip() != ""],
+                "experiment": self.text("EXPDTA"),
+                "authors": [name.strip() for name in self.text("AUTHOR").split(",") if name.strip() != ""],
+                "resolution": resolution,
+                "journal": {subrecord: self.text("JRNL " + subrecord) for subrecord in ("AUTH", "TITL", "REF", "DOI", "PMID")}}
+
+def get_header(lines):
+    """Returns the header index for the lines of a PDB file. Only the lines before the first coordinate record are
+    looked at; if the lines were returned by download_pdb, the index is built once and kept with the lines.
+    Input:
+    lines - file contents of pdb file (list of string lines), or a Header
+    Output:
+    Header index (type Header)"""
+    if isinstance(lines, Header):
+        return lines
+    header = getattr(lines, "header", None)
+    if header is not None:
+        pdbprofile.add("header_cache_hits")
+    else:
+        # If the structure has been parsed, the first coordinate line is already known
+        structure = getattr(lines, "structure", None)
+        if (structure is not None) and (len(structure) > 0):
+            header = Header(lines[:int(structure.line_index[0])])
+        else:
+            header = Header(lines)
+        if isinstance(lines, (PDBLines, MappedLines)):
+            lines.header = header
+    return header
+
+@pdbprofile.timed("read")
+def read_header(filename_or_fileobj):
+    """Reads only the header of a PDB file (plain or compressed), stopping at the first coordinate record, so that
+    details can be found for many files without reading any of their coordinates
+    Input:
+    filename_or_fileobj - name of a file, or a file object opened in binary mode
+    Output:
+    Header index (type Header)"""
+    with open_pdb_file(filename_or_fileobj, background=False) as fobject:
+        return Header(line.rstrip("\n") for line in fobject)
+
+@pdbprofile.timed("query")
+def print_details(details, lines, width=80):
     """Prints each given detail from the list of details, each detail on a separate line. If the detail is longer than 80 characters, wrapping to the next line is performed.
     Inputs:
     details - Starting part of the line for each detail (type list)
-    lines - File contents of a PDB file as a list of strings
+    lines - File contents of a PDB file as a list of strings, or a Header
+    width - number of characters on each printed line (type int, 80 unless given)
     Output:
     None (formatted details printed to standard output)"""
-    # Iterate through each line
-    for line in lines:
-        # Iterate through each key in the dictionary
-        for starting_str in details.keys():
-            # If the key matches the start of the line
+    header = get_header(lines)
+    # Iterate through each key in the dictionary
+    for starting_str in details.keys():
+        # Only the lines of the record the key starts with are checked, if the key is a whole record (e.g. "TITLE"
+        # or "JRNL TITL"); otherwise (e.g. "JRNL" or "REM") every header line is checked
+        key = _header_key(starting_str.ljust(16))
+        for line in (header.get_lines(key) if key in header.records else header.lines):
+            # If the key matches the start of the line, add the contents of the line to the string for that key
             if line.startswith(starting_str):
-                # Get contents of the line (journal title contetns starts at a different index to the others), add to string for that key
-                if starting_str == "JRNL        TITL":
-                    details[starting_str] += line[17:-1]
-                else:
-                    details[starting_str] += line[10:-1]
+                details[starting_str] += _header_text(line)
     # Iterate through each item in the dictionary
     for key, value in details.items():
         # If the line was never found, print that could not find it
@@ -101,113 +1616,191 @@ def print_details(details, lines):
             print("There is no {0} in this PDB file.".format(key))
         # Else, print the formatted string contents
         else:
-            formatted = format_80((" ".join(value.split())))
-            print(formatted)
+            write_wrapped(sys.stdout, " ".join(value.split()), width)
 
-def get_prot_residues(chain_id, lines):
+@pdbprofile.timed("query")
+def get_prot_residues(chain_id, lines, selection=None):
     """Returns the single letter protein residues for a given chain_id of the PDB file
     Inputs:
     chain_id - Chain ID associated with protein residues to print (type string)
     lines - file contents of pdb file (list of string lines)
+    selection - selection string (see compile_selection); only residues with a selected atom are included (all if None)
     Output:
     1-letter protein residues for the chain ID (type string)
     """
-    # Dictionary with three-letter amino acid residues as keys, and one-letter aas as values
-    codes = {"ALA":"A", "ASX":"B", "CYS":"C", "ASP":"D", "GLU":"E", "PHE":"F", "GLY":"G", "HIS":"H", "ILE":"I", "LYS":"K", "LEU":"L", "MET":"M", "ASN":"N", "PRO":"P", 
-             "GLN":"Q", "ARG":"R", "SER":"S", "THR":"T", "SEC":"U", "VAL":"V", "TRP":"W", "XAA":"X", "TYR":"Y", "GLX":"Z"}
-    prot_res = ""
-    # Iterate through each line in the pdb file
-    for line in lines:
-        # Check that it is a line for a protein residue, carbon atom to not repeat the same residue, and find the correct chain
-        if (line.startswith("ATOM")) and ("CA" in line) and (line[21] == chain_id):
-            # Splice the three-letter amino acid code from the line
-            aa_three_code = line[17:20]
-            # Convert to 1-letter code using the dictionary codes, then add the code to the string of residues
-            prot_res += codes[aa_three_code]
+    structure = get_structure(lines)
+    # Select the first atom of each protein residue of the chain (one per residue, so residues are not repeated), in
+    # the first model only if the file has several
+    rows = _select_rows(structure, structure.chain_rows(chain_id, ("ATOM",)), selection)
+    selected = _first_residue_rows(structure, structure.first_model_rows(rows))
+    # Convert each three-letter amino acid code to its 1-letter code (X if unknown), then join them into one string
+    prot_res = _one_letter_codes(structure.resname[selected]).tobytes().decode("ascii")
     return prot_res
 
-def print_prot_residues(chain_id, lines):
+def _first_residue_rows(structure, rows):
+    """Returns the first atom of each residue among the given atoms. A new residue starts wherever the chain ID,
+    residue number or insertion code differs from the atom before, so alternate locations and residues without an
+    alpha-carbon are each counted once.
+    Inputs:
+    structure - parsed structure (type Structure)
+    rows - rows of atoms, in file order (type int array)
+    Output:
+    Row of the first atom of each residue (type int array)"""
+    return rows[_residue_boundaries(structure, rows)]
+
+def _residue_boundaries(structure, rows):
+    """Returns True for each of the given atoms that starts a new residue, and False otherwise (see _first_residue_rows)"""
+    chain = structure.chain[rows]
+    resseq = structure.resseq[rows]
+    icode = structure.icode[rows]
+    new_residue = np.ones(len(rows), dtype=bool)
+    new_residue[1:] = (chain[1:] != chain[:-1]) | (resseq[1:] != resseq[:-1]) | (icode[1:] != icode[:-1])
+    return new_residue
+
+def _one_letter_codes(resnames):
+    """Converts three-letter residue names to 1-letter codes (X if unknown), converting each different name once
+    Input:
+    resnames - three-letter residue names (type string array)
+    Output:
+    1-letter codes (type bytes array)"""
+    (names, inverse) = np.unique(resnames, return_inverse=True)
+    codes = np.array([PROTEIN_CODES.get(name, "X") for name in names.tolist()], dtype="S1")
+    return codes[inverse.ravel()] if len(codes) > 0 else np.zeros(0, dtype="S1")
+
+@pdbprofile.timed("query")
+def get_all_prot_sequences(lines, selection=None):
+    """Returns the single letter protein residues of every chain of the PDB file, found in one pass over the atoms (of
+    the first model only, if the file has several)
+    Inputs:
+    lines - file contents of pdb file (list of string lines)
+    selection - selection string (see compile_selection); only residues with a selected atom are included, and only
+    chains with a selected residue are returned (all if None)
+    Output:
+    1-letter protein residues of each chain, in the order the chains first appear (dictionary of chain ID: string)"""
+    structure = get_structure(lines)
+    # First atom of every protein residue in the file (or its first model), with its chain ID and 1-letter code
+    rows = _select_rows(structure, np.flatnonzero(structure.record == "ATOM"), selection)
+    first_rows = _first_residue_rows(structure, structure.first_model_rows(rows))
+    chains = structure.chain[first_rows]
+    codes = _one_letter_codes(structure.resname[first_rows])
+    # Group the codes by chain (keeping file order within each chain), then order the chains by first appearance
+    (chain_ids, first_idx, inverse) = np.unique(chains, return_index=True, return_inverse=True)
+    grouped = codes[np.argsort(inverse, kind="stable")].tobytes().decode("ascii")
+    ends = np.cumsum(np.bincount(inverse.ravel(), minlength=len(chain_ids)))
+    starts = ends - np.bincount(inverse.ravel(), minlength=len(chain_ids))
+    sequences = {}
+    for chain_idx in np.argsort(first_idx):
+        sequences[str(chain_ids[chain_idx])] = grouped[starts[chain_idx]:ends[chain_idx]]
+    return sequences
+
+@pdbprofile.timed("query")
+def print_prot_residues(chain_id, lines, selection=None):
     """Prints the single letter protein residues for a given chain_id of a PDB file
     Inputs:
     chain_id - Chain ID associated with protein residues to print (type string)
     lines - file contents of pdb file (list of string lines)
+    selection - selection string (see compile_selection); only residues with a selected atom are printed (all if None)
     Output:
-    1-letter protein residues for the chain ID (type string)
+    1-letter protein residues for the chain ID, or an empty string if none were found (type string)
     """
+    prot_res = ""
     # Check that chain ID is syntactically valid
     if is_valid_chain(chain_id):
         # Get the single letter protein residues for the chain
-        prot_res = get_prot_residues(chain_id, lines)
+        prot_res = get_prot_residues(chain_id, lines, selection)
         # If no protein residues were found, it indicates that the chain ID given does not exist in that folder
         if prot_res == "":
             print("Protein residues for a chain ID of {0} could not be found.".format(chain_id))
         # Else print protein residues
         else:
             print(prot_res)
+    return prot_res
 
-def get_fasta_protseqs(filename, chain_id, lines):
+@pdbprofile.timed("write")
+def get_fasta_protseqs(filename, chain_id, lines, width=80, append=False, compress=False, selection=None):
     """Write the protein residue sequence of one or more chain IDs to a given FASTA file
     Inputs:
     filename - the name of a FASTA file to write to, excluding extension (type string)
     chain_id - Chain ID associated with protein residues (if empty string, all must be used)
     lines - file contents of pdb file (list of string lines)
+    width - number of sequence characters on each line (type int, 80 unless given)
+    append - if True, the sequences are added to the end of the FASTA file, so many structures can be written to one file (type bool)
+    compress - if True, the FASTA file is written gzip-compressed, to filename.fasta.gz (type bool)
+    selection - selection string (see compile_selection); only residues with a selected atom are written (all if None)
     Output:
-    None (writes protein residue sequences to file if found, or prints error message if not found)"""
+    True if any sequence was written, False otherwise (type bool) (writes protein residue sequences to file if found,
+    or prints error message if not found)"""
+    # Get the protein sequences of all chains in one pass
+    sequences = get_all_prot_sequences(lines, selection)
+    # If the chain ID was not given with a selection, use every chain with selected protein residues
+    if (chain_id == "") and (selection is not None):
+        chain_ids = list(sequences)
     # If the chain ID was not given, find all chain IDs for protein residues
-    if chain_id == "":
-        # Empty set of chain IDs
-        chain_ids = set()
-        # Go through each line
-        for line in lines:
-            # If a protein residue line with alpha-carbon found
-            if (line.startswith("ATOM")) and ("CA" in line):
-                chain_id = line[21]
-                # Add chain ID to the set
-                chain_ids.add(chain_id)
+    elif chain_id == "":
+        structure = get_structure(lines)
+        # Chain IDs of all protein residues, in the order they first appear in the file
+        chain_ids = structure.chain_ids(("ATOM",))
     else:
         # Check if given chain ID is syntactically valid
         if is_valid_chain(chain_id):
-            # Set of chains only contains that ID
-            chain_ids = {chain_id}
+            # List of chains only contains that ID
+            chain_ids = [chain_id]
+        else:
+            chain_ids = []
 
-    # String to hold all contents to write to file
-    contents = ""
+    # Header and protein sequence of each chain found
+    records = []
     # Go through each chain ID
     for chain_id in chain_ids:
         # Get the protein sequence
-        prot_res = get_prot_residues(chain_id, lines)
+        prot_res = sequences.get(chain_id, "")
         # If the protein sequence is empty, then the chain ID was not found
         if prot_res == "":
             print("Protein residues for a chain ID of {0} could not be found. Please try with a different ID.".format(chain_id))
-        # Otherwise, add header and formatted protein sequence to contents
+        # Otherwise, keep the header and protein sequence to write
         else:
-            header = ">" + " ".join((lines[0][10:-1]).split()) + ": {0}\n".format(chain_id)
-            formatted_seq = format_80(prot_res) + "\n"
-            contents += header + formatted_seq
+            records.append((" ".join((lines[0][10:-1]).split()) + ": {0}".format(chain_id), prot_res))
     # Only write to the FASTA file if any protein sequences were found
-    if contents != "":
-        with open(filename+".fasta", 'w') as fobject:
-            fobject.write(contents)
+    if records != []:
+        extension = ".fasta.gz" if compress else ".fasta"
+        with FastaWriter(filename + extension, width, append) as writer:
+            for (header, prot_res) in records:
+                writer.write(header, prot_res)
         # Tell user then name of the file it was written to, and the chains it was written to
-        print("The protein residues from chains {0} were written to the FASTA file {1}.fasta".format(chain_ids, filename))
+        print("The protein residues from chains {0} were written to the FASTA file {1}{2}".format(chain_ids, filename, extension))
+    return records != []
 
-def get_residue_lines(chain_id, starting, lines):
+@pdbprofile.timed("query")
+def get_residue_lines(chain_id, starting, lines, selection=None):
     """Returns a string containing all lines which start with the given strings in the starting list and contain the chain ID
     Inputs:
-    chain_id - Chain ID used to find lines only containing that chain ID (type string)
+    chain_id - Chain ID used to find lines only containing that chain ID, or None for every chain (type string)
     starting - Starting strings for lines to find (list of strings)
     lines - file contents of pdb file (list of string lines)
+    selection - selection string (see compile_selection); only the lines of selected atoms are included (all if
+    None). It can only be used with ATOM and HETATM records.
     Output:
     String containing all lines matching given criteria
     """
-    res_lines = ""
-    for line in lines:
-        for record in starting:
-            if (line.startswith(record)) and (line[21] == chain_id):
-                res_lines += (line + "\n")
+    # Only ATOM and HETATM records are held in the structure, so any other records are found by checking each line
+    if not set(starting) <= {"ATOM", "HETATM"}:
+        if selection is not None:
+            print("A selection can only be used with ATOM and HETATM records.")
+            return ""
+        res_lines = ""
+        for line in lines:
+            for record in starting:
+                if (line.startswith(record)) and (line[21] == chain_id):
+                    res_lines += (line + "\n")
+        return res_lines
+    structure = get_structure(lines)
+    # Select the atoms of the given record types and chain from the index, and join their lines
+    selected = _select_rows(structure, _record_rows(structure, starting, chain_id), selection)
+    res_lines = "".join([line + "\n" for line in structure.get_lines(selected)])
     return res_lines
                 
-def get_chain_residues(chain_id, record_type, filename, read_write, pdb_lines):
+@pdbprofile.timed("write")
+def get_chain_residues(chain_id, record_type, filename, read_write, pdb_lines, selection=None):
     """Prints the lines matching the record type asked for from the given filename, or writes these lines to a file to the given filename for a particular chain ID
     Inputs:
     chain_id - Chain ID associated with residues (type string)
@@ -215,8 +1808,10 @@ def get_chain_residues(chain_id, record_type, filename, read_write, pdb_lines):
     filename - name of the file to read from/write to, excluding extension (type string)
     read_write - 'r' to read file, anything else to write to file (type string)
     lines - file contents of pdb file (list of string lines)
+    selection - selection string (see compile_selection); only the lines of selected atoms are included (all if None)
     Output:
-    None (writes residues to file or prints residues to standard output)
+    True if any lines were found (and written, when writing), False otherwise (type bool) (writes residues to file
+    or prints residues to standard output)
     """
     # Find ATOM and HETATM if record type is anything other than ATOM or HETATM
     if (record_type != "ATOM") and (record_type != "HETATM"):
@@ -226,23 +1821,26 @@ def get_chain_residues(chain_id, record_type, filename, read_write, pdb_lines):
     # If asked to read from the file
     if read_write == "r":
         (contents, pdb_id) = download_pdb(filename)
-        line_results = get_residue_lines(chain_id, starting, contents)
+        line_results = get_residue_lines(chain_id, starting, contents, selection)
         if line_results == "":
             print("No lines with the chain ID of {0} could be found.".format(chain_id))
-        else:
-            print(line_results)
+            return False
+        print(line_results)
+        return True
     # Otherwise assume we are writing to the filename given
     else:
         # Get the lines needed
-        file_contents = get_residue_lines(chain_id, starting, pdb_lines)
+        file_contents = get_residue_lines(chain_id, starting, pdb_lines, selection)
         # If no lines were found, the chain ID does not exist in the file
         if file_contents == "":
             print("The chain ID {0} could not be found for a residue in the file.".format(chain_id))
+            return False
         # Otherwise write the lines to the file
-        else:
-            with open((filename+".txt"), "w") as fobject:
-                fobject.write(file_contents)
-            print("Your resultant lines for chain {0} are in {1}.txt".format(chain_id, filename))
+        with open((filename+".txt"), "w") as fobject:
+            fobject.write(file_contents)
+        pdbprofile.add("bytes_written", len(file_contents))
+        print("Your resultant lines for chain {0} are in {1}.txt".format(chain_id, filename))
+        return True
 
 def is_valid_chain(chain_id):
     """Returns True if the chain ID is syntactically correct, False otherwise
@@ -301,6 +1899,7 @@ def is_valid_filename(filename):
         valid = True
     return valid
 
+@pdbprofile.timed("write")
 def alter_chain_id(old_chain_id, new_chain_id, lines, pdb_id):
     """Alters the old chain ID to a new chain ID for all residues in the PDB file, saving the changed contents to a file
     Inputs:
@@ -311,35 +1910,15 @@ def alter_chain_id(old_chain_id, new_chain_id, lines, pdb_id):
     Output:
     List of contents of current PDB file, and name of current file"""
     # If both chain IDs are syntactically valid
-    if (is_valid_chain(old_chain_id)) and (is_valid_chain(new_chain_id)):
-        # Check if old chain ID is actually in the PDB file for any residues
-        found_old_id = False
-        for line in lines:
-            if (line.startswith("ATOM") and (line[21] == old_chain_id)) or (line.startswith("HETATM") and (line[21] == old_chain_id)):
-                found_old_id = True
-                break
-        # If the old chain ID is there
-        if found_old_id:
-            new_lines = []
-            altered_text = ""
-            # Iterate through each line
-            for line in lines:
-                # If a protein residue or non-protein residue line, and the old chain ID matches
-                if (line.startswith("ATOM") and (line[21] == old_chain_id)) or (line.startswith("HETATM") and (line[21] == old_chain_id)):
-                    # Replace old chain ID with new chain ID
-                    new_line = (line[:21] + new_chain_id + line[22:])
-                    altered_text += new_line + "\n"
-                    new_lines.append(new_line)
-                # If not a residue line, then just add the line with no changes
-                else:
-                    altered_text += (line) + "\n"
-                    new_lines.append(line)
+    if _is_valid_mapping({old_chain_id: new_chain_id}):
+        structure = get_structure(lines)
+        # If the old chain ID is there on protein or non-protein residue lines
+        if len(structure.chain_rows(old_chain_id)) > 0:
             # Get the name of the file from the header
             new_pdb_id = pdb_id + "_" + new_chain_id
             filename = new_pdb_id + ".pdb"
-            # Write the altered text to the file named according to the header
-            with open(filename, 'w') as fobject:
-                fobject.write(altered_text)
+            # Replace the old chain ID with the new chain ID and write the altered lines to the file
+            (new_lines, altered) = _save_remapped({old_chain_id: new_chain_id}, lines, structure, filename)
             print("The chain ID {0} has been altered to {1} for all residue lines, saved to file {2}. File {2} is now the PDB file being used".format(old_chain_id, new_chain_id, filename))
             # Update the list of lines in main program to also be altered
             return (new_lines, new_pdb_id)
@@ -349,41 +1928,598 @@ def alter_chain_id(old_chain_id, new_chain_id, lines, pdb_id):
     # Return original contents if never altered
     return (lines, pdb_id)
 
+# Column of the chain ID (counting from 0) in each record that has one, by record name: coordinate, anisotropic
+# temperature factor and chain terminator records have it in column 22, and SEQRES records in column 12. The
+# functions that alter chain IDs all count the lines altered the same way: only lines whose chain ID was changed to
+# a different chain ID are counted, so a chain mapped to itself alters nothing
+CHAIN_ID_COLUMNS = {"ATOM  ": 21, "HETATM": 21, "ANISOU": 21, "TER   ": 21, "SEQRES": 11}
+
+def _is_valid_mapping(mapping):
+    """Returns True if the mapping has at least one chain ID and every old and new chain ID is syntactically correct
+    (and a single byte, so it can be patched into a file), False otherwise"""
+    if len(mapping) == 0:
+        print("No chain IDs were given to alter. Please give at least one old and new chain ID.")
+        return False
+    for (old_chain_id, new_chain_id) in mapping.items():
+        if not (is_valid_chain(old_chain_id) and is_valid_chain(new_chain_id)):
+            return False
+        if not (old_chain_id + new_chain_id).isascii():
+            print("A chain ID can only be an ASCII character. Please give a different chain ID.")
+            return False
+    return True
+
+def _remap_line(line, mapping):
+    """Returns the line with its chain ID replaced if its record has a chain ID found in the mapping, otherwise None"""
+    column = CHAIN_ID_COLUMNS.get(line[:6])
+    if (column is not None) and (line[column:column + 1] in mapping):
+        return line[:column] + mapping[line[column]] + line[column + 1:]
+    return None
+
+def _save_remapped(mapping, lines, structure, filename):
+    """Copies the lines with the chain IDs of the mapping replaced in one pass, and writes them to a file line by line
+    Inputs:
+    mapping - new chain ID for each old chain ID (dictionary of string: string)
+    lines - file contents of pdb file (list of string lines)
+    structure - parsed structure of the lines (type Structure)
+    filename - name of the file to write to, including extension (type string)
+    Outputs:
+    Altered contents, with the structure of the altered lines (type PDBLines)
+    Number of lines altered (type int)
+    Both are returned as a tuple"""
+    new_lines = PDBLines(lines)
+    altered = 0
+    for (line_idx, line) in enumerate(new_lines):
+        new_line = _remap_line(line, mapping)
+        if (new_line is not None) and (new_line != line):
+            new_lines[line_idx] = new_line
+            altered += 1
+    # The altered lines keep a copy of the structure with the new chain IDs, so they are not parsed again
+    new_lines.structure = structure.remap_chains(mapping, new_lines)
+    with open(filename, 'w') as fobject:
+        fobject.writelines(line + "\n" for line in new_lines)
+    # Counting the characters means going over every line again, so it is only done while profiling
+    if pdbprofile.is_enabled():
+        pdbprofile.add("bytes_written", sum(len(line) + 1 for line in new_lines))
+    return (new_lines, altered)
+
+@pdbprofile.timed("write")
+def remap_chains(mapping, lines, pdb_id):
+    """Alters any number of chain IDs at once, in one pass over the file, saving the changed contents to a file. Chain
+    IDs are replaced in ATOM, HETATM, ANISOU, TER and SEQRES records, and each line is changed at most once, so
+    chains can be swapped (e.g. {"A": "B", "B": "A"}).
+    Inputs:
+    mapping - new chain ID for each old chain ID (dictionary of string: string)
+    lines - file contents of pdb file (list of string lines)
+    pdb_id - name of current PDB file
+    Output:
+    List of contents of current PDB file, and name of current file (the number of lines altered is printed)"""
+    # If every chain ID is syntactically valid
+    if _is_valid_mapping(mapping):
+        structure = get_structure(lines)
+        # All old chain IDs must be there on protein or non-protein residue lines
+        missing = [old_chain_id for old_chain_id in mapping if len(structure.chain_rows(old_chain_id)) == 0]
+        if missing == []:
+            # Name the file after the new chain IDs, in the order given
+            new_pdb_id = pdb_id + "_" + "".join(mapping.values())
+            filename = new_pdb_id + ".pdb"
+            (new_lines, altered) = _save_remapped(mapping, lines, structure, filename)
+            changes = ", ".join("{0} to {1}".format(old_chain_id, new_chain_id) for (old_chain_id, new_chain_id) in mapping.items())
+            print("The chain IDs have been altered ({0}) on {1} lines, saved to file {2}. File {2} is now the PDB file being used".format(changes, altered, filename))
+            return (new_lines, new_pdb_id)
+        else:
+            print("The old chain IDs {0} do not exist in this file. Please give different chain IDs.".format(", ".join(missing)))
+    # Return original contents if never altered
+    return (lines, pdb_id)
+
+def _remap_mapped_file(mapping, filename):
+    """Replaces the chain IDs of the mapping in a plain PDB file by writing only the changed bytes through a writable
+    memory map, so the file is never copied or read into memory as a whole
+    Inputs:
+    mapping - new chain ID for each old chain ID (dictionary of string: string)
+    filename - name of an uncompressed PDB file (type string)
+    Output:
+    Number of lines altered, counting only lines whose chain ID was changed (type int)"""
+    with open(filename, 'r+b') as fobject:
+        # Files of length 0 cannot be mapped, and have nothing to alter
+        if os.fstat(fobject.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(fobject.fileno(), 0, access=mmap.ACCESS_WRITE) as buffer:
+            data = np.frombuffer(buffer, dtype=np.uint8)
+            newlines = np.flatnonzero(data == ord("\n"))
+            starts = np.concatenate(([0], newlines + 1)).astype(np.int64)
+            lengths = np.concatenate((newlines, [len(data)])) - starts
+            # Only lines long enough to have a chain ID can be altered; read the record name of each of them
+            long_enough = lengths > min(CHAIN_ID_COLUMNS.values())
+            (starts, lengths) = (starts[long_enough], lengths[long_enough])
+            records = data[starts[:, np.newaxis] + np.arange(6)].view("S6").ravel()
+            # Position in the file of the chain ID of every line with a chain ID
+            positions = np.concatenate([starts[(records == record.encode("ascii")) & (lengths > column)] + column
+                                        for (record, column) in CHAIN_ID_COLUMNS.items()])
+            # Look up the new byte for each chain ID at once, and only write the ones that change
+            table = np.arange(256, dtype=np.uint8)
+            for (old_chain_id, new_chain_id) in mapping.items():
+                table[ord(old_chain_id)] = ord(new_chain_id)
+            old_bytes = data[positions]
+            new_bytes = table[old_bytes]
+            changed = positions[new_bytes != old_bytes]
+            data[changed] = new_bytes[new_bytes != old_bytes]
+            # The array must be released before the map can be closed
+            del data
+            buffer.flush()
+    # Make sure the change of contents is seen from the modification time, as pdbstore checks it
+    os.utime(filename)
+    pdbprofile.add("bytes_written", len(changed))
+    return len(changed)
 
+@pdbprofile.timed("write")
+def remap_chains_in_place(mapping, filename):
+    """Alters any number of chain IDs of a local PDB file in place, in ATOM, HETATM, ANISOU, TER and SEQRES records.
+    Plain files are patched through a writable memory map, changing only the bytes of the chain IDs; compressed files
+    are rewritten one line at a time to a temporary file (compressed the same way), which then replaces the file.
+    Inputs:
+    mapping - new chain ID for each old chain ID (dictionary of string: string)
+    filename - name of the PDB file, plain or compressed with gzip, bz2 or xz (type string)
+    Output:
+    Number of lines altered, counting only lines whose chain ID was changed (type int)"""
+    if not _is_valid_mapping(mapping):
+        return 0
+    module = get_compression(filename)
+    if module is None:
+        return _remap_mapped_file(mapping, filename)
+    (handle, temp_filename) = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), prefix=".tmp-")
+    os.close(handle)
+    try:
+        with module.open(temp_filename, 'wt') as out_fobject:
+            altered = stream_remap_chains(mapping, filename, out_fobject)
+        shutil.copymode(filename, temp_filename)
+        os.replace(temp_filename, filename)
+        pdbprofile.add("bytes_written", os.path.getsize(filename))
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+    return altered
+
+
+@pdbprofile.timed("query")
 def print_nonstandard_residues(lines):
     """Prints any non-standard protein residues given the contents of the PDB file
     Input:
     lines - file contents of pdb file (list of string lines)
     Output:
     None (prints non-standard protein residues, or sentence telling user all are standard protein residues)"""
-    # List of three-letter codes for all standard protein residues (only taking 20 as standard)
-    codes = ["ALA", "CYS", "ASP", "GLU", "PHE", "GLY", "HIS", "ILE", "LYS", "LEU", "MET", "ASN", "PRO", 
-             "GLN", "ARG", "SER", "THR", "VAL", "TRP", "TYR"]
-    non_standards = ""
-    curr_chain = ""
-    counter = 0
-    for line in lines:
-        # If we have reached a new chain, reset counter to 0 and keep track of next chain
-        if line.startswith("ATOM") and (line[21] != curr_chain):
-            curr_chain = line[21]
-            counter = 0
-        # If we have not looked at a protein residue yet
-        if line.startswith("ATOM") and (counter < int(line[23:26])):
-            # Increase the counter to find the next protein residue
-            counter = int(line[23:26])
-            # Find the current code
-            res_code = line[16:20].strip()
-            # Add code if not in list of standard protein residues
-            if res_code not in codes:
-                non_standards += res_code + " "
+    structure = get_structure(lines)
+    # First atom of each protein residue (of the first model only, if the file has several); a new residue starts
+    # wherever the chain ID, the whole residue number or the insertion code changes, so residue numbers of 1000 and
+    # above and inserted residues are each counted once
+    protein = structure.first_model_rows(np.flatnonzero(structure.record == "ATOM"))
+    res_codes = structure.resname[_first_residue_rows(structure, protein)]
+    # Add codes that are not in the list of standard protein residues
+    non_standards = "".join([res_code + " " for res_code in res_codes[~np.isin(res_codes, STANDARD_RESIDUES)]])
     # If no non-standard codes found, print that all were standard
     if non_standards == "":
         print("All protein residues were standard.")
     # Print any non-stnadard codes
     else:
         print(non_standards)
-        
-def plot_temp_factor(chain_id, height, width, output_filename, lines, pdb_id):
+
+def _record_rows(structure, records, chain_id=None):
+    """Returns the rows of the atoms of the given record types, of one chain or of every chain, from the chain index
+    Inputs:
+    structure - parsed structure (type Structure)
+    records - record types to include (list or tuple of strings)
+    chain_id - Chain ID of the atoms, or None for every chain (type string)
+    Output:
+    Rows of the atoms in file order (type int array)"""
+    if chain_id is not None:
+        return structure.chain_rows(chain_id, records)
+    ranges = [ranges for ((record, _), ranges) in structure.chain_ranges.items() if record in records]
+    if ranges == []:
+        return np.zeros(0, dtype=np.int64)
+    ranges = np.concatenate(ranges)
+    # Mark where each range starts and stops; the running total is then 1 inside a range and 0 outside (ranges never
+    # overlap), which avoids making an array for every range when there are many chains
+    edges = np.zeros(len(structure) + 1, dtype=np.int32)
+    edges[ranges[:, 0]] += 1
+    edges[ranges[:, 1]] -= 1
+    return np.flatnonzero(np.cumsum(edges[:-1]) > 0)
+
+def _temp_factor_sums(structure, rows):
+    """Adds up the temperature factors and occupancies of the atoms of each residue at once, with one grouped
+    reduction for each sum over the boundaries between residues (see _residue_boundaries)
+    Inputs:
+    structure - parsed structure (type Structure)
+    rows - rows of atoms, in file order (type int array)
+    Output:
+    Row of the first atom of each residue, and the number of atoms, sum of temperature factors, sum of squared
+    temperature factors, highest temperature factor, sum of occupancies and sum of occupancy times temperature factor
+    of each residue (dictionary of string: array)"""
+    starts = np.flatnonzero(_residue_boundaries(structure, rows))
+    bfactor = structure.bfactor[rows]
+    occupancy = structure.occupancy[rows]
+    if len(rows) == 0:
+        empty = np.zeros(0)
+        return {"first": rows, "atoms": np.zeros(0, dtype=np.int64), "bfactor": empty, "squared": empty, "max": empty,
+                "occupancy": empty, "weighted": empty}
+    return {"first": rows[starts], "atoms": np.diff(np.append(starts, len(rows))),
+            "bfactor": np.add.reduceat(bfactor, starts), "squared": np.add.reduceat(bfactor * bfactor, starts),
+            "max": np.maximum.reduceat(bfactor, starts), "occupancy": np.add.reduceat(occupancy, starts),
+            "weighted": np.add.reduceat(occupancy * bfactor, starts)}
+
+def _chain_groups(chains):
+    """Numbers the chains of the residues in the order each chain first appears
+    Input:
+    chains - chain ID of each residue (type string array)
+    Output:
+    Chain IDs in the order they first appear (type string array)
+    Number of the chain of each residue (type int array)
+    Residues sorted by chain, keeping file order within each chain (type int array)
+    Position of the first residue of each chain among the sorted residues (type int array)"""
+    (chain_ids, first, inverse) = np.unique(chains, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    groups = rank[inverse.ravel()]
+    by_chain = np.argsort(groups, kind="stable")
+    chain_starts = np.searchsorted(groups[by_chain], np.arange(len(order)))
+    return (chain_ids[order], groups, by_chain, chain_starts)
+
+def _weighted_means(weighted, occupancy, means):
+    """Divides the sums of occupancy times temperature factor by the sums of occupancy, using the plain mean where
+    the occupancies add up to 0"""
+    return np.where(occupancy > 0, weighted / np.where(occupancy > 0, occupancy, 1), means)
+
+@pdbprofile.timed("query")
+def chain_temp_factors(lines, records=("ATOM",)):
+    """Returns temperature factor and occupancy statistics of every chain (of the first model, if the file has
+    several), found from the sums of each residue with grouped reductions rather than loops over atoms
+    Inputs:
+    lines - file contents of pdb file (list of string lines)
+    records - record types to include (list or tuple of strings)
+    Output:
+    Dictionary of arrays with one element for each chain, in the order the chains first appear:
+    chain - chain ID (type string array)
+    atoms, residues - number of atoms and residues (type int arrays)
+    mean, std, max - mean, standard deviation and highest temperature factor of the atoms (type float arrays)
+    occupancy - mean occupancy of the atoms (type float array)
+    weighted_mean - mean temperature factor weighted by the occupancy of each atom (type float array)"""
+    structure = get_structure(lines)
+    sums = _temp_factor_sums(structure, structure.first_model_rows(_record_rows(structure, records)))
+    (chain_ids, groups, by_chain, chain_starts) = _chain_groups(structure.chain[sums["first"]])
+    if len(chain_ids) == 0:
+        empty = np.zeros(0)
+        return {"chain": chain_ids, "atoms": np.zeros(0, dtype=np.int64), "residues": np.zeros(0, dtype=np.int64),
+                "mean": empty, "std": empty, "max": empty, "occupancy": empty, "weighted_mean": empty}
+    # Add the sums of the residues of each chain
+    totals = {key: np.add.reduceat(sums[key][by_chain], chain_starts) for key in ("atoms", "bfactor", "squared", "occupancy", "weighted")}
+    atoms = totals["atoms"]
+    means = totals["bfactor"] / atoms
+    return {"chain": chain_ids, "atoms": atoms, "residues": np.diff(np.append(chain_starts, len(by_chain))),
+            "mean": means, "std": np.sqrt(np.maximum(totals["squared"] / atoms - means * means, 0)),
+            "max": np.maximum.reduceat(sums["max"][by_chain], chain_starts), "occupancy": totals["occupancy"] / atoms,
+            "weighted_mean": _weighted_means(totals["weighted"], totals["occupancy"], means)}
+
+@pdbprofile.timed("query")
+def residue_temp_factors(lines, chain_id=None, records=("ATOM",), selection=None):
+    """Returns temperature factor and occupancy statistics of every residue, of one chain or of every chain, found with
+    grouped reductions over the boundaries between residues rather than loops over atoms. A new residue starts
+    wherever the chain ID, residue number or insertion code changes, so alternate locations are part of one residue.
+    Only the first model is used if the file has several.
+    Inputs:
+    lines - file contents of pdb file (list of string lines)
+    chain_id - Chain ID of the residues, or None for every chain (type string)
+    records - record types to include (list or tuple of strings)
+    selection - selection string (see compile_selection); only selected atoms are included (all if None)
+    Output:
+    Dictionary of arrays with one element for each residue, in file order:
+    chain, resname, icode - chain ID, residue name and insertion code (type string arrays)
+    resseq - residue number (type int array)
+    atoms - number of atoms (type int array)
+    mean, max - mean and highest temperature factor of the atoms (type float arrays)
+    normalized - mean temperature factor as the number of standard deviations from the mean of its chain (0 if every
+    atom of the chain has the same temperature factor) (type float array)
+    occupancy - mean occupancy of the atoms (type float array)
+    weighted_mean - mean temperature factor weighted by the occupancy of each atom (type float array)"""
+    structure = get_structure(lines)
+    rows = _select_rows(structure, _record_rows(structure, records, chain_id), selection)
+    sums = _temp_factor_sums(structure, structure.first_model_rows(rows))
+    first = sums["first"]
+    means = sums["bfactor"] / np.maximum(sums["atoms"], 1)
+    # Mean and standard deviation of the atoms of the chain of each residue, from the sums of its residues
+    (chain_ids, groups, by_chain, chain_starts) = _chain_groups(structure.chain[first])
+    if len(chain_ids) > 0:
+        atoms = np.add.reduceat(sums["atoms"][by_chain], chain_starts)
+        chain_means = np.add.reduceat(sums["bfactor"][by_chain], chain_starts) / atoms
+        chain_stds = np.sqrt(np.maximum(np.add.reduceat(sums["squared"][by_chain], chain_starts) / atoms - chain_means * chain_means, 0))
+        (chain_means, chain_stds) = (chain_means[groups], chain_stds[groups])
+    else:
+        (chain_means, chain_stds) = (np.zeros(0), np.zeros(0))
+    normalized = np.where(chain_stds > 0, (means - chain_means) / np.where(chain_stds > 0, chain_stds, 1), 0.0)
+    return {"chain": structure.chain[first], "resseq": structure.resseq[first], "icode": structure.icode[first],
+            "resname": structure.resname[first], "atoms": sums["atoms"], "mean": means, "max": sums["max"],
+            "normalized": normalized, "occupancy": sums["occupancy"] / np.maximum(sums["atoms"], 1),
+            "weighted_mean": _weighted_means(sums["weighted"], sums["occupancy"], means)}
+
+@pdbprofile.timed("query")
+def atoms_within(point_or_selection, radius, lines):
+    """Finds every atom within a distance of a point or of any atom of a selection (see Structure.atoms_within)
+    Inputs:
+    point_or_selection - x, y and z of a point or rows of points (type float array), or a selection of atoms (a
+    selection string, rows as an int array, or a boolean mask, e.g. from Structure.ligand_rows)
+    radius - distance in Angstroms (type float)
+    lines - file contents of pdb file (list of string lines)
+    Output:
+    Rows of the atoms found in the structure of the lines, in file order (type int array)"""
+    return get_structure(lines).atoms_within(point_or_selection, radius)
+
+@pdbprofile.timed("query")
+def contacts(sel_a, sel_b, cutoff, lines):
+    """Finds every pair of atoms from two selections that are at most a distance apart (see Structure.contacts)
+    Inputs:
+    sel_a, sel_b - selections of atoms (selection strings, rows as int arrays, boolean masks, or None for every atom)
+    cutoff - largest distance in Angstroms (type float)
+    lines - file contents of pdb file (list of string lines)
+    Output:
+    Rows of the atoms of sel_a, rows of the atoms of sel_b, and the distances of the pairs (tuple of arrays)"""
+    return get_structure(lines).contacts(sel_a, sel_b, cutoff)
+
+@pdbprofile.timed("query")
+def get_binding_residues(resname, cutoff, lines):
+    """Finds the protein residues with any atom at most a distance from any atom of a ligand
+    Inputs:
+    resname - residue name of the ligand's HETATM records (e.g. "HEM") (type string)
+    cutoff - largest distance in Angstroms (type float)
+    lines - file contents of pdb file (list of string lines)
+    Output:
+    (chain ID, residue number, insertion code, residue name) of each residue, in file order (list of tuples)"""
+    structure = get_structure(lines)
+    # Only the first model is used if the file has several, so each residue is found once
+    protein = structure.first_model_rows(np.flatnonzero(structure.record == "ATOM"))
+    (_, rows, _) = structure.contacts(structure.first_model_rows(structure.ligand_rows(resname)), protein, cutoff)
+    rows = np.unique(rows)
+    # Keep one atom of each residue
+    rows = rows[_residue_boundaries(structure, rows)]
+    return list(zip(structure.chain[rows].tolist(), structure.resseq[rows].tolist(), structure.icode[rows].tolist(),
+                    structure.resname[rows].tolist()))
+
+# Mass of each element in daltons, by element symbol as in columns 77-78 of ATOM and HETATM records
+ELEMENT_MASSES = {"H": 1.008, "D": 2.014, "C": 12.011, "N": 14.007, "O": 15.999, "F": 18.998, "NA": 22.990,
+                  "MG": 24.305, "P": 30.974, "S": 32.06, "CL": 35.45, "K": 39.098, "CA": 40.078, "MN": 54.938,
+                  "FE": 55.845, "CO": 58.933, "NI": 58.693, "CU": 63.546, "ZN": 65.38, "SE": 78.971, "BR": 79.904,
+                  "MO": 95.95, "CD": 112.41, "I": 126.90, "HG": 200.59}
+
+def centroid(coords, weights=None):
+    """Returns the centre of a set of points, or of each of a stack of sets of points, optionally weighted (e.g. by
+    mass, for the centre of mass)
+    Inputs:
+    coords - coordinates with one row of x, y and z per atom (type float array of shape (atoms, 3), or
+    (structures, atoms, 3) for a stack)
+    weights - weight of each atom, or None for equal weights (type float array of shape (atoms,))
+    Output:
+    Centre of the points (type float array of shape (3,), or (structures, 3) for a stack)"""
+    coords = np.asarray(coords, dtype=np.float64)
+    if weights is None:
+        return coords.mean(axis=-2)
+    weights = np.asarray(weights, dtype=np.float64)
+    return np.einsum("...ni,n->...i", coords, weights) / weights.sum()
+
+def radius_of_gyration(coords, weights=None):
+    """Returns the radius of gyration of a set of points, or of each of a stack of sets of points: the root mean
+    square distance of the points from their centre, optionally weighted (e.g. by mass)
+    Inputs:
+    coords - coordinates with one row of x, y and z per atom (type float array of shape (atoms, 3), or
+    (structures, atoms, 3) for a stack)
+    weights - weight of each atom, or None for equal weights (type float array of shape (atoms,))
+    Output:
+    Radius of gyration in the units of the coordinates (type float, or float array of shape (structures,))"""
+    coords = np.asarray(coords, dtype=np.float64)
+    squared = ((coords - centroid(coords, weights)[..., np.newaxis, :]) ** 2).sum(axis=-1)
+    if weights is None:
+        return np.sqrt(squared.mean(axis=-1))
+    weights = np.asarray(weights, dtype=np.float64)
+    return np.sqrt(squared @ weights / weights.sum())
+
+def superpose(reference, mobile):
+    """Superposes coordinates onto reference coordinates with the Kabsch algorithm, finding the rotation and
+    translation that give the lowest RMSD. Many sets of coordinates (e.g. the same chain from many structures or
+    models) can be superposed in one call by stacking them, as the optimal rotations of the whole stack are found at
+    once with batched matrix operations. The atoms of each set must match those of the reference one to one.
+    Inputs:
+    reference - reference coordinates (type float array of shape (atoms, 3), or (structures, atoms, 3) to give each
+    set its own reference)
+    mobile - coordinates to move (type float array of shape (atoms, 3), or (structures, atoms, 3) for a stack)
+    Output:
+    Rotation matrix of each set, which is applied as (mobile - centroid(mobile)) @ rotation + centroid(reference)
+    (type float array of shape (3, 3), or (structures, 3, 3))
+    Superposed coordinates (type float array with the shape of mobile)
+    RMSD after superposition (type float, or float array of shape (structures,))
+    All three are returned as a tuple"""
+    reference = np.asarray(reference, dtype=np.float64)
+    mobile = np.asarray(mobile, dtype=np.float64)
+    ref_centre = reference.mean(axis=-2, keepdims=True)
+    mob_centre = mobile.mean(axis=-2, keepdims=True)
+    ref_centred = reference - ref_centre
+    mob_centred = mobile - mob_centre
+    # Covariance matrix of each set and its singular value decomposition, for every set at once
+    covariance = np.einsum("...ni,...nj->...ij", mob_centred, ref_centred)
+    (u, singular, vt) = np.linalg.svd(covariance)
+    # Flip the axis of the smallest singular value where needed, so each rotation is proper (not a reflection)
+    sign = np.sign(np.linalg.det(u @ vt))
+    sign = np.where(sign == 0, 1.0, sign)
+    u[..., :, -1] *= sign[..., np.newaxis]
+    rotation = u @ vt
+    superposed = mob_centred @ rotation + ref_centre
+    # The RMSD follows from the singular values, without measuring the superposed coordinates again
+    singular[..., -1] *= sign
+    atoms = reference.shape[-2]
+    squared = ((ref_centred ** 2).sum(axis=(-2, -1)) + (mob_centred ** 2).sum(axis=(-2, -1)) - 2 * singular.sum(axis=-1)) / atoms
+    return (rotation, superposed, np.sqrt(np.maximum(squared, 0)))
+
+def rmsd(reference, mobile, superposition=True):
+    """Returns the RMSD between coordinates and reference coordinates, after superposing them (see superpose) or as
+    they are. Stacks of coordinates give one RMSD for each set.
+    Inputs:
+    reference - reference coordinates (type float array of shape (atoms, 3), or (structures, atoms, 3))
+    mobile - coordinates to compare (type float array of shape (atoms, 3), or (structures, atoms, 3))
+    superposition - if True, the coordinates are superposed first (type bool)
+    Output:
+    RMSD (type float, or float array of shape (structures,))"""
+    if superposition:
+        return superpose(reference, mobile)[2]
+    difference = np.asarray(mobile, dtype=np.float64) - np.asarray(reference, dtype=np.float64)
+    return np.sqrt((difference ** 2).sum(axis=-1).mean(axis=-1))
+
+@pdbprofile.timed("query")
+def get_coords(lines, chain_id=None, names=None, records=("ATOM",)):
+    """Returns the coordinates of the atoms of one chain (or every chain) with the given atom names, in the first
+    model if the file has several (see get_models for every model)
+    Inputs:
+    lines - file contents of pdb file (list of string lines)
+    chain_id - Chain ID of the atoms, or None for every chain (type string)
+    names - atom names to include (e.g. ("CA",)), or None for every atom (list or tuple of strings)
+    records - record types to include (list or tuple of strings)
+    Output:
+    Coordinates with one row of x, y and z per atom, in file order (type float array of shape (atoms, 3))"""
+    structure = get_structure(lines)
+    rows = structure.first_model_rows(structure.atom_rows(chain_id, names, records))
+    return np.column_stack((structure.x[rows], structure.y[rows], structure.z[rows]))
+
+@pdbprofile.timed("query")
+def get_center_of_mass(lines, chain_id=None, names=None, records=("ATOM",)):
+    """Returns the centre of mass of the atoms of one chain (or every chain) with the given atom names, in the first
+    model if the file has several
+    Inputs:
+    lines - file contents of pdb file (list of string lines)
+    chain_id - Chain ID of the atoms, or None for every chain (type string)
+    names - atom names to include, or None for every atom (list or tuple of strings)
+    records - record types to include (list or tuple of strings)
+    Output:
+    x, y and z of the centre of mass (type float array)"""
+    structure = get_structure(lines)
+    rows = structure.first_model_rows(structure.atom_rows(chain_id, names, records))
+    return centroid(structure.coords[rows], structure.masses(rows))
+
+@pdbprofile.timed("query")
+def get_radius_of_gyration(lines, chain_id=None, names=None, records=("ATOM",), mass_weighted=True):
+    """Returns the radius of gyration of the atoms of one chain (or every chain) with the given atom names, in the
+    first model if the file has several
+    Inputs:
+    lines - file contents of pdb file (list of string lines)
+    chain_id - Chain ID of the atoms, or None for every chain (type string)
+    names - atom names to include, or None for every atom (list or tuple of strings)
+    records - record types to include (list or tuple of strings)
+    mass_weighted - if True, each atom is weighted by its mass, otherwise every atom is weighted equally (type bool)
+    Output:
+    Radius of gyration in Angstroms (type float)"""
+    structure = get_structure(lines)
+    rows = structure.first_model_rows(structure.atom_rows(chain_id, names, records))
+    return float(radius_of_gyration(structure.coords[rows], structure.masses(rows) if mass_weighted else None))
+
+def decimate_min_max(x, y, max_points):
+    """Reduces a line to at most max_points points, keeping the lowest and highest point of each of max_points / 2
+    equal runs of points, so that peaks and dips still show when the line is drawn
+    Inputs:
+    x, y - coordinates of the points of the line, in order (type arrays)
+    max_points - largest number of points to keep, at least 2 (type int)
+    Output:
+    x and y of the points kept, in the same order (tuple of arrays)"""
+    # Each run keeps two points, so fewer than two points cannot be kept
+    if max_points < 2:
+        raise ValueError("max_points must be at least 2, not {0}".format(max_points))
+    count = len(y)
+    if count <= max_points:
+        return (x, y)
+    # Split the points into runs of equal size, padding the last run with the last point
+    size = -(-count // (max_points // 2))
+    runs = -(-count // size)
+    padded = np.empty(runs * size, dtype=y.dtype)
+    padded[:count] = y
+    padded[count:] = y[-1]
+    grid = padded.reshape(runs, size)
+    offsets = np.arange(runs) * size
+    # Index of the lowest and highest point of each run (the padding is never past the last point)
+    lowest = np.minimum(offsets + np.argmin(grid, axis=1), count - 1)
+    highest = np.minimum(offsets + np.argmax(grid, axis=1), count - 1)
+    keep = np.unique(np.concatenate((lowest, highest)))
+    return (x[keep], y[keep])
+
+class TempFactorPlotter:
+    """Draws temperature factor plots on one figure that is reused for every plot, using the Agg renderer directly
+    rather than pyplot, so plots can be saved without a display and no figures are left open however many are drawn.
+    A plotter should only be used by one thread at a time.
+    Attributes:
+    figure - the figure every plot is drawn on (type matplotlib Figure)
+    axes - axes of the figure (type matplotlib Axes)
+    line - the plotted line, whose points are replaced for each plot (type matplotlib Line2D)"""
+
+    def __init__(self):
+        """Creates the figure, its axes and an empty line"""
+        # matplotlib takes longer to import than everything else, so it is only imported when a plot is drawn
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.figure = Figure()
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+        (self.line,) = self.axes.plot([], [])
+
+    @pdbprofile.timed("plot")
+    def save(self, x, y, height, width, title, xlabel, filename, max_points=None):
+        """Draws a line plot of temperature factors and saves it to a PNG file
+        Inputs:
+        x, y - points of the line (type arrays)
+        height, width - size of the figure in inches, in the order used by plot_temp_factor (type int)
+        title - title of the plot (type string)
+        xlabel - label of the x axis (type string)
+        filename - name of the file to save the plot to, including extension (type string)
+        max_points - largest number of points to draw (if None, 4 for each pixel across the figure) (type int)"""
+        self.figure.set_size_inches(height, width)
+        if max_points is None:
+            max_points = 4 * int(height * self.figure.dpi)
+        (x, y) = decimate_min_max(x, y, max_points)
+        self.line.set_data(x, y)
+        # Fit the axes to the new line, as a new plot would
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.axes.set_title(title)
+        self.axes.set_xlabel(xlabel)
+        self.axes.set_ylabel("Temperature factor")
+        self.figure.savefig(filename)
+        if pdbprofile.is_enabled():
+            pdbprofile.add("bytes_written", os.path.getsize(filename))
+
+# Plotter of each thread, created the first time the thread plots
+_plotters = threading.local()
+
+def get_plotter():
+    """Returns the temperature factor plotter of the current thread, creating it the first time (type TempFactorPlotter)"""
+    plotter = getattr(_plotters, "plotter", None)
+    if plotter is None:
+        plotter = TempFactorPlotter()
+        _plotters.plotter = plotter
+    return plotter
+
+@pdbprofile.timed("query")
+def temp_factor_points(chain_id, lines, per_residue=False, selection=None):
+    """Returns the points plotted by plot_temp_factor for a chain: the temperature factor of each atom of its protein
+    residues against the atom number, or the mean temperature factor of each residue against the residue number
+    Inputs:
+    chain_id - Chain ID of protein residues (type string)
+    lines - file contents of pdb file (list of string lines)
+    per_residue - if True, one point for each residue instead of each atom (type bool)
+    selection - selection string (see compile_selection); only selected atoms are included (all if None)
+    Output:
+    x and y of the points, empty if the chain has no protein residues (tuple of arrays)"""
+    if per_residue:
+        residues = residue_temp_factors(lines, chain_id, selection=selection)
+        return (residues["resseq"], residues["mean"])
+    structure = get_structure(lines)
+    # Select each atom of a protein residue only of given chain (in the first model, if the file has several)
+    selected = structure.first_model_rows(_select_rows(structure, structure.chain_rows(chain_id, ("ATOM",)), selection))
+    # Atom numbers, and temperature factors as whole numbers
+    return (structure.serial[selected], structure.bfactor[selected].astype(int))
+
+@pdbprofile.timed("plot")
+def plot_temp_factor(chain_id, height, width, output_filename, lines, pdb_id, per_residue=False, max_points=None, selection=None):
     """Plots the temperature factor for all atoms of the protein chain, writing to an output file a plot of given height and width
     Inputs:
     chain_id - Chain ID of protein residues to plot (type string)
@@ -392,38 +2528,251 @@ def plot_temp_factor(chain_id, height, width, output_filename, lines, pdb_id):
     output_filename - name of the file to save the plot to, excluding extension (type string)
     lines - file contents of pdb file (list of string lines)
     pdb_id - current PDB ID
+    per_residue - if True, the mean temperature factor of each residue is plotted instead of each atom (type bool)
+    max_points - largest number of points to draw; longer chains keep the lowest and highest points of equal runs
+    of atoms (if None, 4 for each pixel across the plot) (type int)
+    selection - selection string (see compile_selection); only selected atoms are plotted (all if None)
     Output:
-    None (saves plot to file if successful, hint to user if unsuccessful)"""
+    True if the plot was saved, False otherwise (type bool) (saves plot to file if successful, hint to user if
+    unsuccessful)"""
     # Note: this interpretation of plotting the temperature factor of the protein is that only
     # protein residues will be considered (not the non-protein residues) and the temperature factor
-    # is plotted for each atom of the protein residues, not each protein residue - then it would
-    # have been determining which of the atoms would be used in an a verage for each residue
-    if is_valid_dimension(height) and is_valid_dimension(width) and is_valid_chain(chain_id):
+    # is plotted for each atom of the protein residues, unless the mean of each residue is asked for
+    if (max_points is not None) and (max_points < 2):
+        print("At least 2 points must be drawn. Please give a larger number of points.")
+    elif is_valid_dimension(height) and is_valid_dimension(width) and is_valid_chain(chain_id):
         height = int(height)
         width = int(width)
-        # Get all atom numbers in one list, and temperature factors in a second one
-        atom_nums = []
-        temp_factors = []
-        for line in lines:
-            # Get each line detailing an atom of a protein residue only of given chain
-            if line.startswith("ATOM") and (line[21] == chain_id):
-                atom_num = int(line[4:11])
-                temp_factor = float(line[61:66])
-                atom_nums.append(atom_num)
-                temp_factors.append(int(temp_factor))
+        (x, y) = temp_factor_points(chain_id, lines, per_residue, selection)
         # If nothing found, given chain ID does not exist
-        if atom_nums == []:
+        if len(x) == 0:
             print("Temperature factors for a chain ID of {0} could not be found.".format(chain_id))
-        else:
-            # Plotting line graph of size height by width
-            fig = plt.figure(figsize=(height, width))
-            # X axis is atom numbers, y axis is temperature factor
-            plt.plot(atom_nums, temp_factors)
-            # Label x and y axes
-            plt.title("Line plot of temperature factor of the protein residues for chain {0} of PDB ID {1}".format(chain_id, pdb_id))
-            plt.xlabel("Atom number")
-            plt.ylabel("Temperature factor")
-            if is_valid_filename(output_filename):
-                output_filename = output_filename + ".png"
-                plt.savefig(output_filename)
+        elif is_valid_filename(output_filename):
+            # Line graph of size height by width, with atom (or residue) numbers on the x axis
+            title = "Line plot of temperature factor of the protein residues for chain {0} of PDB ID {1}".format(chain_id, pdb_id)
+            xlabel = "Residue number" if per_residue else "Atom number"
+            get_plotter().save(x, y, height, width, title, xlabel, output_filename + ".png", max_points)
+            return True
+    return False
+
+def _plot_file_temp_factors(task):
+    """Plots every chain of one PDB file in a worker process (see plot_temp_factors)
+    Input:
+    task - (name of the PDB file, height, width, output folder, per_residue, max_points, profiling) (type tuple)
+    Output:
+    Names of the files saved (list of strings)
+    Calls recorded by pdbprofile in the worker, to add to those of the main process (type dictionary)
+    Both are returned as a tuple"""
+    (filename, height, width, output_dir, per_residue, max_points, profiling) = task
+    # Workers record the calls they make if the main process is recording
+    if profiling:
+        pdbprofile.enable()
+    with pdbprofile.collect() as recorded:
+        lines = read_pdb_file(filename)
+        pdb_id = pdb_id_from_filename(filename)
+        plotter = get_plotter()
+        saved = []
+        for chain_id in get_structure(lines).chain_ids(("ATOM",)):
+            (x, y) = temp_factor_points(chain_id, lines, per_residue)
+            output_filename = os.path.join(output_dir, "{0}_{1}_tempfact.png".format(pdb_id, chain_id))
+            title = "Line plot of temperature factor of the protein residues for chain {0} of PDB ID {1}".format(chain_id, pdb_id)
+            plotter.save(x, y, height, width, title, "Residue number" if per_residue else "Atom number", output_filename, max_points)
+            saved.append(output_filename)
+    return (saved, recorded)
+
+@pdbprofile.timed("plot")
+def plot_temp_factors(filenames, height=6, width=4, output_dir=".", per_residue=False, max_points=None, workers=None):
+    """Plots the temperature factors of every chain with protein residues of every given PDB file, sharing the files
+    out between a pool of worker processes. Plots are saved as <ID>_<chain>_tempfact.png, where ID is the PDB ID of
+    the file name (see pdb_id_from_filename).
+    Inputs:
+    filenames - names of PDB files, plain or compressed (list of strings)
+    height, width - size of each plot in inches, as for plot_temp_factor (type int)
+    output_dir - folder to save the plots in (type string)
+    per_residue - if True, the mean temperature factor of each residue is plotted instead of each atom (type bool)
+    max_points - largest number of points to draw for each plot, as for plot_temp_factor (type int)
+    workers - number of worker processes (if None, the number of CPUs) (type int)
+    Output:
+    Names of the files saved (list of strings)"""
+    if (max_points is not None) and (max_points < 2):
+        print("At least 2 points must be drawn. Please give a larger number of points.")
+        return []
+    profiling = pdbprofile.is_enabled()
+    tasks = [(filename, height, width, output_dir, per_residue, max_points, profiling) for filename in filenames]
+    if len(tasks) == 0:
+        return []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(tasks))) as executor:
+        results = list(executor.map(_plot_file_temp_factors, tasks))
+    if profiling:
+        for (saved, recorded) in results:
+            pdbprofile.merge(recorded)
+    return [output_filename for (saved, recorded) in results for output_filename in saved]
+
+"""
+Streaming functions: these read a PDB file one line at a time from a file name or an open file object, and write
+their results to another file name or file object as they go, so files larger than memory can be processed. Only
+the current line (and, for sequences, the sequences found so far) is kept in memory.
+"""
+
+# A parsed ATOM or HETATM record, with one field for each of ATOM_COLUMNS and the full line
+AtomRecord = namedtuple("AtomRecord", list(ATOM_COLUMNS.keys()) + ["line"])
+# Any other record (header, TER, MODEL, END, ...), with the record name and the full line
+PDBRecord = namedtuple("PDBRecord", ["record", "line"])
+
+@contextlib.contextmanager
+def _open_stream(path_or_fileobj, mode):
+    """Opens the file if given a file name, or uses it as it is if it is already a text file object (which is not
+    closed). Files read from a name or a binary file object may be compressed, and binary file objects are closed.
+    Inputs:
+    path_or_fileobj - name of a file, or an open file object
+    mode - mode to open a file name with (type string)
+    Output:
+    Open file object (yielded)"""
+    if isinstance(path_or_fileobj, (str, os.PathLike)):
+        with (open_pdb_file(path_or_fileobj) if mode == 'r' else open(path_or_fileobj, mode)) as fobject:
+            yield fobject
+    elif (mode == 'r') and not isinstance(path_or_fileobj, io.TextIOBase):
+        with open_pdb_file(path_or_fileobj) as fobject:
+            yield fobject
+    else:
+        yield path_or_fileobj
+
+def parse_atom_line(line):
+    """Parses the fixed-width fields of an ATOM or HETATM line, the same way as the columns of a Structure
+    Input:
+    line - ATOM or HETATM line (type string)
+    Output:
+    Parsed record (type AtomRecord)"""
+    fields = {}
+    for field, (start, end) in ATOM_COLUMNS.items():
+        value = line[start:end].strip()
+        if field in ("serial", "resseq"):
+            try:
+                value = int(value) if value != "" else 0
+            except ValueError:
+                value = 0
+        elif field in ("x", "y", "z", "occupancy", "bfactor"):
+            try:
+                value = float(value) if value != "" else np.nan
+            except ValueError:
+                value = np.nan
+        fields[field] = value
+    return AtomRecord(line=line, **fields)
+
+def iter_records(path_or_fileobj):
+    """Yields each record of a PDB file in order, reading one line at a time
+    Input:
+    path_or_fileobj - name of a PDB file, or a PDB file opened in text mode
+    Output:
+    AtomRecord for each ATOM and HETATM line, and PDBRecord for every other line (yielded)"""
+    with _open_stream(path_or_fileobj, 'r') as fobject:
+        for line in fobject:
+            line = line.rstrip("\n")
+            if line.startswith(("ATOM", "HETATM")):
+                yield parse_atom_line(line)
+            else:
+                yield PDBRecord(line[:6].strip(), line)
+
+@pdbprofile.timed("query")
+def stream_prot_residues(source):
+    """Returns the single letter protein residues of every chain, reading the file one record at a time
+    Input:
+    source - name of a PDB file, or a PDB file opened in text mode
+    Output:
+    First line of the file (type string)
+    Protein residues for each chain, in the order the chains first appear (dictionary of chain ID: string)"""
+    first_line = None
+    sequences = {}
+    previous = None
+    for record in iter_records(source):
+        if first_line is None:
+            first_line = record.line
+        # Only the first model is read if the file has several, as in get_all_prot_sequences
+        if record.record == "ENDMDL":
+            break
+        # First atom of each protein residue, as in get_all_prot_sequences
+        if isinstance(record, AtomRecord) and (record.record == "ATOM"):
+            residue = (record.chain, record.resseq, record.icode)
+            if residue != previous:
+                sequences.setdefault(record.chain, []).append(PROTEIN_CODES.get(record.resname, "X"))
+            previous = residue
+    return ((first_line or ""), {chain_id: "".join(residues) for chain_id, residues in sequences.items()})
+
+@pdbprofile.timed("write")
+def stream_fasta_protseqs(source, target, chain_id="", width=80):
+    """Writes the protein residue sequences of one or all chains of a PDB file to a FASTA file, reading the PDB file
+    one record at a time
+    Inputs:
+    source - name of a PDB file, or a PDB file opened in text mode
+    target - name of the FASTA file to write to, including extension (.gz to compress it), or a file object opened
+    for writing, or a FastaWriter (so that many PDB files can be written to one FASTA file)
+    chain_id - Chain ID of protein residues to write (if empty string, all chains are written)
+    width - number of sequence characters on each line (type int)
+    Output:
+    Chain IDs written (list of strings)"""
+    (first_line, sequences) = stream_prot_residues(source)
+    if chain_id != "":
+        sequences = {chain_id: sequences[chain_id]} if chain_id in sequences else {}
+    header = " ".join((first_line[10:-1]).split())
+    with (contextlib.nullcontext(target) if isinstance(target, FastaWriter) else FastaWriter(target, width)) as writer:
+        for (seq_chain_id, prot_res) in sequences.items():
+            writer.write(header + ": {0}".format(seq_chain_id), prot_res)
+    return list(sequences.keys())
 
+@pdbprofile.timed("write")
+def stream_residue_lines(chain_id, starting, source, target):
+    """Writes all lines which start with the given strings in the starting list and contain the chain ID, reading the
+    PDB file one line at a time
+    Inputs:
+    chain_id - Chain ID used to find lines only containing that chain ID (type string)
+    starting - Starting strings for lines to find (list of strings)
+    source - name of a PDB file, or a PDB file opened in text mode
+    target - name of the file to write to, including extension, or a file object opened for writing
+    Output:
+    Number of lines written (type int)"""
+    starting = tuple(starting)
+    written = 0
+    with _open_stream(source, 'r') as in_fobject, _open_stream(target, 'w') as out_fobject:
+        for line in in_fobject:
+            line = line.rstrip("\n")
+            if line.startswith(starting) and (line[21:22] == chain_id):
+                out_fobject.write(line + "\n")
+                written += 1
+    return written
+
+def stream_alter_chain_id(old_chain_id, new_chain_id, source, target):
+    """Copies a PDB file, altering the old chain ID to a new chain ID for all residues, one line at a time
+    Inputs:
+    old_chain_id - Chain ID currently in file that must be altered (type string)
+    new_chain_id - Chain ID that the old ID will be replaced with (type string)
+    source - name of a PDB file, or a PDB file opened in text mode
+    target - name of the file to write to, including extension, or a file object opened for writing
+    Output:
+    Number of lines altered, counting only lines whose chain ID was changed (type int)"""
+    return stream_remap_chains({old_chain_id: new_chain_id}, source, target)
+
+@pdbprofile.timed("write")
+def stream_remap_chains(mapping, source, target):
+    """Copies a PDB file, altering any number of chain IDs at once in ATOM, HETATM, ANISOU, TER and SEQRES records,
+    one line at a time
+    Inputs:
+    mapping - new chain ID for each old chain ID (dictionary of string: string)
+    source - name of a PDB file, or a PDB file opened in text mode
+    target - name of the file to write to, including extension, or a file object opened for writing
+    Output:
+    Number of lines altered, counting only lines whose chain ID was changed (type int), or 0 if the mapping is not
+    valid, in which case nothing is written"""
+    # Check the mapping before the target is opened, as a chain ID that is empty or longer than one character would
+    # shift the columns of every altered line
+    if not _is_valid_mapping(mapping):
+        return 0
+    altered = 0
+    with _open_stream(source, 'r') as in_fobject, _open_stream(target, 'w') as out_fobject:
+        for line in in_fobject:
+            # If a record with a chain ID, and the chain ID is one to alter, replace it
+            new_line = _remap_line(line, mapping)
+            if (new_line is not None) and (new_line != line):
+                line = new_line
+                altered += 1
+            out_fobject.write(line)
+    return altered
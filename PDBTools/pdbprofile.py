@@ -0,0 +1,202 @@
+import contextlib
+import functools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from PDBTools import pdbcache
+
+
+"""
+Opt-in instrumentation of pdblib. When it is turned on (with enable(), or by setting the PDBTOOLS_PROFILE
+environment variable), every call of the instrumented functions (downloading, reading, parsing, queries, writing
+files and plotting) is timed, and the bytes read, downloaded and written, and the hits of the structure and download
+caches, are counted. stats() returns everything recorded, with the number of calls, total time and percentile times of
+each function; dump() saves it as JSON and report() prints it as a table.
+
+When it is off, each instrumented call only checks one flag, so it costs well under a microsecond.
+"""
+
+# Largest number of call times kept for each function to find percentiles from; later calls replace kept times at
+# random (reservoir sampling), so the kept times stay a fair sample of every call
+MAX_SAMPLES = 10000
+
+_enabled = bool(os.environ.get("PDBTOOLS_PROFILE"))
+_lock = threading.Lock()
+# For each function: [category, calls, total seconds, longest call in seconds, sampled call times]
+_calls = {}
+# Counts of bytes and cache hits, by name
+_counters = {}
+
+def enable():
+    """Turns on recording"""
+    global _enabled
+    _enabled = True
+
+def disable():
+    """Turns off recording (what has been recorded is kept)"""
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    """Returns True if recording is on, False otherwise"""
+    return _enabled
+
+def reset():
+    """Removes everything recorded"""
+    with _lock:
+        _calls.clear()
+        _counters.clear()
+
+def _record(name, category, elapsed):
+    """Adds one call of a function and the time it took"""
+    with _lock:
+        entry = _calls.get(name)
+        if entry is None:
+            entry = _calls[name] = [category, 0, 0.0, 0.0, []]
+        entry[1] += 1
+        entry[2] += elapsed
+        entry[3] = max(entry[3], elapsed)
+        samples = entry[4]
+        if len(samples) < MAX_SAMPLES:
+            samples.append(elapsed)
+        else:
+            slot = random.randrange(entry[1])
+            if slot < MAX_SAMPLES:
+                samples[slot] = elapsed
+
+def timed(category, name=None):
+    """Decorator that records the calls of a function and the time each takes, when recording is on
+    Inputs:
+    category - kind of work the function does: download, read, parse, query, write or plot (type string)
+    name - name to record the calls under (the qualified name of the function if None) (type string)
+    Output:
+    Decorator (type function)"""
+    def decorator(function):
+        label = name if name is not None else function.__qualname__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _record(label, category, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def add(counter, amount=1):
+    """Adds to a counter (e.g. bytes_read or structure_cache_hits), when recording is on
+    Inputs:
+    counter - name of the counter (type string)
+    amount - amount to add (type int)"""
+    if _enabled:
+        with _lock:
+            _counters[counter] = _counters.get(counter, 0) + amount
+
+def _percentile(ordered, fraction):
+    """Returns the value at the given fraction (0 to 1) of a sorted list, or 0 if it is empty"""
+    if ordered == []:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def export():
+    """Returns everything recorded in a form that can be sent between processes and added with merge()
+    Output:
+    Recorded calls and counters (type dictionary)"""
+    with _lock:
+        return {"calls": {name: [entry[0], entry[1], entry[2], entry[3], list(entry[4])] for (name, entry) in _calls.items()},
+                "counters": dict(_counters)}
+
+def merge(recorded):
+    """Adds what another process (or a collect() block) recorded to what this process has recorded
+    Input:
+    recorded - result of export() (type dictionary)"""
+    with _lock:
+        for (name, (category, calls, total, longest, samples)) in recorded["calls"].items():
+            entry = _calls.get(name)
+            if entry is None:
+                entry = _calls[name] = [category, 0, 0.0, 0.0, []]
+            entry[1] += calls
+            entry[2] += total
+            entry[3] = max(entry[3], longest)
+            entry[4].extend(samples)
+            if len(entry[4]) > MAX_SAMPLES:
+                entry[4] = random.sample(entry[4], MAX_SAMPLES)
+        for (counter, amount) in recorded["counters"].items():
+            _counters[counter] = _counters.get(counter, 0) + amount
+
+@contextlib.contextmanager
+def collect():
+    """Records the calls made inside a with block separately, so they can be sent to another process, then adds them
+    to what this process has recorded when the block ends
+    Output:
+    Dictionary that is filled with the result of export() for the block when it ends (yielded)"""
+    global _calls, _counters
+    with _lock:
+        saved = (_calls, _counters)
+        (_calls, _counters) = ({}, {})
+    recorded = {}
+    try:
+        yield recorded
+    finally:
+        recorded.update(export())
+        with _lock:
+            (_calls, _counters) = saved
+        merge(recorded)
+
+def stats():
+    """Returns everything recorded
+    Output:
+    Dictionary with the keys enabled, functions (calls, total_s, mean_s, p50_s, p90_s, p99_s and max_s of each
+    function, slowest in total first), categories (calls and total_s of each category, where the time of a call made
+    inside another instrumented call is counted in both) and counters (bytes and cache hits), plus download_cache with the statistics of the download cache if one is turned on (type dictionary)"""
+    with _lock:
+        calls = {name: (entry[0], entry[1], entry[2], entry[3], sorted(entry[4])) for (name, entry) in _calls.items()}
+        counters = dict(_counters)
+    functions = {}
+    categories = {}
+    for (name, (category, count, total, longest, ordered)) in sorted(calls.items(), key=lambda item: item[1][2], reverse=True):
+        functions[name] = {"category": category, "calls": count, "total_s": total, "mean_s": total / count,
+                           "p50_s": _percentile(ordered, 0.5), "p90_s": _percentile(ordered, 0.9),
+                           "p99_s": _percentile(ordered, 0.99), "max_s": longest}
+        summary = categories.setdefault(category, {"calls": 0, "total_s": 0.0})
+        summary["calls"] += count
+        summary["total_s"] += total
+    result = {"enabled": _enabled, "functions": functions, "categories": categories, "counters": counters}
+    # The download cache keeps its own counts, as it is used whether or not recording is on
+    cache = pdbcache.get_cache()
+    if cache is not None:
+        result["download_cache"] = cache.stats()
+    return result
+
+def dump(target):
+    """Saves everything recorded as JSON
+    Input:
+    target - name of the file to save to, or a file object opened for writing text"""
+    if isinstance(target, (str, os.PathLike)):
+        with open(target, 'w') as fobject:
+            json.dump(stats(), fobject, indent=1)
+    else:
+        json.dump(stats(), target, indent=1)
+
+def report(fobject=None):
+    """Prints everything recorded as a table, slowest functions first
+    Input:
+    fobject - file object to print to (sys.stderr if None)"""
+    fobject = fobject if fobject is not None else sys.stderr
+    recorded = stats()
+    print("{0:<34} {1:<9} {2:>8} {3:>11} {4:>10} {5:>10} {6:>10} {7:>10}".format("function", "category", "calls", "total (ms)", "p50 (ms)", "p90 (ms)", "p99 (ms)", "max (ms)"), file=fobject)
+    for (name, entry) in recorded["functions"].items():
+        print("{0:<34} {1:<9} {2:>8} {3:>11.2f} {4:>10.3f} {5:>10.3f} {6:>10.3f} {7:>10.3f}".format(name, entry["category"], entry["calls"], entry["total_s"] * 1000,
+              entry["p50_s"] * 1000, entry["p90_s"] * 1000, entry["p99_s"] * 1000, entry["max_s"] * 1000), file=fobject)
+    for (category, entry) in sorted(recorded["categories"].items(), key=lambda item: item[1]["total_s"], reverse=True):
+        print("Total {0}: {1} calls, {2:.2f} ms".format(category, entry["calls"], entry["total_s"] * 1000), file=fobject)
+    for (counter, amount) in sorted(recorded["counters"].items()):
+        print("{0}: {1}".format(counter, amount), file=fobject)
+    if "download_cache" in recorded:
+        cache = recorded["download_cache"]
+        print("download cache: {0} hits, {1} misses, {2} stored, {3} evicted".format(cache["hits"], cache["misses"], cache["stores"], cache["evictions"]), file=fobject)
@@ -0,0 +1,322 @@
+import collections
+import concurrent.futures
+import csv
+import json
+import os
+import tarfile
+import numpy as np
+from PDBTools import pdblib
+from PDBTools import pdbprofile
+
+
+"""
+Scans a whole corpus of PDB files (a folder, searched recursively, or a tar file such as a PDB mirror archive) for
+non-standard protein residues, sharing the files out between a pool of worker processes. For each file, the number of
+residues of each non-standard residue code in each chain is counted, and the result of each file is written to a CSV
+or JSONL file as soon as it is ready, so a scan of hundreds of thousands of files can be followed (or stopped) as it
+runs.
+
+Only the columns that are needed (record name, residue name, chain ID, residue number and insertion code) are sliced
+out of the bytes of each file, with array operations over every line at once; nothing is parsed into a Structure. A
+new residue starts wherever the chain ID, the whole residue number (columns 23-26) or the insertion code changes, so
+residue numbers of 1000 and above and inserted residues (e.g. 52A) are each counted once, as are residues with
+alternate locations. Only the first model of files with several models (e.g. NMR ensembles) is counted.
+"""
+
+# Columns used from each coordinate line: residue name (17-20), chain ID (21), residue number (22-26) and insertion
+# code (26), as [start, stop) character positions; the record name (0-6) is read with them
+SCAN_COLUMNS = (17, 27)
+# Number of files given to a worker process at a time, so small files do not cost one message each
+SCAN_CHUNK = 16
+# Columns of the CSV output: one row for each non-standard residue code of each chain of each file, or one row with
+# an empty chain and code for a file with none
+CSV_FIELDS = ("file", "pdb_id", "chain", "code", "count", "residues", "error")
+
+def _line_columns(data, starts, ends, last):
+    """Returns the first characters of each line as a 2D array, padding lines that are too short with spaces
+    Inputs:
+    data - bytes of the file (type uint8 array)
+    starts, ends - byte offsets of the start and end of each line (type int arrays)
+    last - number of characters to take from each line (type int)
+    Output:
+    Characters of each line, one row per line (type uint8 array)"""
+    # Every run of last characters of the file, as a view (nothing is copied), so the characters of each line are
+    # copied as one row rather than one character at a time; the file is padded so the last lines have enough
+    padded = np.concatenate((data, np.full(last, ord(" "), dtype=np.uint8)))
+    columns = np.lib.stride_tricks.sliding_window_view(padded, last)[starts]
+    # Lines shorter than last run into the next line, so blank the characters past their end
+    short = np.flatnonzero(ends - starts < last)
+    if len(short) > 0:
+        columns[short] = np.where(np.arange(last) < (ends[short] - starts[short])[:, None], columns[short], ord(" "))
+    return columns
+
+def count_nonstandard(data, records=("ATOM",)):
+    """Counts the residues of a PDB file, and the non-standard protein residues of each chain, from the bytes of the
+    file (see the description of the scan above)
+    Inputs:
+    data - contents of the PDB file, uncompressed (type bytes)
+    records - record types whose residues are counted (tuple of strings, ATOM unless given)
+    Outputs:
+    Number of residues counted (type int)
+    Number of residues of each non-standard code in each chain, in the order the chains first appear (dictionary of
+    chain ID: dictionary of residue code: int)
+    Both are returned as a tuple"""
+    data = np.frombuffer(data, dtype=np.uint8)
+    if len(data) == 0:
+        return (0, {})
+    ends = np.flatnonzero(data == ord("\n"))
+    if (len(ends) == 0) or (ends[-1] != len(data) - 1):
+        ends = np.append(ends, len(data))
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # Only lines starting with the first letter of a wanted record (or E, for ENDMDL) need their record name read
+    letters = np.frombuffer("".join(record[0] for record in records).encode("ascii") + b"E", dtype=np.uint8)
+    candidates = np.flatnonzero(np.isin(data[np.minimum(starts, len(data) - 1)], letters))
+    columns = _line_columns(data, starts[candidates], ends[candidates], SCAN_COLUMNS[1])
+    names = np.ascontiguousarray(columns[:, 0:6]).view("S6").ravel()
+    wanted = np.isin(names, [record.ljust(6).encode("ascii") for record in records])
+    # Stop at the end of the first model
+    model_ends = np.flatnonzero(names == b"ENDMDL")
+    if len(model_ends) > 0:
+        wanted[model_ends[0]:] = False
+    columns = columns[wanted, SCAN_COLUMNS[0]:]
+    if len(columns) == 0:
+        return (0, {})
+    # Chain ID, residue number and insertion code of each atom, compared as raw bytes with the atom before
+    keys = np.ascontiguousarray(columns[:, 4:10]).view("S6").ravel()
+    new_residue = np.ones(len(columns), dtype=bool)
+    new_residue[1:] = keys[1:] != keys[:-1]
+    first = columns[new_residue]
+    resnames = np.char.strip(np.ascontiguousarray(first[:, 0:3]).view("S3").ravel())
+    # Water is not counted as a non-standard residue when HETATM records are included
+    nonstandard = ~np.isin(resnames, [code.encode("ascii") for code in pdblib.STANDARD_RESIDUES + pdblib.WATER_NAMES])
+    chains = {}
+    if nonstandard.any():
+        # Count each (chain ID, residue code) pair once, then group the counts by chain in order of first appearance
+        pairs = np.ascontiguousarray(first[nonstandard][:, [4, 0, 1, 2]]).view("S4").ravel()
+        (unique, first_idx, counts) = np.unique(pairs, return_index=True, return_counts=True)
+        for idx in np.argsort(first_idx, kind="stable"):
+            pair = unique[idx].decode("ascii", "replace").ljust(4)
+            chains.setdefault(pair[0].strip(), {})[pair[1:].strip()] = int(counts[idx])
+    return (int(new_residue.sum()), chains)
+
+def scan_file(name, source, records=("ATOM",)):
+    """Scans one PDB file for non-standard protein residues. Errors are recorded in the result rather than raised, so
+    one bad file does not stop a scan of a whole corpus.
+    Inputs:
+    name - name of the file (or tar member) to report the result under (type string)
+    source - name of the file, plain or compressed, or its contents as bytes (compressed or not)
+    records - record types whose residues are counted (tuple of strings, ATOM unless given)
+    Output:
+    Result with the keys file, pdb_id, residues, nonstandard (total number of non-standard residues), chains (counts
+    of each code in each chain, as from count_nonstandard) and error (empty if the file was scanned) (type dictionary)"""
+    result = {"file": name, "pdb_id": pdblib.pdb_id_from_filename(name), "residues": 0, "nonstandard": 0,
+              "chains": {}, "error": ""}
+    try:
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as fobject:
+                source = fobject.read()
+        # Compressed files (and tar members) are decompressed in memory
+        module = pdblib.get_compression(None, source[:6])
+        if module is not None:
+            source = module.decompress(source)
+        pdbprofile.add("bytes_read", len(source))
+        (result["residues"], result["chains"]) = count_nonstandard(source, records)
+    except Exception as error:
+        result["error"] = "{0}: {1}".format(type(error).__name__, error)
+    result["nonstandard"] = sum(count for codes in result["chains"].values() for count in codes.values())
+    return result
+
+def _scan_chunk(task):
+    """Scans a chunk of files in a worker process (see scan_corpus)
+    Input:
+    task - (list of (name, file name or bytes) of each file, records, profiling) (type tuple)
+    Output:
+    Results of scan_file for each file (list of dictionaries)
+    Calls recorded by pdbprofile in the worker, to add to those of the main process (type dictionary)
+    Both are returned as a tuple"""
+    (files, records, profiling) = task
+    if profiling:
+        pdbprofile.enable()
+    with pdbprofile.collect() as recorded:
+        results = [scan_file(name, source, records) for (name, source) in files]
+    return (results, recorded)
+
+def iter_corpus(source):
+    """Finds every PDB file of a corpus: the files of a folder (and of its subfolders, in sorted order) whose names end
+    in one of pdblib.LOCAL_EXTENSIONS or .ent, the members of a tar file with those endings, or a single PDB file
+    Input:
+    source - name of a folder, tar file (which may be compressed) or PDB file (type string)
+    Output:
+    (name of the file relative to the folder or the tar member name, file name or the bytes of the tar member) for each
+    PDB file (yielded tuples)"""
+    extensions = pdblib.LOCAL_EXTENSIONS + (".ent",)
+    if os.path.isdir(source):
+        for (folder, subfolders, filenames) in os.walk(source):
+            subfolders.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(extensions):
+                    path = os.path.join(folder, filename)
+                    yield (os.path.relpath(path, source), path)
+    elif tarfile.is_tarfile(source):
+        # Stream mode reads the members in order without seeking, so the tar file is only decompressed once; members
+        # are read here and sent to the workers as bytes
+        with tarfile.open(source, 'r|*') as tar:
+            for member in tar:
+                if member.isfile() and os.path.basename(member.name).lower().endswith(extensions):
+                    yield (member.name, tar.extractfile(member).read())
+    else:
+        yield (os.path.basename(source), source)
+
+def chunks(items, size):
+    """Groups items into lists of at most size items, as they are produced"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk != []:
+        yield chunk
+
+def map_bounded(function, tasks, workers=None):
+    """Runs a function on each task across a pool of worker processes, yielding each result as soon as it is ready
+    (so results may not be in the order of the tasks). Tasks are only taken from the iterable when a worker is
+    nearly free, a few per worker, so tasks holding file contents are not all in memory at once.
+    Inputs:
+    function - function of one task, which must be defined at the top level of a module (type function)
+    tasks - tasks to run (iterable)
+    workers - number of worker processes (if None, the number of CPUs; 1 runs every task in this process) (type int)
+    Output:
+    Result of the function for each task (yielded)"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for task in tasks:
+            yield function(task)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for task in tasks:
+            pending.add(executor.submit(function, task))
+            # Wait for a task to finish before taking more once every worker has a few tasks queued
+            if len(pending) >= workers * 4:
+                (done, pending) = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            (done, pending) = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def iter_scan(source, workers=None, records=("ATOM",), chunk_size=SCAN_CHUNK):
+    """Scans every PDB file of a corpus for non-standard protein residues across a pool of worker processes, yielding
+    the result of each file as soon as it is ready (so results may not be in file order). Only a few chunks of files
+    per worker are read ahead, so the files of a large tar file are not all held in memory at once.
+    Inputs:
+    source - name of a folder, tar file or PDB file (see iter_corpus) (type string)
+    workers - number of worker processes (if None, the number of CPUs; 1 scans in this process) (type int)
+    records - record types whose residues are counted (tuple of strings, ATOM unless given)
+    chunk_size - number of files given to a worker at a time (type int)
+    Output:
+    Result of scan_file for each file (yielded dictionaries)"""
+    workers = workers or os.cpu_count() or 1
+    profiling = pdbprofile.is_enabled()
+    tasks = ((chunk, records, profiling) for chunk in chunks(iter_corpus(source), chunk_size))
+    for (results, recorded) in map_bounded(_scan_chunk, tasks, workers):
+        # Calls made in this process have already been added up, but those of worker processes have not
+        if profiling and (workers > 1):
+            pdbprofile.merge(recorded)
+        yield from results
+
+class ScanWriter:
+    """Writes the results of a scan to a CSV or JSONL file as they are given, flushing after each file, so the output
+    is complete up to the last file scanned even if the scan is stopped. Can be used in a with statement.
+    CSV files have one row for each non-standard residue code of each chain of each file (see CSV_FIELDS), and a row
+    with an empty chain and code for each file without any; JSONL files have one line for each file, holding its whole
+    result from scan_file.
+    Attributes:
+    format - csv or jsonl (type string)
+    files - number of files written (type int)"""
+
+    def __init__(self, filename_or_fileobj, format=None):
+        """Opens the output file for writing
+        Inputs:
+        filename_or_fileobj - name of the output file, or a file object opened for writing text
+        format - csv or jsonl (if None, jsonl for file names ending in .jsonl or .json, and csv otherwise) (type string)"""
+        if format is None:
+            name = str(filename_or_fileobj) if isinstance(filename_or_fileobj, (str, os.PathLike)) else ""
+            format = "jsonl" if name.lower().endswith((".jsonl", ".json")) else "csv"
+        self.format = format
+        self.files = 0
+        if isinstance(filename_or_fileobj, (str, os.PathLike)):
+            self._fobject = open(filename_or_fileobj, 'w', newline="")
+            self._close = True
+        else:
+            self._fobject = filename_or_fileobj
+            self._close = False
+        if self.format == "csv":
+            self._csv = csv.writer(self._fobject)
+            self._csv.writerow(CSV_FIELDS)
+
+    def write(self, result):
+        """Writes the result of one file
+        Input:
+        result - result of scan_file (type dictionary)
+        Output:
+        None (writes the result)"""
+        if self.format == "jsonl":
+            self._fobject.write(json.dumps(result) + "\n")
+        else:
+            rows = [(result["file"], result["pdb_id"], chain_id, code, count, result["residues"], result["error"])
+                    for (chain_id, codes) in result["chains"].items() for (code, count) in codes.items()]
+            if rows == []:
+                rows = [(result["file"], result["pdb_id"], "", "", 0, result["residues"], result["error"])]
+            self._csv.writerows(rows)
+        self._fobject.flush()
+        self.files += 1
+
+    def close(self):
+        """Closes the file, unless it was given as a file object"""
+        if self._close:
+            self._fobject.close()
+        else:
+            self._fobject.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+@pdbprofile.timed("query")
+def scan_corpus(source, output=None, format=None, workers=None, records=("ATOM",)):
+    """Scans every PDB file of a corpus for non-standard protein residues across a pool of worker processes, writing
+    the result of each file to the output as soon as it is ready
+    Inputs:
+    source - name of a folder, tar file or PDB file (see iter_corpus) (type string)
+    output - name of a CSV or JSONL file, or a file object opened for writing text, to write each result to (nothing
+    is written if None)
+    format - csv or jsonl, as for ScanWriter (type string)
+    workers - number of worker processes (if None, the number of CPUs) (type int)
+    records - record types whose residues are counted (tuple of strings, ATOM unless given)
+    Output:
+    Summary with the keys files (number of files scanned), failed (number that could not be read), residues (total
+    residues counted), files_with_nonstandard (number of files with any non-standard residue) and codes (total
+    residues of each non-standard code, most common first) (type dictionary)"""
+    codes = collections.Counter()
+    summary = {"files": 0, "failed": 0, "residues": 0, "files_with_nonstandard": 0}
+    writer = ScanWriter(output, format) if output is not None else None
+    try:
+        for result in iter_scan(source, workers, records):
+            if writer is not None:
+                writer.write(result)
+            summary["files"] += 1
+            summary["failed"] += (result["error"] != "")
+            summary["residues"] += result["residues"]
+            summary["files_with_nonstandard"] += (result["nonstandard"] > 0)
+            for chain_codes in result["chains"].values():
+                codes.update(chain_codes)
+    finally:
+        if writer is not None:
+            writer.close()
+    summary["codes"] = dict(codes.most_common())
+    return summary
@@ -0,0 +1,193 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from PDBTools import pdblib
+
+
+"""
+Persistent cache of parsed structures, so that reopening a large PDB file does not split and parse its text again.
+Each entry is a folder holding an uncompressed copy of the file (lines.pdb) and the offsets of its lines, one .npy
+file per column of the Structure, and meta.json with the header records and the key of the source file. Opening a cached entry memory-maps
+the copy of the file and every column, so nothing is read from disk until it is used.
+
+Entries are keyed by the absolute path of the source file, and are checked against the source file's size,
+modification time and SHA-256 hash: if the size or modification time have changed, the hash is compared, and the
+entry is parsed and saved again if the contents are different.
+"""
+
+# Version of the layout of a cache entry; entries with another version are parsed again
+STORE_VERSION = 1
+# Folder used for parsed structures if none is given
+DEFAULT_STORE_DIR = os.environ.get("PDBTOOLS_STORE_DIR", os.path.join("~", ".cache", "pdbtools", "parsed"))
+
+def _file_hash(filename):
+    """Returns the SHA-256 hash of the contents of a file, reading it a block at a time
+    Input:
+    filename - name of the file (type string)
+    Output:
+    Hexadecimal hash (type string)"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as fobject:
+        for block in iter(lambda: fobject.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def entry_path(filename, store_dir=None):
+    """Returns the folder of the cache entry for a source file (whether or not it exists)
+    Inputs:
+    filename - name of the source PDB file (type string)
+    store_dir - folder of the cache (DEFAULT_STORE_DIR if None) (type string)
+    Output:
+    Name of the entry folder (type string)"""
+    store_dir = os.path.expanduser(store_dir if store_dir is not None else DEFAULT_STORE_DIR)
+    key = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()
+    return os.path.join(store_dir, key)
+
+def _read_meta(entry):
+    """Returns the metadata of a cache entry, or None if it does not exist or cannot be read"""
+    try:
+        with open(os.path.join(entry, "meta.json"), 'r') as fobject:
+            meta = json.load(fobject)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("version") == STORE_VERSION else None
+
+def is_current(filename, store_dir=None):
+    """Returns True if there is a cache entry for the source file that matches its current contents, False otherwise
+    Inputs:
+    filename - name of the source PDB file (type string)
+    store_dir - folder of the cache (DEFAULT_STORE_DIR if None) (type string)
+    Output:
+    True if the entry can be used, False if it is missing or out of date"""
+    entry = entry_path(filename, store_dir)
+    meta = _read_meta(entry)
+    if meta is None:
+        return False
+    stat = os.stat(filename)
+    if (meta["size"] == stat.st_size) and (meta["mtime_ns"] == stat.st_mtime_ns):
+        return True
+    # A different size means different contents; a different time alone needs the contents to be compared
+    if meta["size"] != stat.st_size:
+        return False
+    if meta["sha256"] != _file_hash(filename):
+        return False
+    # Same contents (e.g. the file was only touched), so record the new time to skip hashing next time
+    meta["size"] = stat.st_size
+    meta["mtime_ns"] = stat.st_mtime_ns
+    _write_json(os.path.join(entry, "meta.json"), meta)
+    return True
+
+def _write_json(filename, data):
+    """Writes data to a JSON file through a temporary file, so readers never see a partly written file"""
+    (handle, temp_filename) = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".json")
+    with os.fdopen(handle, 'w') as fobject:
+        json.dump(data, fobject)
+    os.replace(temp_filename, filename)
+
+def save_structure(filename, lines=None, store_dir=None):
+    """Parses a PDB file (plain or compressed) and saves its structure as a cache entry, replacing any old entry
+    Inputs:
+    filename - name of the source PDB file (type string)
+    lines - contents of the file, if already read (list of string lines)
+    store_dir - folder of the cache (DEFAULT_STORE_DIR if None) (type string)
+    Output:
+    Name of the entry folder, or None if the entry could not be saved (type string)"""
+    entry = entry_path(filename, store_dir)
+    stat = os.stat(filename)
+    if lines is None:
+        lines = pdblib.read_pdb_file(filename)
+    structure = pdblib.get_structure(lines)
+    # Build the entry in a temporary folder next to it, then move it into place
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    temp_entry = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix=".tmp-")
+    try:
+        with open(os.path.join(temp_entry, "lines.pdb"), 'w', encoding="utf-8") as fobject:
+            fobject.write("\n".join(lines))
+        # Save the line offsets as well, so the copy of the file does not need to be scanned when it is mapped
+        saved_lines = pdblib.MappedLines(os.path.join(temp_entry, "lines.pdb"))
+        np.save(os.path.join(temp_entry, "line_starts.npy"), saved_lines.starts)
+        np.save(os.path.join(temp_entry, "line_ends.npy"), saved_lines.ends)
+        del saved_lines
+        np.save(os.path.join(temp_entry, "line_index.npy"), structure.line_index)
+        for field in pdblib.ATOM_COLUMNS.keys():
+            np.save(os.path.join(temp_entry, field + ".npy"), getattr(structure, field))
+        # Header records are every line before the first coordinate record
+        first_atom = int(structure.line_index[0]) if len(structure) > 0 else len(lines)
+        meta = {"version": STORE_VERSION, "source": os.path.abspath(filename), "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns, "sha256": _file_hash(filename), "atoms": len(structure),
+                "header": list(lines[:first_atom])}
+        _write_json(os.path.join(temp_entry, "meta.json"), meta)
+    except OSError as error:
+        shutil.rmtree(temp_entry, ignore_errors=True)
+        print("The parsed structure of {0} could not be saved to {1}: {2}".format(filename, entry, error))
+        return None
+    # Move any old entry aside first, so that the new entry is renamed into place in one step and readers see
+    # either the old entry or the new one, never a partly removed folder
+    old_entry = None
+    if os.path.isdir(entry):
+        old_entry = tempfile.mkdtemp(dir=os.path.dirname(entry), prefix=".old-")
+        try:
+            os.replace(entry, old_entry)
+        # Another worker may have moved or replaced the old entry already
+        except OSError:
+            os.rmdir(old_entry)
+            old_entry = None
+    try:
+        os.replace(temp_entry, entry)
+    except OSError as error:
+        shutil.rmtree(temp_entry, ignore_errors=True)
+        # If another worker saved the same entry first, theirs is kept; otherwise the old entry is put back
+        if not os.path.isdir(entry):
+            if old_entry is not None:
+                with contextlib.suppress(OSError):
+                    os.replace(old_entry, entry)
+                    old_entry = None
+            print("The parsed structure of {0} could not be saved to {1}: {2}".format(filename, entry, error))
+            entry = None
+    if old_entry is not None:
+        shutil.rmtree(old_entry, ignore_errors=True)
+    return entry
+
+def load_structure(filename, store_dir=None):
+    """Opens the cache entry of a PDB file without parsing anything: the copy of the file and every column are
+    memory-mapped, so they are only read from disk when used. Does not check that the entry is current.
+    Inputs:
+    filename - name of the source PDB file (type string)
+    store_dir - folder of the cache (DEFAULT_STORE_DIR if None) (type string)
+    Output:
+    Contents of the file, with its structure attached (type MappedLines)"""
+    entry = entry_path(filename, store_dir)
+    offsets = (np.load(os.path.join(entry, "line_starts.npy"), mmap_mode='r'), np.load(os.path.join(entry, "line_ends.npy"), mmap_mode='r'))
+    lines = pdblib.MappedLines(os.path.join(entry, "lines.pdb"), offsets)
+    line_index = np.load(os.path.join(entry, "line_index.npy"), mmap_mode='r')
+    columns = {field: np.load(os.path.join(entry, field + ".npy"), mmap_mode='r') for field in pdblib.ATOM_COLUMNS.keys()}
+    lines.structure = pdblib.Structure.from_columns(lines, line_index, columns)
+    return lines
+
+def load_header(filename, store_dir=None):
+    """Returns the header records of a cached PDB file, without opening the copy of the file or any column
+    Inputs:
+    filename - name of the source PDB file (type string)
+    store_dir - folder of the cache (DEFAULT_STORE_DIR if None) (type string)
+    Output:
+    Header lines, or None if the file is not cached (list of strings)"""
+    meta = _read_meta(entry_path(filename, store_dir))
+    return meta["header"] if meta is not None else None
+
+def open_structure(filename, store_dir=None):
+    """Returns the lines and structure of a PDB file, loading them from the cache if the cache entry is current, or
+    parsing the file and saving a new entry otherwise
+    Inputs:
+    filename - name of the source PDB file, plain or compressed (type string)
+    store_dir - folder of the cache (DEFAULT_STORE_DIR if None) (type string)
+    Output:
+    Contents of the file, with its structure attached (type MappedLines or PDBLines)"""
+    if is_current(filename, store_dir):
+        return load_structure(filename, store_dir)
+    lines = pdblib.read_pdb_file(filename)
+    save_structure(filename, lines, store_dir)
+    return lines
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import os
+import subprocess
+import sys
+
+
+"""
+Checks the time taken to import PDBTools.pdblib in a new Python process, measured with python -X importtime, and
+that requests and matplotlib are not imported until they are used. The time checked is PDBTools' own: the import
+of pdblib less the import of numpy, which takes most of the time and depends on the machine more than on PDBTools.
+Exits with status 1 if the best of several imports takes longer than the budget in milliseconds given as the first
+argument (default BUDGET_RATIO times MEASURED_OWN_MS), or if either module is imported. tests/test_import_time.py
+runs the same checks with pytest.
+Run with: python benchmarks/bench_import.py [budget in ms] [repeats]
+"""
+
+# Modules that must only be imported when a file is downloaded or a plot is drawn
+DEFERRED = ("requests", "urllib3", "matplotlib")
+# PDBTools' own import time in milliseconds (best of 5, from cached bytecode) when the budget was last set
+MEASURED_OWN_MS = 20.0
+# Ratio of the measured time above which the import has regressed, so a doubling of the time always fails
+BUDGET_RATIO = 1.5
+
+def import_times(module):
+    """Imports a module in a new Python process, and returns the total time in microseconds taken by each module it
+    imported, from the output of python -X importtime
+    Input:
+    module - name of the module to import (type string)
+    Output:
+    Cumulative import time of each imported module (dictionary of string: int)"""
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # Bytecode is written and used as it would be for an installed package, or every import would compile pdblib
+    environment = dict(os.environ, PYTHONPATH=here)
+    environment.pop("PYTHONDONTWRITEBYTECODE", None)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], cwd=here,
+                            env=environment, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        # Lines look like: "import time:       323 |      13309 |   PDBTools.pdbbatch"
+        if line.startswith("import time:") and not line.rstrip().endswith("imported package"):
+            fields = line[len("import time:"):].split("|")
+            if fields[1].strip().isdigit():
+                times[fields[2].strip()] = int(fields[1])
+    return times
+
+def own_time(times):
+    """Returns the time in milliseconds taken by PDBTools' own modules in one import of pdblib (the time of pdblib
+    less that of numpy), from the result of import_times"""
+    return (times["PDBTools.pdblib"] - times.get("numpy", 0)) / 1000
+
+def deferred_imports(times):
+    """Returns the modules of DEFERRED that were imported, from the result of import_times (list of strings)"""
+    return sorted({name.split(".")[0] for name in times if name.split(".")[0] in DEFERRED})
+
+def timed_imports(repeats):
+    """Imports pdblib once to write its bytecode, then the given number of times more
+    Input:
+    repeats - number of timed imports (type int)
+    Output:
+    Result of import_times for each timed import (list of dictionaries)"""
+    import_times("PDBTools.pdblib")
+    return [import_times("PDBTools.pdblib") for _ in range(repeats)]
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_RATIO * MEASURED_OWN_MS
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    runs = timed_imports(repeats)
+    total = min(times["PDBTools.pdblib"] for times in runs) / 1000
+    best = min(own_time(times) for times in runs)
+    print("Best import of PDBTools.pdblib over {0} runs: {1:.1f} ms, of which PDBTools {2:.1f} ms (budget {3:.1f} ms)".format(repeats, total, best, budget))
+    slowest = sorted(runs[-1].items(), key=lambda item: item[1], reverse=True)
+    print("Slowest modules: " + ", ".join("{0} {1:.1f} ms".format(name, time / 1000) for (name, time) in slowest[1:6]))
+    imported = sorted({name for times in runs for name in deferred_imports(times)})
+    failed = False
+    if imported != []:
+        print("FAIL: modules imported before they are used: " + ", ".join(imported))
+        failed = True
+    if best > budget:
+        print("FAIL: importing the modules of PDBTools took longer than the budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
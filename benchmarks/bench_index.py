@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PDBTools import pdbindex
+
+
+"""
+Measures pdbindex on a corpus made by linking the five files of data.tar.gz again and again under new names, until
+it has the number of files given as the first argument (default 2000): the time to index every file, the time to
+update the index when nothing has changed and when one file has been touched, and the time of each kind of query.
+The number of worker processes can be given as the second argument (default: number of CPUs).
+Run with: python benchmarks/bench_index.py [files] [workers]
+"""
+
+def time_call(function, *args):
+    """Returns the result of one call of the function, and the time in milliseconds it took"""
+    start = time.perf_counter()
+    result = function(*args)
+    return (result, (time.perf_counter() - start) * 1000)
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as work:
+        with tarfile.open(os.path.join(here, "data.tar.gz")) as tar:
+            tar.extractall(work, filter="data")
+        data_dir = os.path.join(work, "data")
+        sources = sorted(os.path.join(data_dir, name) for name in os.listdir(data_dir))
+        corpus = os.path.join(work, "corpus")
+        os.makedirs(corpus)
+        for file_idx in range(files):
+            os.link(sources[file_idx % len(sources)], os.path.join(corpus, "{0:04X}.pdb".format(file_idx)))
+        with pdbindex.StructureIndex(os.path.join(work, "index.sqlite")) as index:
+            (summary, elapsed) = time_call(index.update, corpus, workers)
+            print("index {0} files: {1:.0f} ms ({2:.2f} ms per file)".format(summary["indexed"], elapsed, elapsed / files))
+            (summary, elapsed) = time_call(index.update, corpus, workers)
+            print("update with nothing changed: {0:.1f} ms".format(elapsed))
+            os.utime(os.path.join(corpus, "0000.pdb"))
+            (summary, elapsed) = time_call(index.update, corpus, workers)
+            print("update with one file touched: {0:.1f} ms".format(elapsed))
+            queries = (("find_ligand 1ZK chain A", index.find_ligand, "1ZK", "A"),
+                       ("find_motif PQVTLW", index.find_motif, "PQVTLW"),
+                       ("find_motif G.G..G (regex)", index.find_motif, "G.G..G", True),
+                       ("search title protease", index.search, "title", "protease"),
+                       ("get_entry", index.get_entry, "0001"))
+            for (name, function, *args) in queries:
+                (result, elapsed) = time_call(function, *args)
+                print("{0:<28} {1:>8.2f} ms".format(name, elapsed))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from PDBTools import pdblib
+
+
+"""
+Measures temperature factor plots saved per second: the pyplot path plot_temp_factor used before (a new pyplot
+figure for every plot, every atom drawn), plot_temp_factor now (one reused Agg figure, long chains decimated), and
+plot_temp_factors over a pool of worker processes. Runs on every chain of the files in data.tar.gz, and on a
+synthetic chain with the number of atoms given as the first argument (default 1,000,000).
+Run with: python benchmarks/bench_plot.py [atoms]
+"""
+
+def old_plot_temp_factor(chain_id, height, width, output_filename, lines, pdb_id):
+    """plot_temp_factor before TempFactorPlotter, except that figures are closed so the benchmark does not run out of memory"""
+    (height, width) = (int(height), int(width))
+    structure = pdblib.get_structure(lines)
+    selected = structure.chain_rows(chain_id, ("ATOM",))
+    plt.figure(figsize=(height, width))
+    plt.plot(structure.serial[selected], structure.bfactor[selected].astype(int))
+    plt.title("Line plot of temperature factor of the protein residues for chain {0} of PDB ID {1}".format(chain_id, pdb_id))
+    plt.xlabel("Atom number")
+    plt.ylabel("Temperature factor")
+    plt.savefig(output_filename + ".png")
+    plt.close()
+
+def make_long_chain(atoms, filename):
+    """Writes a PDB file of one chain with the given number of atoms, with varying temperature factors"""
+    with open(filename, 'w') as fobject:
+        for serial in range(atoms):
+            bfactor = 20 + 15 * ((serial * 7919) % 101) / 101
+            fobject.write("ATOM  {0:>5}  CA  ALA A{1:>4}    {2:>8.3f}{3:>8.3f}{4:>8.3f}  1.00{5:>6.2f}           C\n".format(serial % 100000, (serial // 8) % 10000, 0.0, 0.0, 0.0, bfactor))
+        fobject.write("END\n")
+
+def per_second(function, chains):
+    """Returns the figures saved per second (to the current folder) by calling function for every (lines, PDB ID, chain ID)"""
+    start = time.perf_counter()
+    for (lines, pdb_id, chain_id) in chains:
+        function(chain_id, "6", "4", "{0}_{1}".format(pdb_id, chain_id), lines, pdb_id)
+    return len(chains) / (time.perf_counter() - start)
+
+def main():
+    atoms = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as work:
+        with tarfile.open(os.path.join(here, "data.tar.gz")) as tar:
+            tar.extractall(work, filter="data")
+        data_dir = os.path.join(work, "data")
+        filenames = sorted(os.path.join(data_dir, name) for name in os.listdir(data_dir))
+        chains = []
+        for filename in filenames:
+            lines = pdblib.read_pdb_file(filename)
+            pdb_id = os.path.basename(filename).split(".")[0]
+            chains += [(lines, pdb_id, chain_id) for chain_id in pdblib.get_structure(lines).chain_ids(("ATOM",))]
+        long_filename = os.path.join(work, "LONG.pdb")
+        make_long_chain(atoms, long_filename)
+        long_chain = [(pdblib.read_pdb_file(long_filename), "LONG", "A")]
+        pdblib.get_structure(long_chain[0][0])
+        # plot_temp_factor saves to names without folders, so plots are saved in the temporary folder
+        os.chdir(work)
+        # Draw one plot each way first, so both time plots with matplotlib already loaded
+        per_second(old_plot_temp_factor, chains[:1])
+        per_second(pdblib.plot_temp_factor, chains[:1])
+        print("{0:<28} {1:>14} {2:>14}".format("figures per second", "pyplot", "reused Agg"))
+        print("{0:<28} {1:>14.1f} {2:>14.1f}".format("data chains ({0})".format(len(chains)), per_second(old_plot_temp_factor, chains), per_second(pdblib.plot_temp_factor, chains)))
+        print("{0:<28} {1:>14.2f} {2:>14.2f}".format("{0} atom chain".format(atoms), per_second(old_plot_temp_factor, long_chain), per_second(pdblib.plot_temp_factor, long_chain)))
+        # The pool reads and plots each file in a worker, so reading is included in this time
+        for workers in sorted({1, os.cpu_count() or 1}):
+            start = time.perf_counter()
+            saved = pdblib.plot_temp_factors(filenames * 4, output_dir=work, workers=workers)
+            print("{0:<28} {1:>14.1f}".format("plot_temp_factors, {0} workers".format(workers), len(saved) / (time.perf_counter() - start)))
+        os.chdir(here)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PDBTools import pdblib, pdbprofile
+
+
+"""
+Measures the cost of the pdbprofile instrumentation for each call of an instrumented function: the function called
+directly (without its wrapper), through its wrapper with profiling turned off, and with profiling turned on. It is
+measured on a function that does nothing, so the cost of the wrapper is not hidden by the work done, and on
+get_all_prot_sequences of 1HIV.pdb from data.tar.gz (already parsed), a quick query. The number of calls is given as the
+first argument (default 100000).
+Run with: python benchmarks/bench_profile.py [calls]
+"""
+
+def time_calls(function, calls, *args):
+    """Returns the mean time in microseconds taken by a call of the function"""
+    start = time.perf_counter()
+    for _ in range(calls):
+        function(*args)
+    return (time.perf_counter() - start) / calls * 1e6
+
+@pdbprofile.timed("query")
+def nothing(lines):
+    """Does nothing, so only the cost of the wrapper is measured"""
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    lines = [line for (name, pdb_id, lines) in pdblib.iter_tar_pdbs(os.path.join(here, "data.tar.gz")) if pdb_id == "1HIV" for line in lines]
+    lines = pdblib.PDBLines(lines)
+    pdblib.get_structure(lines)
+    print("{0:<24} {1:>12} {2:>16} {3:>15}".format("function", "direct (us)", "profile off (us)", "profile on (us)"))
+    for (name, function, repeats) in (("nothing", nothing, calls), ("get_all_prot_sequences", pdblib.get_all_prot_sequences, calls // 100)):
+        direct = time_calls(function.__wrapped__, repeats, lines)
+        pdbprofile.disable()
+        disabled = time_calls(function, repeats, lines)
+        pdbprofile.enable()
+        enabled = time_calls(function, repeats, lines)
+        pdbprofile.disable()
+        print("{0:<24} {1:>12.3f} {2:>16.3f} {3:>15.3f}".format(name, direct, disabled, enabled))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PDBTools import pdblib
+
+
+"""
+Compares three ways of getting the protein sequence of every chain: scanning every line for "CA" once per chain (as
+get_prot_residues first did), selecting the "CA" atoms of each chain from the parsed structure (as
+get_fasta_protseqs did before get_all_prot_sequences), and get_all_prot_sequences, which finds every residue of every
+chain in one pass. The time to parse the structure, which the last two share and is done once per file, is shown
+separately. Runs on the files in data.tar.gz, timing each the number of times given as the first argument (default 20).
+Run with: python benchmarks/bench_sequences.py [repeats]
+"""
+
+def old_prot_residues(chain_id, lines):
+    """get_prot_residues before get_all_prot_sequences: one scan of every line for each chain"""
+    prot_res = ""
+    for line in lines:
+        if line.startswith("ATOM") and (line[21] == chain_id) and ("CA" in line):
+            prot_res += pdblib.PROTEIN_CODES.get(line[17:20], "X")
+    return prot_res
+
+def old_all_sequences(lines):
+    """Chain IDs found by one scan, then the sequence of each chain by another scan each"""
+    chain_ids = []
+    for line in lines:
+        if line.startswith("ATOM") and (line[21] not in chain_ids):
+            chain_ids.append(line[21])
+    return {chain_id: old_prot_residues(chain_id, lines) for chain_id in chain_ids}
+
+def chain_all_sequences(lines):
+    """Chain IDs from the parsed structure, then the "CA" atoms of each chain selected from it"""
+    structure = pdblib.get_structure(lines)
+    sequences = {}
+    for chain_id in structure.chain_ids(("ATOM",)):
+        rows = structure.chain_rows(chain_id, ("ATOM",))
+        selected = rows[structure.name[rows] == "CA"]
+        sequences[chain_id] = "".join([pdblib.PROTEIN_CODES.get(aa_three_code, "X") for aa_three_code in structure.resname[selected]])
+    return sequences
+
+def parse(lines):
+    """Parses the lines into a new structure"""
+    return pdblib.Structure(lines)
+
+def time_call(function, repeats, *args):
+    """Returns the mean time in seconds taken by a call of the function"""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function(*args)
+    return (time.perf_counter() - start) / repeats
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as work:
+        with tarfile.open(os.path.join(here, "data.tar.gz")) as tar:
+            tar.extractall(work, filter="data")
+        data_dir = os.path.join(work, "data")
+        print("{0:<10} {1:>7} {2:>10} {3:>10} {4:>10} {5:>10} {6:>9}".format("file", "chains", "text (ms)", "parse (ms)", "chain (ms)", "pass (ms)", "differs"))
+        for name in sorted(os.listdir(data_dir)):
+            lines = pdblib.read_pdb_file(os.path.join(data_dir, name))
+            text = time_call(old_all_sequences, repeats, list(lines))
+            parsing = time_call(parse, repeats, lines)
+            pdblib.get_structure(lines)
+            chain = time_call(chain_all_sequences, repeats, lines)
+            single = time_call(pdblib.get_all_prot_sequences, repeats, lines)
+            # Chains whose sequence changed, from residues counted twice or "CA" found elsewhere in a line
+            old_sequences = old_all_sequences(lines)
+            new_sequences = pdblib.get_all_prot_sequences(lines)
+            differs = [chain_id for chain_id in old_sequences if old_sequences[chain_id] != new_sequences.get(chain_id)]
+            print("{0:<10} {1:>7} {2:>10.2f} {3:>10.2f} {4:>10.3f} {5:>10.3f} {6:>9}".format(name, len(new_sequences), text * 1000, parsing * 1000, chain * 1000, single * 1000, ",".join(differs) or "-"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from PDBTools import pdblib, pdbstore
+
+
+"""
+Compares opening a PDB file by parsing its text (cold) with opening its saved structure from pdbstore (warm).
+Runs on the files in data.tar.gz and on a synthetic file made by repeating the atoms of 5Y42 until it has at least
+the number of atoms given as the first argument (default 1,000,000).
+Run with: python benchmarks/bench_store.py [atoms]
+"""
+
+def make_giant(source_lines, atoms, filename):
+    """Writes a PDB file with at least the given number of atoms, by repeating the coordinate lines of a structure"""
+    atom_lines = [line for line in source_lines if line.startswith(("ATOM", "HETATM"))]
+    header = [line for line in source_lines if line.startswith(("HEADER", "TITLE", "COMPND", "SOURCE"))]
+    repeats = -(-atoms // len(atom_lines))
+    with open(filename, 'w') as fobject:
+        fobject.write("\n".join(header) + "\n")
+        for _ in range(repeats):
+            fobject.write("\n".join(atom_lines) + "\n")
+        fobject.write("END\n")
+
+def time_call(function, *args):
+    """Returns the time in seconds taken by one call of the function"""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def main():
+    atoms = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as work:
+        with tarfile.open(os.path.join(here, "data.tar.gz")) as tar:
+            tar.extractall(work, filter="data")
+        data_dir = os.path.join(work, "data")
+        filenames = sorted(os.path.join(data_dir, name) for name in os.listdir(data_dir))
+        giant = os.path.join(work, "giant.pdb")
+        make_giant(pdblib.read_pdb_file(os.path.join(data_dir, "5Y42.pdb")), atoms, giant)
+        filenames.append(giant)
+        store_dir = os.path.join(work, "store")
+        print("{0:<12} {1:>10} {2:>12} {3:>12} {4:>9}".format("file", "atoms", "cold (s)", "warm (s)", "speedup"))
+        for filename in filenames:
+            cold = time_call(lambda: pdblib.get_structure(pdblib.read_pdb_file(filename)))
+            # The first open saves the entry; the second opens it
+            pdbstore.open_structure(filename, store_dir)
+            warm = time_call(lambda: pdblib.get_structure(pdbstore.open_structure(filename, store_dir)))
+            atom_count = len(pdblib.get_structure(pdbstore.open_structure(filename, store_dir)))
+            print("{0:<12} {1:>10} {2:>12.4f} {3:>12.4f} {4:>8.1f}x".format(os.path.basename(filename), atom_count, cold, warm, cold / warm))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+
+import argparse
+import contextlib
+import datetime
+import gzip
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+import numpy as np
+from PDBTools import pdblib, pdbscan
+
+
+"""
+Benchmark suite for pdblib. Every public pdblib function that reads, parses, queries, alters, writes or plots a whole
+structure is run (small helpers, such as the chain ID checks, parse_atom_line, centroid and the profiling functions,
+are only timed through the functions that use them) on the five structures in data.tar.gz (1AA6, 1BKX, 1C6Y, 1HIV,
+5Y42) and on synthetic structures made by repeating the chains of 5Y42 (shifted so that copies do not
+overlap) until they have 10^4, 10^5 and 10^6 atoms (or the sizes given with --sizes, up to 10^7). Each function is run
+on each structure in its own process, and the wall time (best and mean of --repeats runs, after one run to warm up),
+the peak resident memory of the process, and the peak memory allocated during one run (traced with tracemalloc) are
+recorded.
+
+Results can be saved as a baseline, by default to benchmarks/baselines/<commit>-<host>-py<version>.json, and two sets
+of results compared to find the functions that became slower or used more memory between commits. Timings are only
+comparable on the same machine and Python, so baselines are kept locally (the folder is not committed): save one
+before a change and compare against it after, and compare warns when the two runs were made on different machines. Benchmarks with no result in
+the older set fail the comparison too, so the baseline is saved again whenever a benchmark is added.
+
+Run with:
+python benchmarks/run_benchmarks.py run [--sizes 10000,100000,1000000] [--repeats 3] [--only name,...] [--save [file]]
+python benchmarks/run_benchmarks.py compare old.json [new.json] [--threshold 1.25]
+(compare with one file runs the benchmarks again to compare against it)
+"""
+
+# Folder baselines are saved to
+BASELINE_DIR = os.path.join(HERE, "baselines")
+# Folder synthetic structures are kept in between runs, as the largest take a while to write
+GIANT_DIR = os.path.join(tempfile.gettempdir(), "pdbtools-bench")
+# Sizes of the synthetic structures used if none are given
+DEFAULT_SIZES = (10000, 100000, 1000000)
+# Version of the layout of the synthetic structures, part of their file names so that files kept from a run with an
+# older layout are written again
+GIANT_VERSION = 2
+# Number of copies of the structure placed along x before starting a new row along y, so that every coordinate fits
+# in its 8 columns (up to 9999.999) even with 10^7 atoms
+GIANT_ROW = 90
+# Chain IDs given to the copies of the chains of the synthetic structures, in order
+GIANT_CHAIN_IDS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+# Every detail print_details is used for by checkPDB.py
+DETAILS = ("HEADER", "TITLE", "SOURCE", "KEYWDS", "AUTHOR", "REMARK   2 RESOLUTION.", "JRNL        TITL")
+
+class Context:
+    """What each benchmark is run on: one structure, already read and parsed, in a folder the benchmark can write to
+    Attributes:
+    pdb_id - name of the structure, which is also the name of its file without extension (type string)
+    path, gz_path - the plain and gzip-compressed file (type string)
+    tar_path - a tar file holding the gzip-compressed file (type string)
+    lines - contents of the file, with the structure parsed (type PDBLines)
+    mapped - the memory-mapped file, with the structure parsed (type MappedLines)
+    chain - first chain with protein residues (type string)
+    ligand - residue name of the first HETATM residue that is not water, or HOH if there is none (type string)
+    sequence - protein sequences of every chain, joined (type string)
+    mapping - chain IDs to alter: the first two chains swapped, or the first chain altered to z if there is one chain
+    (dictionary of string: string)
+    inplace_path - a copy of the file that can be altered (type string)"""
+
+    def __init__(self, pdb_id, directory):
+        self.pdb_id = pdb_id
+        self.path = os.path.join(directory, pdb_id + ".pdb")
+        self.gz_path = os.path.join(directory, pdb_id + ".pdb.gz")
+        self.tar_path = os.path.join(directory, pdb_id + ".tar")
+        self.lines = pdblib.read_pdb_file(self.path)
+        self.mapped = pdblib.MappedLines(self.path)
+        pdblib.get_structure(self.mapped)
+        chain_ids = pdblib.get_structure(self.lines).chain_ids()
+        self.chain = pdblib.get_structure(self.lines).chain_ids(("ATOM",))[0]
+        ligand_rows = pdblib.get_structure(self.lines).ligand_rows()
+        self.ligand = str(pdblib.get_structure(self.lines).resname[ligand_rows[0]]) if len(ligand_rows) > 0 else "HOH"
+        self.sequence = "".join(pdblib.get_all_prot_sequences(self.lines).values())
+        self.mapping = {chain_ids[0]: chain_ids[1], chain_ids[1]: chain_ids[0]} if len(chain_ids) > 1 else {self.chain: "z"}
+        self.inplace_path = os.path.join(directory, "inplace.pdb")
+        shutil.copy(self.path, self.inplace_path)
+
+# Each benchmark, by name: the function run, given a Context. Queries are timed on lines that are already parsed;
+# reading and parsing are timed by their own benchmarks.
+CASES = {
+    "read_pdb_file": lambda ctx: pdblib.read_pdb_file(ctx.path),
+    "read_pdb_file_gz": lambda ctx: pdblib.read_pdb_file(ctx.gz_path),
+    "iter_tar_pdbs": lambda ctx: sum(1 for member in pdblib.iter_tar_pdbs(ctx.tar_path)),
+    "download_pdb_local": lambda ctx: pdblib.download_pdb(ctx.pdb_id),
+    "download_pdb_mapped": lambda ctx: pdblib.download_pdb(ctx.pdb_id, mapped=True),
+    "download_many_local": lambda ctx: pdblib.download_many([ctx.pdb_id], workers=1, directory="."),
+    "MappedLines": lambda ctx: pdblib.MappedLines(ctx.path),
+    "Structure": lambda ctx: pdblib.Structure(ctx.lines),
+    "Structure_mapped": lambda ctx: pdblib.Structure(ctx.mapped),
+    "Header": lambda ctx: pdblib.Header(ctx.lines),
+    "read_header": lambda ctx: pdblib.read_header(ctx.path),
+    "get_models": lambda ctx: pdblib.get_models(ctx.lines),
+    "print_details": lambda ctx: pdblib.print_details({detail: "" for detail in DETAILS}, ctx.lines),
+    "format_80": lambda ctx: pdblib.format_80(ctx.sequence),
+    "get_prot_residues": lambda ctx: pdblib.get_prot_residues(ctx.chain, ctx.lines),
+    "get_all_prot_sequences": lambda ctx: pdblib.get_all_prot_sequences(ctx.lines),
+    "print_prot_residues": lambda ctx: pdblib.print_prot_residues(ctx.chain, ctx.lines),
+    "get_fasta_protseqs": lambda ctx: pdblib.get_fasta_protseqs("bench", "", ctx.lines),
+    "get_residue_lines": lambda ctx: pdblib.get_residue_lines(ctx.chain, ["ATOM", "HETATM"], ctx.lines),
+    "get_chain_residues": lambda ctx: pdblib.get_chain_residues(ctx.chain, "both", "bench", "w", ctx.lines),
+    "alter_chain_id": lambda ctx: pdblib.alter_chain_id(ctx.chain, "z", ctx.lines, "bench"),
+    "remap_chains": lambda ctx: pdblib.remap_chains(ctx.mapping, ctx.lines, "bench"),
+    "remap_chains_in_place": lambda ctx: pdblib.remap_chains_in_place(ctx.mapping, ctx.inplace_path),
+    "print_nonstandard_residues": lambda ctx: pdblib.print_nonstandard_residues(ctx.lines),
+    "temp_factor_points": lambda ctx: pdblib.temp_factor_points(ctx.chain, ctx.lines),
+    "residue_temp_factors": lambda ctx: pdblib.residue_temp_factors(ctx.lines),
+    "chain_temp_factors": lambda ctx: pdblib.chain_temp_factors(ctx.lines),
+    "SpatialGrid": lambda ctx: pdblib.SpatialGrid(pdblib.get_structure(ctx.lines).coords),
+    "atoms_within_ligands": lambda ctx: pdblib.atoms_within(pdblib.get_structure(ctx.lines).ligand_rows(), 5.0, ctx.lines),
+    "contacts_ligands": lambda ctx: pdblib.contacts(pdblib.get_structure(ctx.lines).ligand_rows(), None, 4.0, ctx.lines),
+    "get_coords": lambda ctx: pdblib.get_coords(ctx.lines, ctx.chain, ("CA",)),
+    "get_binding_residues": lambda ctx: pdblib.get_binding_residues(ctx.ligand, 5.0, ctx.lines),
+    "get_center_of_mass": lambda ctx: pdblib.get_center_of_mass(ctx.lines),
+    "get_radius_of_gyration": lambda ctx: pdblib.get_radius_of_gyration(ctx.lines),
+    "rmsd": lambda ctx: pdblib.rmsd(pdblib.get_coords(ctx.lines, ctx.chain), pdblib.get_coords(ctx.lines, ctx.chain)[::-1]),
+    "superpose_1000": lambda ctx: pdblib.superpose(pdblib.get_coords(ctx.lines, ctx.chain, ("CA",)), np.repeat(pdblib.get_coords(ctx.lines, ctx.chain, ("CA",))[np.newaxis], 1000, axis=0)),
+    "Models_coords": lambda ctx: pdblib.Models(ctx.lines).coords(names=("CA",)),
+    "compile_selection": lambda ctx: pdblib.compile_selection("chain A and resname HIS PRO and resseq 10:50 and name CA")(pdblib.get_structure(ctx.lines)),
+    "select": lambda ctx: pdblib.select("chain {0} and name CA".format(ctx.chain), ctx.lines),
+    "select_within": lambda ctx: pdblib.compile_selection("protein and within 5 of ligand")(pdblib.get_structure(ctx.lines)),
+    "scan_file": lambda ctx: pdbscan.scan_file(ctx.pdb_id + ".pdb", ctx.path),
+    "scan_file_gz": lambda ctx: pdbscan.scan_file(ctx.pdb_id + ".pdb.gz", ctx.gz_path),
+    "plot_temp_factor": lambda ctx: pdblib.plot_temp_factor(ctx.chain, "6", "4", "bench_plot", ctx.lines, ctx.pdb_id),
+    "plot_temp_factor_residues": lambda ctx: pdblib.plot_temp_factor(ctx.chain, "6", "4", "bench_plot", ctx.lines, ctx.pdb_id, per_residue=True),
+    "plot_temp_factors": lambda ctx: pdblib.plot_temp_factors([ctx.path], workers=1),
+    "decimate_min_max": lambda ctx: pdblib.decimate_min_max(*pdblib.temp_factor_points(ctx.chain, ctx.lines), 2000),
+    "iter_records": lambda ctx: sum(1 for record in pdblib.iter_records(ctx.path)),
+    "stream_prot_residues": lambda ctx: pdblib.stream_prot_residues(ctx.path),
+    "stream_fasta_protseqs": lambda ctx: pdblib.stream_fasta_protseqs(ctx.path, "bench_stream.fasta"),
+    "stream_residue_lines": lambda ctx: pdblib.stream_residue_lines(ctx.chain, ["ATOM", "HETATM"], ctx.path, "bench_stream.txt"),
+    "stream_alter_chain_id": lambda ctx: pdblib.stream_alter_chain_id(ctx.chain, "z", ctx.path, "bench_stream.pdb"),
+    "stream_remap_chains": lambda ctx: pdblib.stream_remap_chains(ctx.mapping, ctx.path, "bench_stream.pdb"),
+}
+
+def run_case(name, pdb_id, directory, repeats):
+    """Runs one benchmark on one structure, in this process (see main_case)
+    Inputs:
+    name - name of the benchmark in CASES (type string)
+    pdb_id - name of the structure (type string)
+    directory - folder holding the structure's files, which the benchmark writes to (type string)
+    repeats - number of timed runs (type int)
+    Output:
+    Results, with the keys best_s, mean_s, setup_rss_mb, peak_rss_mb and alloc_peak_mb (type dictionary)"""
+    os.chdir(directory)
+    ctx = Context(pdb_id, directory)
+    function = CASES[name]
+    setup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        # One run first, so modules imported on first use (e.g. matplotlib) are not timed
+        function(ctx)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            function(ctx)
+            times.append(time.perf_counter() - start)
+        # Allocations are traced on a separate run, as tracing slows everything down
+        tracemalloc.start()
+        function(ctx)
+        alloc_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {"best_s": min(times), "mean_s": sum(times) / len(times), "setup_rss_mb": setup_rss * unit / 2 ** 20,
+            "peak_rss_mb": peak_rss * unit / 2 ** 20, "alloc_peak_mb": alloc_peak / 2 ** 20}
+
+def make_giant(source_lines, atoms, filename):
+    """Writes a synthetic PDB file with at least the given number of atoms, by repeating the chains of a structure.
+    Each copy of a chain gets the next chain ID of GIANT_CHAIN_IDS, and each copy of the whole structure is moved 100
+    Angstroms along x (starting a new row 150 Angstroms along y after GIANT_ROW copies), so copies do not overlap and
+    coordinates fit in their columns, and atom serial numbers continue across copies (wrapping at 100000, as the
+    column has 5 digits).
+    Inputs:
+    source_lines - lines of the structure to copy (list of strings)
+    atoms - smallest number of atoms (type int)
+    filename - name of the file to write (type string)"""
+    structure = pdblib.Structure(source_lines)
+    chains = [structure.chain_rows(chain_id) for chain_id in structure.chain_ids()]
+    header = [line for line in source_lines if line.startswith(("HEADER", "TITLE", "COMPND", "SOURCE", "KEYWDS", "EXPDTA", "AUTHOR", "REMARK   2"))]
+    temp_filename = filename + ".part"
+    with open(temp_filename, 'w') as fobject:
+        fobject.write("\n".join(header) + "\n")
+        (written, copy) = (0, 0)
+        while written < atoms:
+            rows = chains[copy % len(chains)]
+            chain_id = GIANT_CHAIN_IDS[copy % len(GIANT_CHAIN_IDS)]
+            (row, column) = divmod(copy // len(chains), GIANT_ROW)
+            serials = (written + np.arange(len(rows))) % 100000
+            xs = structure.x[rows] + 100.0 * column
+            ys = structure.y[rows] + 150.0 * row
+            block = []
+            for (line, serial, x, y) in zip(structure.get_lines(rows), serials.tolist(), xs.tolist(), ys.tolist()):
+                line = line.ljust(80)
+                block.append("{0}{1:>5}{2}{3}{4}{5:>8.3f}{6:>8.3f}{7}".format(line[:6], serial, line[11:21], chain_id, line[22:30], x, y, line[46:80]))
+            block.append("TER")
+            fobject.write("\n".join(block) + "\n")
+            written += len(rows)
+            copy += 1
+        fobject.write("END\n")
+    os.replace(temp_filename, filename)
+
+def prepare_inputs(work, sizes):
+    """Puts every structure to benchmark in its own folder in work, as <name>.pdb, <name>.pdb.gz and <name>.tar
+    Inputs:
+    work - folder to use (type string)
+    sizes - numbers of atoms of the synthetic structures (list of ints)
+    Output:
+    (name, folder) of each structure (list of tuples)"""
+    inputs = []
+    with tarfile.open(os.path.join(ROOT, "data.tar.gz")) as tar:
+        tar.extractall(work, filter="data")
+    data_dir = os.path.join(work, "data")
+    sources = {}
+    for name in sorted(os.listdir(data_dir)):
+        pdb_id = name.split(".")[0]
+        sources[pdb_id] = os.path.join(data_dir, name)
+    os.makedirs(GIANT_DIR, exist_ok=True)
+    for atoms in sizes:
+        pdb_id = "G{0}".format(atoms)
+        giant = os.path.join(GIANT_DIR, "{0}-v{1}.pdb".format(pdb_id, GIANT_VERSION))
+        if not os.path.isfile(giant):
+            print("Writing synthetic structure with {0} atoms...".format(atoms), file=sys.stderr)
+            make_giant(pdblib.read_pdb_file(sources["5Y42"]), atoms, giant)
+        sources[pdb_id] = giant
+    for (pdb_id, source) in sources.items():
+        directory = os.path.join(work, "inputs", pdb_id)
+        os.makedirs(directory)
+        shutil.copy(source, os.path.join(directory, pdb_id + ".pdb"))
+        with open(source, 'rb') as in_fobject, gzip.open(os.path.join(directory, pdb_id + ".pdb.gz"), 'wb', compresslevel=6) as out_fobject:
+            shutil.copyfileobj(in_fobject, out_fobject, 1 << 20)
+        with tarfile.open(os.path.join(directory, pdb_id + ".tar"), 'w') as tar:
+            tar.add(os.path.join(directory, pdb_id + ".pdb.gz"), arcname=pdb_id + ".pdb.gz")
+        inputs.append((pdb_id, directory))
+    return inputs
+
+def git_commit():
+    """Returns the short hash of the current commit, ending in -dirty if pdblib has uncommitted changes, or 'unknown'"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        changed = subprocess.run(["git", "status", "--porcelain", "PDBTools"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return commit + ("-dirty" if changed != "" else "")
+
+def run_all(sizes, repeats, only):
+    """Runs every benchmark on every structure, each in a new process, printing the results as they finish
+    Inputs:
+    sizes - numbers of atoms of the synthetic structures (list of ints)
+    repeats - number of timed runs of each benchmark (type int)
+    only - names of the benchmarks to run, or None for all (list of strings)
+    Output:
+    Results and details of the run (type dictionary)"""
+    names = [name for name in CASES if (only is None) or (name in only)]
+    results = {}
+    with tempfile.TemporaryDirectory() as work:
+        inputs = prepare_inputs(work, sizes)
+        print("{0:<28} {1:<9} {2:>11} {3:>11} {4:>10} {5:>10}".format("benchmark", "structure", "best (ms)", "mean (ms)", "RSS (MB)", "alloc (MB)"))
+        for name in names:
+            for (pdb_id, directory) in inputs:
+                process = subprocess.run([sys.executable, os.path.abspath(__file__), "_case", name, pdb_id, directory, str(repeats)],
+                                         capture_output=True, text=True)
+                if process.returncode != 0:
+                    error = (process.stderr.strip().splitlines() or ["failed"])[-1]
+                    print("{0:<28} {1:<9} failed: {2}".format(name, pdb_id, error))
+                    continue
+                result = json.loads(process.stdout.strip().splitlines()[-1])
+                results["{0}@{1}".format(name, pdb_id)] = result
+                print("{0:<28} {1:<9} {2:>11.3f} {3:>11.3f} {4:>10.1f} {5:>10.2f}".format(name, pdb_id, result["best_s"] * 1000, result["mean_s"] * 1000, result["peak_rss_mb"], result["alloc_peak_mb"]))
+    meta = {"commit": git_commit(), "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "host": platform.node(), "python": platform.python_version(), "implementation": platform.python_implementation(),
+            "numpy": np.__version__, "machine": platform.platform(), "cpus": os.cpu_count(), "sizes": list(sizes),
+            "repeats": repeats}
+    return {"meta": meta, "results": results}
+
+# Details of the machine and Python of a run that must match for two runs to be compared
+ENVIRONMENT_KEYS = ("host", "python", "implementation", "numpy", "machine", "cpus")
+
+def compare(old, new, threshold):
+    """Prints the benchmarks whose best time or peak memory grew by more than the threshold between two runs, and
+    the benchmarks of the new run that have no result in the old run (which count as failures, as nothing checks them
+    until the old results are saved again)
+    Inputs:
+    old, new - results of two runs (type dictionary)
+    threshold - ratio of new to old above which a benchmark has regressed (type float)
+    Output:
+    Number of regressions and benchmarks without an old result (type int)"""
+    print("Comparing {0} ({1}) with {2} ({3})".format(old["meta"]["commit"], old["meta"]["date"], new["meta"]["commit"], new["meta"]["date"]))
+    # Timings from another machine or Python differ for reasons that have nothing to do with the change
+    different = [key for key in ENVIRONMENT_KEYS if old["meta"].get(key) != new["meta"].get(key)]
+    if different != []:
+        print("WARNING: the runs differ in {0}, so differences in time or memory may not be regressions".format(
+              ", ".join("{0} ({1} and {2})".format(key, old["meta"].get(key), new["meta"].get(key)) for key in different)))
+    print("{0:<38} {1:>11} {2:>11} {3:>8} {4:>8}".format("benchmark", "old (ms)", "new (ms)", "time", "RSS"))
+    regressions = 0
+    for key in sorted(set(old["results"]) & set(new["results"])):
+        (before, after) = (old["results"][key], new["results"][key])
+        time_ratio = after["best_s"] / max(before["best_s"], 1e-9)
+        # Memory is compared beyond what the process used before running the benchmark
+        rss_ratio = max(after["peak_rss_mb"] - after["setup_rss_mb"], 1) / max(before["peak_rss_mb"] - before["setup_rss_mb"], 1)
+        flag = ""
+        if (time_ratio > threshold) or (rss_ratio > threshold):
+            flag = "  REGRESSION"
+            regressions += 1
+        print("{0:<38} {1:>11.3f} {2:>11.3f} {3:>7.2f}x {4:>7.2f}x{5}".format(key, before["best_s"] * 1000, after["best_s"] * 1000, time_ratio, rss_ratio, flag))
+    print("{0} regressions beyond {1:.2f}x".format(regressions, threshold))
+    # Benchmarks added since the old results were saved
+    unmatched = sorted(set(new["results"]) - set(old["results"]))
+    for key in unmatched:
+        print("{0:<38} {1:>11} {2:>11.3f}  NO BASELINE".format(key, "-", new["results"][key]["best_s"] * 1000))
+    if unmatched != []:
+        print("{0} benchmarks have no result in {1}; save a new baseline with: run --save".format(len(unmatched), old["meta"]["commit"]))
+    return regressions + len(unmatched)
+
+def main_case(argv):
+    """Runs one benchmark in this process and prints its results as JSON (used by run_all)"""
+    (name, pdb_id, directory, repeats) = argv
+    print(json.dumps(run_case(name, pdb_id, directory, int(repeats))))
+
+def main():
+    if sys.argv[1:2] == ["_case"]:
+        return main_case(sys.argv[2:])
+    parser = argparse.ArgumentParser(description="Benchmark suite for pdblib")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    options = argparse.ArgumentParser(add_help=False)
+    options.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES), help="atoms in each synthetic structure, separated by commas (default: 10000,100000,1000000)")
+    options.add_argument("--repeats", type=int, default=3, help="timed runs of each benchmark (default: 3)")
+    options.add_argument("--only", help="names of the benchmarks to run, separated by commas (default: all)")
+    run = subparsers.add_parser("run", parents=[options], help="run the benchmarks")
+    run.add_argument("--save", nargs="?", const="", help="save the results, to benchmarks/baselines/<commit>-<host>-py<version>.json unless a file is given")
+    compare_parser = subparsers.add_parser("compare", parents=[options], help="compare saved results")
+    compare_parser.add_argument("old", help="saved results to compare against")
+    compare_parser.add_argument("new", nargs="?", help="saved results to compare (if not given, the benchmarks are run now)")
+    compare_parser.add_argument("--threshold", type=float, default=1.25, help="ratio above which a benchmark has regressed (default: 1.25)")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip() != ""]
+    only = args.only.split(",") if args.only else None
+    if args.command == "run":
+        results = run_all(sizes, args.repeats, only)
+        if args.save is not None:
+            meta = results["meta"]
+            filename = args.save or os.path.join(BASELINE_DIR, "{0}-{1}-py{2}.json".format(meta["commit"], meta["host"] or "unknown", meta["python"]))
+            os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+            with open(filename, 'w') as fobject:
+                json.dump(results, fobject, indent=1, sort_keys=True)
+            print("Saved results to {0}".format(filename))
+        return 0
+    with open(args.old, 'r') as fobject:
+        old = json.load(fobject)
+    if args.new is not None:
+        with open(args.new, 'r') as fobject:
+            new = json.load(fobject)
+    else:
+        new = run_all(old["meta"]["sizes"], args.repeats, only)
+    return 1 if compare(old, new, args.threshold) > 0 else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
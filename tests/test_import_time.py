@@ -0,0 +1,29 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import bench_import
+
+
+"""
+Checks that importing PDBTools.pdblib stays fast and does not import requests, urllib3 or matplotlib, by importing
+it in new Python processes with python -X importtime (see benchmarks/bench_import.py, which runs the same checks).
+Run with: python -m pytest tests
+"""
+
+@pytest.fixture(scope="module")
+def runs():
+    """Timed imports of pdblib, made once for every test as each takes a new Python process"""
+    return bench_import.timed_imports(5)
+
+def test_deferred_modules_not_imported(runs):
+    """requests, urllib3 and matplotlib are only imported when a file is downloaded or a plot is drawn"""
+    for times in runs:
+        assert bench_import.deferred_imports(times) == []
+
+def test_import_time_within_budget(runs):
+    """The best of five imports of PDBTools' own modules is no slower than BUDGET_RATIO times the measured time"""
+    best = min(bench_import.own_time(times) for times in runs)
+    budget = bench_import.BUDGET_RATIO * bench_import.MEASURED_OWN_MS
+    assert best <= budget, "PDBTools took {0:.1f} ms to import, over the budget of {1:.1f} ms".format(best, budget)